@@ -3,9 +3,19 @@ import matplotlib.pyplot as plt
 import numpy as np
 import sqlite3
 
-PROBLEM_COL_START_IDX = 2 
-PROBLEM_COL_END_IDX = 6   
-IS_SAT_COL_IDX = 6   
+PROBLEM_COLUMNS = ('grid', 'idx', 'try_Val', 'assert_equals')
+
+
+def encoding_columns(column_names):
+    '''The constraint (encoding) columns, e.g. is_classic, in table order.'''
+    return [name for name in column_names if name.startswith('is_') and name != 'is_sat']
+
+
+def solver_names(column_names):
+    '''The solvers that have <solver>_time, <solver>_is_timeout and <solver>_state columns, in table order.'''
+    return [name[:-len('_time')] for name in column_names if name.endswith('_time')
+            and f"{name[:-len('_time')]}_is_timeout" in column_names
+            and f"{name[:-len('_time')]}_state" in column_names]
 
 class ConstraintPlotter:
     def __init__(self, file_path):
@@ -34,8 +44,10 @@ class ConstraintPlotter:
         self.grid = grid
 
     def _parse_data(self):
-        '''Parses the SQLite database and organizes the data into a structured format.'''
+        '''Parses the SQLite database and organizes the data into a structured format. The columns are read by
+        name, so the solver order of the table does not matter.'''
         conn = sqlite3.connect(self.file_path)
+        conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         cursor.execute("""
             SELECT name, type FROM sqlite_master 
@@ -43,20 +55,18 @@ class ConstraintPlotter:
         """)
         tables = cursor.fetchall()
         table_name = tables[0][0]
-        cursor.execute('SELECT instance_id FROM '+table_name)
-        instances = cursor.fetchall()
+        column_names = [col[1] for col in cursor.execute(f'PRAGMA table_info({table_name})').fetchall()]
+        constraints = encoding_columns(column_names)
+        solvers = solver_names(column_names)
         output = {}
-        for i in range(instances[-1][0]+1):
-            cursor.execute('SELECT * FROM '+table_name+' WHERE instance_id='+str(i))
-            data = cursor.fetchall()
-            output[i] = {'problem':{'grid':data[0][PROBLEM_COL_START_IDX:PROBLEM_COL_END_IDX], 
-                                    #'index':data[0][3].split(', '),
-                                    #'try Val':data[0][4],
-                                    #'assert equals':data[0][5],
-                                    'is sat':data[0][IS_SAT_COL_IDX]}
-                                    }
-            for j in range(len(data)):
-                output[i][(data[j][7],data[j][8],data[j][9],data[j][10],data[j][11])] = {'cvc5':(data[j][12],data[j][13],data[j][14]),'z3':(data[j][15],data[j][16],data[j][17])}
+        for row in cursor.execute(f'SELECT * FROM {table_name} ORDER BY instance_id, ID').fetchall():
+            if row['instance_id'] not in output:
+                output[row['instance_id']] = {'problem': {'grid': tuple(row[name] for name in PROBLEM_COLUMNS),
+                                                          'is sat': row['is_sat']}}
+            output[row['instance_id']][tuple(row[name] for name in constraints)] = {
+                solver: (row[f'{solver}_time'], row[f'{solver}_is_timeout'], row[f'{solver}_state'])
+                for solver in solvers}
+        conn.close()
         parse_data = list(output.values())
         return parse_data
     def list_columns(self):
@@ -90,7 +100,7 @@ class ConstraintPlotter:
         columns = cursor.fetchall()
         column_names = [col[1] for col in columns]
         output = {}
-        for idx, name in enumerate(column_names[PROBLEM_COL_END_IDX+1: -6]): # {from (is_sat +1) to (cvc5_time -1).
+        for idx, name in enumerate(encoding_columns(column_names)):
             output[idx] = name
         print(output)
         return output
@@ -200,7 +210,7 @@ class ConstraintPlotter:
 
         ax.plot([0, self.x_max], [0, self.y_max], self.line_style)
         
-        # Use idx2name to get the constraint name. This is soft code as idx2name is parsed from the database by taking idxs from PROBLEM_COL_END_IDX+1 to -6.
+        # Use idx2name to get the constraint name, the encoding columns of the database in table order.
         name = self.idx2name[constraint_idx]
 
         ax.set_title(f'Time Comparison: Constraint {name} - {solver}')
@@ -6,22 +6,94 @@
 #   get a true/false value based on obj by looking up the variables in dict
 # obj.predicates():
 #   get the set of predicates occurring in obj
+# The expressions are hash-consed: constructing an expression that is structurally equal to a live one returns
+# that same object, so equal subterms are one node of a DAG, and == / hash are identity checks in constant time.
+# Every node caches its z3 translation per z3.Context, to_z3_expr() builds each shared subterm once.
+import threading
+import weakref
 from abc import ABC, abstractmethod
 import z3
 from typing import Tuple, Dict, List
 
+_INTERNED = weakref.WeakValueDictionary()  # (class, fields) -> the live node with those fields
+_INTERN_LOCK = threading.Lock()
+
+
+def _node(value):
+    """Lets python bools and ints stand for BoolVal and Const."""
+    if isinstance(value, Expression):
+        return value
+    if isinstance(value, bool):
+        return BoolVal(value)
+    if isinstance(value, int):
+        return Const(value)
+    raise TypeError(f"Expected an Expression, got {value!r}")
+
 
 class Expression(ABC):
     """Abstract base class for all expressions."""
+    __slots__ = ("_z3_ctx", "_z3_expr", "_z3_more", "__weakref__")
+    _FIELDS = ()  # the slots that make up the structure, in constructor order
+
+    def __new__(cls, *args, **kwargs):
+        fields = cls._fields(*args, **kwargs)
+        key = (cls,) + fields
+        node = _INTERNED.get(key)
+        if node is not None:
+            return node
+        with _INTERN_LOCK:  # two threads building the same node must end up with one
+            node = _INTERNED.get(key)
+            if node is None:
+                node = super().__new__(cls)
+                for name, value in zip(cls._FIELDS, fields):
+                    object.__setattr__(node, name, value)
+                node._z3_ctx = node._z3_expr = node._z3_more = None
+                _INTERNED[key] = node
+        return node
+
+    @classmethod
+    def _fields(cls, *args):
+        """The normalized values of _FIELDS, the interning key."""
+        return args
+
+    def _constructor_args(self):
+        return tuple(getattr(self, name) for name in self._FIELDS)
+
+    def __reduce__(self):  # unpickled nodes are interned again
+        return self.__class__, self._constructor_args()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({', '.join(repr(getattr(self, name)) for name in self._FIELDS)})"
+
+    def children(self):
+        """The direct subexpressions."""
+        return ()
 
     @abstractmethod
     def get_predicate_name(self):
         """Returns the variable(s) name(s). involved in the expression"""
         pass
 
+    def to_z3_expr(self, ctx=None):
+        """Convert to z3 expression, cached per z3.Context (the main context when None)."""
+        if ctx is None:
+            ctx = z3.main_ctx()
+        if self._z3_ctx is ctx:
+            return self._z3_expr
+        if self._z3_more is not None and ctx in self._z3_more:
+            return self._z3_more[ctx]
+        expr = self._translate(ctx)
+        if self._z3_ctx is None:
+            self._z3_ctx, self._z3_expr = ctx, expr
+        else:
+            if self._z3_more is None:
+                self._z3_more = {}
+            self._z3_more[ctx] = expr
+        return expr
+
     @abstractmethod
-    def to_z3_expr(self):
-        """Convert to z3 expression."""
+    def _translate(self, ctx):
+        """Builds the z3 expression in `ctx`, the children through their (cached) to_z3_expr."""
         pass
 
     @abstractmethod
@@ -30,31 +102,50 @@ class Expression(ABC):
         pass
 
 
+def _names(expressions):
+    """The variable names of the expressions, every shared subterm is visited once."""
+    names = set()
+    visited = set()
+    stack = list(expressions)
+    while stack:
+        expr = stack.pop()
+        if expr in visited:
+            continue
+        visited.add(expr)
+        if isinstance(expr, (Bool, Int)):
+            names.add(expr.name)
+        stack.extend(expr.children())
+    return names
+
+
 class BoolVal(Expression):
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ("value",)
+    _FIELDS = __slots__
+
+    @classmethod
+    def _fields(cls, value):
+        return (bool(value),)
 
     def get_predicate_name(self):
-        return {}
+        return set()
 
     def evaluate_assigned_value(self, _values):
         return self.value
 
-    def to_z3_expr(self):
-        return z3.BoolVal(self.value)
+    def _translate(self, ctx):
+        return z3.BoolVal(self.value, ctx)
 
 
 class Bool(Expression):
     """Wrapper for boolean variable."""
-
-    def __init__(self, name):
-        self.name = name
+    __slots__ = ("name",)
+    _FIELDS = __slots__
 
     def get_predicate_name(self):
         return self.name
 
-    def to_z3_expr(self):
-        return z3.Bool(self.name)
+    def _translate(self, ctx):
+        return z3.Bool(self.name, ctx)
 
     def evaluate_assigned_value(self, value_dct):
         return value_dct[self.name]
@@ -62,15 +153,14 @@ class Bool(Expression):
 
 class Int(Expression):
     """Wrapper for integer variable."""
-
-    def __init__(self, name):
-        self.name = name
+    __slots__ = ("name",)
+    _FIELDS = __slots__
 
     def get_predicate_name(self):
         return self.name
 
-    def to_z3_expr(self):
-        return z3.Int(self.name)
+    def _translate(self, ctx):
+        return z3.Int(self.name, ctx)
 
     def evaluate_assigned_value(self, value_dct):
         return value_dct[self.name]
@@ -78,120 +168,134 @@ class Int(Expression):
 
 class Not(Expression):
     """Wrapper for logical NOT operation."""
+    __slots__ = ("arg",)
+    _FIELDS = __slots__
+
+    @classmethod
+    def _fields(cls, arg):
+        return (_node(arg),)
 
-    def __init__(self, *args):
-        self.args = args
+    def children(self):
+        return (self.arg,)
 
     def get_predicate_name(self):
-        names = set()
-        for arg in self.args:
-            names.update(*arg.get_predicate_name())
-        return names
+        return _names(self.children())
 
-    def to_z3_expr(self):
-        return z3.Not(self.arg.to_z3_expr())
+    def _translate(self, ctx):
+        return z3.Not(self.arg.to_z3_expr(ctx), ctx)
 
     def evaluate_assigned_value(self, value_dct):
         return not self.arg.evaluate_assigned_value(value_dct)
 
 
-class Or(Expression):
-    """Wrapper for logical OR operation between multiple expressions."""
+class _NAry(Expression):
+    """An operation over any number of expressions."""
+    __slots__ = ("args",)
+    _FIELDS = __slots__
+
+    @classmethod
+    def _fields(cls, *args):
+        return (tuple(_node(arg) for arg in args),)
+
+    def _constructor_args(self):
+        return self.args
 
-    def __init__(self, *args):
-        self.args = args
+    def children(self):
+        return self.args
 
     def get_predicate_name(self):
-        names = set()
-        for arg in self.args:
-            names.update(*arg.get_predicate_name())
-        return names
+        return _names(self.args)
 
-    def to_z3_expr(self):
-        return z3.Or([arg.to_z3_expr() for arg in self.args])
+    def _z3_args(self, ctx):
+        return [arg.to_z3_expr(ctx) for arg in self.args]
+
+
+class Or(_NAry):
+    """Wrapper for logical OR operation between multiple expressions."""
+    __slots__ = ()
+
+    def _translate(self, ctx):
+        return z3.Or(*self._z3_args(ctx), ctx) if self.args else z3.BoolVal(False, ctx)
 
     def evaluate_assigned_value(self, value_dct):
         return any(arg.evaluate_assigned_value(value_dct) for arg in self.args)
 
 
-class And(Expression):
+class And(_NAry):
     """Wrapper for logical AND operation between multiple expressions."""
+    __slots__ = ()
 
-    def __init__(self, *args):
-        self.args = args
-
-    def get_predicate_name(self):
-        names = set()
-        for arg in self.args:
-            names.update(*arg.get_predicate_name())
-        return names
-
-    def to_z3_expr(self):
-        for arg in self.args:
-            print(arg)
-        return z3.And([arg.to_z3_expr() for arg in self.args])
+    def _translate(self, ctx):
+        return z3.And(*self._z3_args(ctx), ctx) if self.args else z3.BoolVal(True, ctx)
 
     def evaluate_assigned_value(self, value_dct):
         return all(arg.evaluate_assigned_value(value_dct) for arg in self.args)
 
 
-class Distinct(Expression):
+class Distinct(_NAry):
     """...."""
+    __slots__ = ()
 
-    def __init__(self, *args):
-        self.args = args
-
-    def get_predicate_name(self):
-        names = set()
-        for arg in self.args:
-            names.update(*arg.get_predicate_name())
-        return names
-
-    def to_z3_expr(self):
-        return z3.Distinct([arg.to_z3_expr() for arg in self.args])
+    def _translate(self, ctx):
+        if len(self.args) < 2:
+            return z3.BoolVal(True, ctx)
+        return z3.Distinct(self._z3_args(ctx))
 
     def evaluate_assigned_value(self, value_dct):
         all_predicates = [arg.evaluate_assigned_value(value_dct) for arg in self.args]
         return len(set(all_predicates)) == len(all_predicates)
 
 
+class _PseudoBoolean(Expression):
+    """A weighted sum of boolean expressions compared with a constant."""
+    __slots__ = ("expr_weights", "equal_val")
+    _FIELDS = __slots__
 
-class PbEq(Expression):
-    """...."""
-
-    def __init__(self, expr_weights: List[Tuple[Expression, int]], equal_val: int):
-        self.expr_weights = expr_weights
-        self.equal_val = equal_val
+    @classmethod
+    def _fields(cls, expr_weights: List[Tuple[Expression, int]], equal_val: int):
+        return tuple((_node(expr), int(weight)) for expr, weight in expr_weights), int(equal_val)
 
+    def children(self):
+        return tuple(expr for expr, _ in self.expr_weights)
 
     def get_predicate_name(self):
-        # Implementation depends on specifics of PbEq.
-        names = set()
-        for name,_ in self.expr_weights:
-            names.update(name.get_predicate_name())
-        return names
+        return _names(self.children())
+
+    def _z3_args(self, ctx):
+        return [(expr.to_z3_expr(ctx), weight) for expr, weight in self.expr_weights]
+
+    def _weighted_sum(self, value_dct):
+        return sum(expr.evaluate_assigned_value(value_dct) * weight for expr, weight in self.expr_weights)
 
-    def to_z3_expr(self):
-        # Implementation depends on specifics of PbEq.
-        return z3.PbEq(self.expr_weights,self.equal_val)
+
+class PbEq(_PseudoBoolean):
+    """...."""
+    __slots__ = ()
+
+    def _translate(self, ctx):
+        if not self.expr_weights:
+            return z3.BoolVal(self.equal_val == 0, ctx)
+        return z3.PbEq(self._z3_args(ctx), self.equal_val, ctx)
 
     def evaluate_assigned_value(self, value_dct):
-        sum_values = sum(expr.evaluate_assigned_value(value_dct) * weight for expr, weight in self.expr_weights)
-        return sum_values==self.equal_val
+        return self._weighted_sum(value_dct) == self.equal_val
 
 
 class Const(Expression):
-    """Wrapper for constant value."""
+    """Wrapper for integer constant value, use BoolVal for booleans."""
+    __slots__ = ("value",)
+    _FIELDS = __slots__
 
-    def __init__(self, value):
-        self.value = value
+    @classmethod
+    def _fields(cls, value):
+        return (int(value),)
 
     def get_predicate_name(self):
         return set()
 
-    def to_z3_expr(self):
+    def _translate(self, ctx):
         # Directly return the constant value as its Z3 expression equivalent
-        return z3.Const(self.value)
+        return z3.IntVal(self.value, ctx)
 
     def evaluate_assigned_value(self, value_dct):
         # The evaluation of a constant is the constant itself
@@ -199,55 +303,56 @@ class Const(Expression):
 
 
 class Eq(Expression):
+    __slots__ = ("expr1", "expr2")
+    _FIELDS = __slots__
+
+    @classmethod
+    def _fields(cls, expr1, expr2):
+        return _node(expr1), _node(expr2)
 
-    def __init__(self, expr1, expr2):
-        self.expr1 = expr1
-        self.expr2 = expr2
+    def children(self):
+        return self.expr1, self.expr2
 
     def get_predicate_name(self):
-        return (self.expr1, self.expr2)
+        return _names(self.children())
 
-    def to_z3_expr(self):
-        return z3.eq(self.expr1.to_z3_expr(), self.expr2.to_z3_expr())
+    def _translate(self, ctx):
+        return self.expr1.to_z3_expr(ctx) == self.expr2.to_z3_expr(ctx)
 
     def evaluate_assigned_value(self, value_dct):
-        return value_dct[self.expr1] == value_dct[self.expr2]
-
-class PbLe(Expression):
-    """...."""
-
-    def __init__(self, expr_weights: List[Tuple[Expression, int]], equal_val: int):
-        self.expr_weights = expr_weights
-        self.equal_val = equal_val
+        return self.expr1.evaluate_assigned_value(value_dct) == self.expr2.evaluate_assigned_value(value_dct)
 
 
-    def get_predicate_name(self):
-        # Implementation depends on specifics of PbEq.
-        names = set()
-        for name,_ in self.expr_weights:
-            names.update(name.get_predicate_name())
-        return names
+class PbLe(_PseudoBoolean):
+    """...."""
+    __slots__ = ()
 
-    def to_z3_expr(self):
-        # Implementation depends on specifics of PbEq.
-        return z3.PbEq(self.expr_weights,self.equal_val)
+    def _translate(self, ctx):
+        if not self.expr_weights:
+            return z3.BoolVal(0 <= self.equal_val, ctx)
+        return z3.PbLe(self._z3_args(ctx), self.equal_val)
 
     def evaluate_assigned_value(self, value_dct):
-        sum_values = sum(expr.evaluate_assigned_value(value_dct) * weight for expr, weight in self.expr_weights)
-        return sum_values<=self.equal_val
+        return self._weighted_sum(value_dct) <= self.equal_val
+
 
 class Implies(Expression):
     """Represents a logical implication between two expressions."""
+    __slots__ = ("premise", "conclusion")
+    _FIELDS = __slots__
+
+    @classmethod
+    def _fields(cls, premise, conclusion):
+        return _node(premise), _node(conclusion)
 
-    def __init__(self, premise, conclusion):
-        self.premise = premise
-        self.conclusion = conclusion
+    def children(self):
+        return self.premise, self.conclusion
 
     def get_predicate_name(self):
-        return self.premise.get_predicate_name(), self.conclusion.get_predicate_name()
+        return _names(self.children())
 
-    def to_z3_expr(self):
-        return z3.Implies(self.premise.to_z3_expr(), self.conclusion.to_z3_expr())
+    def _translate(self, ctx):
+        return z3.Implies(self.premise.to_z3_expr(ctx), self.conclusion.to_z3_expr(ctx), ctx)
 
     def evaluate_assigned_value(self, value_dct):
         return not self.premise.evaluate_assigned_value(value_dct) or self.conclusion.evaluate_assigned_value(value_dct)
@@ -261,12 +366,62 @@ def false():
     return BoolVal(False)
 
 
+class UnsatisfiableConditions(Exception):
+    """No assignment of the condition variables satisfies the global constraints and the conditions."""
+    pass
+
+
+SELECTOR_PREFIX = "jz3!sel"
+
+
+def _without_selectors(model):
+    """A copy of the z3 model without the selector literals, they are internal to Solver."""
+    # through the C API like Solver._flush, model.decls() and update_value wrap every constant in python objects
+    ctx = model.ctx.ref()
+    filtered = z3.Model(ctx=model.ctx)
+    for i in range(z3.Z3_model_get_num_consts(ctx, model.model)):
+        decl = z3.Z3_model_get_const_decl(ctx, model.model, i)
+        if not z3.Z3_get_symbol_string(ctx, z3.Z3_get_decl_name(ctx, decl)).startswith(SELECTOR_PREFIX):
+            z3.Z3_add_const_interp(ctx, filtered.model, decl, z3.Z3_model_get_const_interp(ctx, model.model, decl))
+    for i in range(z3.Z3_model_get_num_funcs(ctx, model.model)):
+        decl = z3.FuncDeclRef(z3.Z3_model_get_func_decl(ctx, model.model, i), model.ctx)
+        filtered.update_value(decl, model[decl])
+    return filtered
+
+
+class _Group:
+    """The constraints of one condition, switched on in the constraint solver by one selector literal."""
+    __slots__ = ("condition", "selector", "constraints")
+
+    def __init__(self, condition, selector):
+        self.condition = condition
+        self.selector = selector  # None for the unconditional group, its constraints are asserted as they are
+        self.constraints = []
+
+
 class Solver:
+    """
+    The constraints are compiled into two persistent incremental z3 solvers instead of new solvers on every call:
+    - the condition solver has the global constraints and every distinct condition, a model of it picks the
+      conditions whose constraints apply
+    - the constraint solver has every constraint once as Implies(selector of its condition, constraint), check
+      turns the groups on with their selectors as assumptions. Every condition is asserted on the condition solver,
+      so all of them hold in its model and check passes all selectors without evaluating the conditions again
+    Constraints are only translated to z3 by the next check (dirty tracking), so loading N constraints is O(N).
+    """
     def __init__(self):
         self.assertions: List[Tuple[Expression, Expression]] = []  # (conditional_constraint, condition)
         self.modelVariables = {}  # no_num, distinct, etc
         self.global_constraints = true()  # no_num and distinct cannot be true at the same time
         self.model = None
+        self._groups: Dict[Expression, _Group] = {}
+        self._selectors = []  # the selectors of the conditional groups, in the order the groups were made
+        self._pending: List[Tuple[_Group, Expression]] = []  # added, not yet asserted on the constraint solver
+        self._constraint_solver = z3.Solver()
+        self._condition_solver = None  # built for the current global constraints
+        self._asserted_global = None
+        self._asserted_conditions = 0  # the first groups whose condition is on the condition solver
+        self._condition_model = None  # model of the condition solver, None when it has to be checked again
 
     def add(self, *args, condition: Expression = None) -> None:
         """
@@ -275,25 +430,62 @@ class Solver:
         Parameters:
             expression (Expression): The constraint to be added.
             condition (Expression, optional): The condition under which the constraint is applied.
+
+        Raises:
+            UnsatisfiableConditions: when a new condition cannot hold together with the global constraints and the
+                                     other conditions. Repeated conditions are not checked again.
         """
 
         if condition is None:
             condition = true()
+        group = self._groups.get(condition)
+        if group is None:
+            selector = None if condition is true() else z3.Bool(f"{SELECTOR_PREFIX}{len(self._groups)}")
+            group = self._groups[condition] = _Group(condition, selector)
+            if selector is not None:
+                self._selectors.append(selector)
         for conditional_constraint in args:
             # TODO: check the the constraints are validly typed @sj is this what you mean?
             self.assertions.append((conditional_constraint, condition))
-        s = z3.Solver()
-        s.add(self.global_constraints.to_z3_expr())
-        for _, condition in self.assertions:
-            # Check if the condition is an instance of your Expression class
-            # and convert it to a Z3 expression if so. Otherwise, use it as is.
-            if isinstance(condition, Expression):
-                z3_condition = condition.to_z3_expr()
-            else:
-                z3_condition = condition
-            s.add(z3_condition)
-        if s.check() != z3.sat:
-            raise "The conditions provided are not satisfiable"
+            group.constraints.append(conditional_constraint)
+            self._pending.append((group, conditional_constraint))
+        if self._condition_assignment() is None:
+            raise UnsatisfiableConditions("The conditions provided are not satisfiable")
+
+    def _condition_assignment(self):
+        """
+        A model of the global constraints and all conditions, None when there is none.
+        Only the conditions added since the last call are translated and asserted.
+        """
+        if self._asserted_global is not self.global_constraints:  # replaced since, start over
+            self._condition_solver = z3.Solver()
+            self._condition_solver.add(self.global_constraints.to_z3_expr())
+            self._asserted_global = self.global_constraints
+            self._asserted_conditions = 0
+            self._condition_model = None
+        groups = list(self._groups.values())
+        if self._asserted_conditions < len(groups):
+            for group in groups[self._asserted_conditions:]:
+                self._condition_solver.add(group.condition.to_z3_expr())
+            self._asserted_conditions = len(groups)
+            self._condition_model = None
+        if self._condition_model is None:
+            if self._condition_solver.check() != z3.sat:
+                return None
+            self._condition_model = self._condition_solver.model()
+        return self._condition_model
+
+    def _flush(self):
+        """Asserts the constraints added since the last check on the constraint solver."""
+        # straight through the C API, the sort checks of z3.Implies and Solver.add cost more than z3 itself here
+        ctx = self._constraint_solver.ctx
+        solver = self._constraint_solver.solver
+        for group, conditional_constraint in self._pending:
+            constraint = conditional_constraint.to_z3_expr()
+            if group.selector is not None:
+                constraint = z3.BoolRef(z3.Z3_mk_implies(ctx.ref(), group.selector.as_ast(), constraint.as_ast()), ctx)
+            z3.Z3_solver_assert(ctx.ref(), solver, constraint.as_ast())
+        self._pending = []
 
     def check(self, *args, condition: Expression = true()):
         """
@@ -302,41 +494,15 @@ class Solver:
         and checks for overall satisfiability.
 
         """
-        s = z3.Solver()
-        s.add(self.global_constraints.to_z3_expr())
-        # unconditional constraint
-
         # adding all conditions to solver to determine if they
         # can satisfy the global constraint
-        conditional_expressions = [cond.to_z3_expr() for (_, cond) in self.assertions]
-        for expr in conditional_expressions:
-            s.add(expr)
-
-        if s.check() == z3.sat:
-            # find a specific combination
-            model = s.model()  # [cond1==True, cond2==False, cond3==False, ...]
-
-            solver_with_conditional_constraint = z3.Solver()
-            modelValues = {}
-            # todo: launch multiple solvers in parallel, get first response
-
-            # {var: makeTF(model[var]) for var in self.modelVariables}
-            # assignment dict of condition:True/False: z3.z3.BoolRef
-            self.assertions: List[Expression, Expression]
-            for (conditional_constraint, condition) in self.assertions:
-                # for unconditional conditions, or conditions that we assign to be true
-                if condition == BoolVal(True) or model.eval(condition.to_z3_expr()):
-                    # modelValues[condition] = BoolVal(True)
-                    solver_with_conditional_constraint.add(conditional_constraint.to_z3_expr())
-            solver_with_conditional_constraint.check()
-            self.model = solver_with_conditional_constraint.model()
-            return solver_with_conditional_constraint.check(*args)  # todo convert z3.sat to ours???? @sj, this would impact the current program using z3.sat tho
-
-        else:
-            raise "Impossible to find any way of building constraints"
-
-    def model(self):
-        return self.model()
+        if self._condition_assignment() is None:
+            raise UnsatisfiableConditions("Impossible to find any way of building constraints")
+        self._flush()
+        assumptions = [arg.to_z3_expr() if isinstance(arg, Expression) else arg for arg in args]
+        result = self._constraint_solver.check(*self._selectors, *assumptions)
+        self.model = _without_selectors(self._constraint_solver.model()) if result == z3.sat else None
+        return result  # todo convert z3.sat to ours???? @sj, this would impact the current program using z3.sat tho
 
 
 sat = "sat"
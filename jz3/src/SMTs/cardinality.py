@@ -0,0 +1,208 @@
+"""
+Lowers the pseudo-boolean constraints PbEq / PbLe into clauses, so the cardinality encoding can be chosen (and
+benchmarked) instead of always leaving it to the solver:
+- "native": the PbEq / PbLe itself, the solver's own pseudo-boolean handling
+- "sequential": Sinz's sequential counter, O(n*k) auxiliary variables
+- "totalizer": a totalizer tree with unary counts cut off at k+1, O(n*k) auxiliary variables
+- "sorting_network": Batcher's odd-even merge sort of the inputs, O(n log^2 n) auxiliary variables
+
+Weights are expanded into that many copies of their term (a negative weight is a positive one on the negated term),
+so the clause encodings suit the small weights of cardinality constraints.
+
+    encode(PbEq([(x, 1), (y, 1), (z, 1)], 1), "totalizer")  # an And of clauses over x, y, z and auxiliary Bools
+
+    conditions = add_encoding_choice(solver, sudoku_pb_constraints, family="cells")
+    solver.check_conditional_constraints(max_count=len(ENCODINGS))  # benchmark mode compares the encodings
+"""
+import itertools
+
+import z3
+
+from .SMTs import Expression, Bool, BoolVal, Not, And, Or, PbEq, PbLe
+
+ENCODINGS = ("native", "sequential", "totalizer", "sorting_network")
+AUX_PREFIX = "jz3!card"
+_prefixes = itertools.count()
+
+
+def _literals(constraint):
+    """:return: (list of literals with every weight expanded, bound) of the PbEq / PbLe"""
+    literals = []
+    bound = constraint.equal_val
+    for expr, weight in constraint.expr_weights:
+        if weight < 0:  # w*x = |w|*Not(x) - |w|
+            expr, weight = Not(expr), -weight
+            bound += weight
+        literals.extend([expr] * weight)
+    return literals, bound
+
+
+def _clause(*literals):
+    return literals[0] if len(literals) == 1 else Or(*literals)
+
+
+def _trivial(lower, upper, count):
+    """:return: a BoolVal when the bounds decide the constraint without looking at the literals, else None"""
+    if upper is not None and upper < 0:
+        return BoolVal(False)
+    if lower is not None and lower > count:
+        return BoolVal(False)
+    if lower is None and upper is None:
+        return BoolVal(True)
+    return None
+
+
+def sequential_counter(literals, at_most, prefix):
+    """Sinz's sequential counter clauses of sum(literals) <= at_most, the aux Bools are named `prefix`s<i>_<j>."""
+    n = len(literals)
+    if at_most >= n:
+        return []
+    if at_most == 0:
+        return [Not(literal) for literal in literals]
+    s = [[Bool(f"{prefix}s{i}_{j}") for j in range(at_most)] for i in range(n - 1)]
+    clauses = [_clause(Not(literals[0]), s[0][0])]
+    clauses.extend(Not(s[0][j]) for j in range(1, at_most))
+    for i in range(1, n - 1):
+        clauses.append(_clause(Not(literals[i]), s[i][0]))
+        clauses.append(_clause(Not(s[i - 1][0]), s[i][0]))
+        for j in range(1, at_most):
+            clauses.append(_clause(Not(literals[i]), Not(s[i - 1][j - 1]), s[i][j]))
+            clauses.append(_clause(Not(s[i - 1][j]), s[i][j]))
+        clauses.append(_clause(Not(literals[i]), Not(s[i - 1][at_most - 1])))
+    clauses.append(_clause(Not(literals[n - 1]), Not(s[n - 2][at_most - 1])))
+    return clauses
+
+
+def _totalizer(literals, limit, prefix, clauses, names):
+    """
+    :return: (unary outputs, exact) outputs[i] holds iff at least i+1 literals hold, cut off after `limit` outputs,
+             exact when none were cut off
+    """
+    if len(literals) == 1:
+        return [literals[0]], True
+    middle = len(literals) // 2
+    left, left_exact = _totalizer(literals[:middle], limit, prefix, clauses, names)
+    right, right_exact = _totalizer(literals[middle:], limit, prefix, clauses, names)
+    size = min(len(literals), limit)
+    node = next(names)
+    outputs = [Bool(f"{prefix}t{node}_{i}") for i in range(size)]
+    for i in range(len(left) + 1):
+        for j in range(len(right) + 1):
+            if i + j > 0:  # at least i left and j right: at least i+j
+                clauses.append(_clause(*([Not(left[i - 1])] if i else []), *([Not(right[j - 1])] if j else []),
+                                       outputs[min(i + j, size) - 1]))
+            if i + j < size:  # at most i left and j right: at most i+j
+                upper_left = [left[i]] if i < len(left) else ([] if left_exact else None)
+                upper_right = [right[j]] if j < len(right) else ([] if right_exact else None)
+                if upper_left is not None and upper_right is not None:
+                    clauses.append(_clause(*upper_left, *upper_right, Not(outputs[i + j])))
+    return outputs, size == len(literals)
+
+
+def totalizer(literals, at_least, at_most, prefix):
+    """Totalizer clauses of at_least <= sum(literals) <= at_most, either bound may be None."""
+    limit = len(literals) if at_most is None else at_most + 1
+    clauses = []
+    outputs, _ = _totalizer(literals, max(limit, at_least or 0), prefix, clauses, itertools.count())
+    if at_least:
+        clauses.append(outputs[at_least - 1])
+    if at_most is not None and at_most < len(outputs):
+        clauses.append(Not(outputs[at_most]))
+    return clauses
+
+
+def _comparator(high, low, prefix, clauses, names):
+    """:return: (high or low, high and low), defined with full equivalences"""
+    index = next(names)
+    maximum, minimum = Bool(f"{prefix}c{index}_max"), Bool(f"{prefix}c{index}_min")
+    clauses.extend([_clause(Not(high), maximum), _clause(Not(low), maximum), _clause(high, low, Not(maximum)),
+                    _clause(Not(minimum), high), _clause(Not(minimum), low), _clause(Not(high), Not(low), minimum)])
+    return maximum, minimum
+
+
+def _merge(values, prefix, clauses, names):
+    """Batcher's odd-even merge of two sorted (descending) halves, len(values) is a power of two."""
+    if len(values) == 2:
+        return list(_comparator(values[0], values[1], prefix, clauses, names))
+    even = _merge(values[0::2], prefix, clauses, names)
+    odd = _merge(values[1::2], prefix, clauses, names)
+    merged = [even[0]]
+    for i in range(len(even) - 1):
+        merged.extend(_comparator(odd[i], even[i + 1], prefix, clauses, names))
+    merged.append(odd[-1])
+    return merged
+
+
+def _sort(values, prefix, clauses, names):
+    if len(values) == 1:
+        return values
+    middle = len(values) // 2
+    return _merge(_sort(values[:middle], prefix, clauses, names) + _sort(values[middle:], prefix, clauses, names),
+                  prefix, clauses, names)
+
+
+def sorting_network(literals, at_least, at_most, prefix):
+    """Odd-even merge sort clauses of at_least <= sum(literals) <= at_most, either bound may be None."""
+    size = 1
+    while size < len(literals):
+        size *= 2
+    padded = list(literals) + [BoolVal(False)] * (size - len(literals))
+    clauses = []
+    outputs = _sort(padded, prefix, clauses, itertools.count())  # outputs[i] holds iff at least i+1 inputs hold
+    if at_least:
+        clauses.append(outputs[at_least - 1])
+    if at_most is not None and at_most < len(outputs):
+        clauses.append(Not(outputs[at_most]))
+    return clauses
+
+
+def encode(constraint, encoding="native", prefix=None) -> Expression:
+    """
+    :param constraint: an SMTs PbEq or PbLe
+    :param encoding: one of ENCODINGS
+    :param prefix: name prefix of the auxiliary Bools, unique per call when None
+    :return: an SMTs expression equisatisfiable with `constraint`, the same on its variables
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown cardinality encoding {encoding!r}, expected one of {ENCODINGS}")
+    if not isinstance(constraint, (PbEq, PbLe)):
+        raise TypeError(f"Expected a PbEq or PbLe, got {type(constraint).__name__}")
+    if encoding == "native":
+        return constraint
+    if prefix is None:
+        prefix = f"{AUX_PREFIX}{next(_prefixes)}!"
+    literals, bound = _literals(constraint)
+    lower = bound if isinstance(constraint, PbEq) and bound > 0 else None
+    upper = bound if bound < len(literals) else None
+    trivial = _trivial(lower, upper, len(literals))
+    if trivial is not None:
+        return trivial
+    if encoding == "sequential":
+        clauses = [] if upper is None else sequential_counter(literals, upper, prefix + "u")
+        if lower is not None:  # at least lower of them: at most len - lower of their negations
+            clauses += sequential_counter([Not(literal) for literal in literals], len(literals) - lower,
+                                          prefix + "l")
+    elif encoding == "totalizer":
+        clauses = totalizer(literals, lower, upper, prefix)
+    else:
+        clauses = sorting_network(literals, lower, upper, prefix)
+    return And(*clauses)
+
+
+def add_encoding_choice(solver, constraints, encodings=ENCODINGS, family="card"):
+    """
+    Adds the pseudo-boolean constraints to a jz3 Solver once per encoding, every encoding under its own condition
+    variable Bool("<family>_<encoding>"), and exactly one of them is on (global constraint). Benchmark mode then
+    compares the encodings like any other condition variables.
+    :param constraints: SMTs PbEq / PbLe constraints of one family, e.g. the cell constraints of a Sudoku
+    :param encodings: the encodings to choose from
+    :param family: name of the constraint family, families get their own condition variables
+    :return: dict encoding -> condition variable (z3 Bool)
+    """
+    constraints = list(constraints)
+    conditions = {encoding: z3.Bool(f"{family}_{encoding}") for encoding in encodings}
+    solver.add_global_constraints(z3.PbEq([(condition, 1) for condition in conditions.values()], 1))
+    solver.add_conditional_constraints([
+        (encode(constraint, encoding, f"{AUX_PREFIX}!{family}!{encoding}{i}!").to_z3_expr(), condition)
+        for encoding, condition in conditions.items() for i, constraint in enumerate(constraints)])
+    return conditions
@@ -0,0 +1,273 @@
+"""
+Writes SMTs expressions as SMT-LIB2 straight from the DAG, no z3 context or z3 objects involved, for handing large
+generated problems to external solvers.
+
+Variables are declared the first time an assertion uses them. A compound subterm that an assertion uses twice, or
+that an earlier assertion had too, is named once with define-fun and referred to by that name from then on.
+The text goes through a buffer of buffer_size characters to a path, anything with write() (a file, a pipe) or a
+socket, and every term is written while walking it, so memory is bounded by the largest assertion, not the script:
+
+    with SMT2Emitter("sudoku.smt2") as emitter:
+        emitter.set_logic("QF_LIA")
+        for constraint in constraints:
+            emitter.assert_expr(constraint)
+        emitter.check_sat()
+
+PbEq / PbLe are written as linear integer arithmetic, (= (+ (ite x 1 0) (ite y 2 0)) 1), which every solver reads.
+With `max_entries` the tables of seen subterms and definitions are bounded, for very long scripts.
+"""
+import os
+import re
+from collections import OrderedDict
+
+from .SMTs import (Expression, BoolVal, Bool, Int, Const, Not, And, Or, Distinct, PbEq, Eq, Implies,
+                   _PseudoBoolean)
+
+DEFINITION_PREFIX = "jz3!e"
+DEFAULT_BUFFER_SIZE = 1 << 16
+_SIMPLE_SYMBOL = re.compile(r"[A-Za-z~!@$%^&*_+=<>.?/-][0-9A-Za-z~!@$%^&*_+=<>.?/-]*\Z")
+_OPERATORS = {Not: "not", And: "and", Or: "or", Distinct: "distinct", Eq: "=", Implies: "=>"}
+
+
+def symbol(name):
+    """The SMT-LIB2 symbol of `name`, quoted with |...| unless it is a simple symbol."""
+    if _SIMPLE_SYMBOL.match(name):
+        return name
+    if "|" in name or "\\" in name:
+        raise ValueError(f"{name!r} cannot be written as an SMT-LIB2 symbol")
+    return f"|{name}|"
+
+
+def _integer(value):
+    return str(value) if value >= 0 else f"(- {-value})"
+
+
+def _compound(node):
+    """Worth a name when shared: not a leaf and not the negation of a leaf."""
+    children = node.children()
+    if not children:
+        return False
+    return not (isinstance(node, Not) and not node.arg.children())
+
+
+class SMT2Emitter:
+    def __init__(self, out, share=True, max_entries=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        :param out: a path (opened here and closed by close()), anything with write(), or a socket
+        :param share: name shared subterms with define-fun
+        :param max_entries: optional bound on the remembered subterms and definitions, the oldest are forgotten
+                            (a forgotten subterm is printed in full or defined again)
+        :param buffer_size: characters collected before they are passed on to `out`
+        """
+        self._owned = isinstance(out, (str, os.PathLike))
+        self.out = open(out, "w") if self._owned else out
+        self.share = share
+        self.max_entries = max_entries
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        self._declared = {}  # variable name -> sort
+        self._defined = OrderedDict()  # node -> definition name
+        self._seen = OrderedDict()  # node -> None, compound subterms of earlier assertions
+        self._scopes = [[]]  # per push level: the declared names and defined nodes to drop on pop
+        self._definition_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Passes the buffered text on to `out`."""
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        if not text:
+            return
+        if hasattr(self.out, "sendall"):
+            self.out.sendall(text.encode())
+        else:
+            self.out.write(text)
+
+    def close(self):
+        """Flushes, and closes `out` when it was opened from a path."""
+        self.flush()
+        if self._owned:
+            self.out.close()
+        elif hasattr(self.out, "flush"):
+            self.out.flush()
+
+    def set_logic(self, logic):
+        self.write(f"(set-logic {logic})\n")
+
+    def comment(self, text):
+        self.write(f"; {text}\n")
+
+    def push(self, levels=1):
+        for _ in range(levels):
+            self._scopes.append([])
+        self.write(f"(push {levels})\n")
+
+    def pop(self, levels=1):
+        for _ in range(min(levels, len(self._scopes) - 1)):
+            for kind, key in self._scopes.pop():
+                if kind == "declared":
+                    self._declared.pop(key, None)
+                else:
+                    self._defined.pop(key, None)
+        self.write(f"(pop {levels})\n")
+
+    def check_sat(self):
+        self.write("(check-sat)\n")
+
+    def get_model(self):
+        self.write("(get-model)\n")
+
+    def assert_expr(self, expr: Expression, name=None):
+        """:param name: optional name of the assertion, as it shows up in unsat cores"""
+        order, shared = self._walk(expr)
+        for node in order:
+            if isinstance(node, (Bool, Int)):
+                self._declare(node)
+            elif node in shared and node is not expr:
+                self._define(node)
+        self.write("(assert ")
+        if name is not None:
+            self.write("(! ")
+        self._term(expr)
+        if name is not None:
+            self.write(f" :named {symbol(name)})")
+        self.write(")\n")
+        if self.share:
+            for node in order:
+                if _compound(node) and node not in self._defined:
+                    self._remember(self._seen, node, None)
+
+    def _walk(self, root):
+        """
+        :return: (the nodes of `root` below the defined ones, children first,
+                  the compound nodes that are used twice in `root` or were in an earlier assertion)
+        """
+        order = []
+        uses = {}
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                order.append(node)
+                continue
+            uses[node] = uses.get(node, 0) + 1
+            if uses[node] > 1 or node in self._defined:
+                continue
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children()))
+        if not self.share:
+            return order, set()
+        shared = {node for node in order if _compound(node) and (uses[node] > 1 or node in self._seen)}
+        return order, shared
+
+    def _declare(self, node):
+        sort = "Int" if isinstance(node, Int) else "Bool"
+        declared = self._declared.get(node.name)
+        if declared == sort:
+            return
+        if declared is not None:
+            raise ValueError(f"{node.name!r} is used both as {declared} and as {sort}")
+        self._declared[node.name] = sort
+        self._scopes[-1].append(("declared", node.name))
+        self.write(f"(declare-const {symbol(node.name)} {sort})\n")
+
+    def _define(self, node):
+        self._definition_count += 1
+        name = f"{DEFINITION_PREFIX}{self._definition_count}"
+        self.write(f"(define-fun {name} () {self._sort(node)} ")
+        self._term(node)
+        self.write(")\n")
+        self._seen.pop(node, None)
+        self._remember(self._defined, node, name)
+        self._scopes[-1].append(("defined", node))
+
+    @staticmethod
+    def _sort(node):
+        return "Int" if isinstance(node, (Int, Const)) else "Bool"
+
+    def _term(self, root):
+        """Writes `root`, its defined subterms by name, with an explicit stack instead of recursion."""
+        stack = [root]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                self.write(item)
+                continue
+            node = item
+            if node in self._defined:
+                self.write(self._defined[node])
+            elif isinstance(node, (Bool, Int)):
+                self.write(symbol(node.name))
+            elif isinstance(node, BoolVal):
+                self.write("true" if node.value else "false")
+            elif isinstance(node, Const):
+                self.write(_integer(node.value))
+            elif isinstance(node, _PseudoBoolean):
+                stack.extend(reversed(self._pseudo_boolean(node)))
+            else:
+                children = node.children()
+                if isinstance(node, (And, Or)) and len(children) < 2:
+                    stack.append(children[0] if children else ("true" if isinstance(node, And) else "false"))
+                elif isinstance(node, Distinct) and len(children) < 2:
+                    self.write("true")
+                else:
+                    stack.append(")")
+                    for child in reversed(children):
+                        stack.extend((child, " "))
+                    self.write(f"({_OPERATORS[type(node)]}")
+
+    @staticmethod
+    def _pseudo_boolean(node):
+        """:return: the tokens (text and nodes) of a PbEq / PbLe as linear integer arithmetic"""
+        relation = "=" if isinstance(node, PbEq) else "<="
+        bound = _integer(node.equal_val)
+        terms = [(expr, weight) for expr, weight in node.expr_weights if weight != 0]
+        if not terms:
+            holds = 0 == node.equal_val if isinstance(node, PbEq) else 0 <= node.equal_val
+            return ["true" if holds else "false"]
+        tokens = [f"({relation} "]
+        if len(terms) > 1:
+            tokens.append("(+")
+        for expr, weight in terms:
+            tokens.extend([" " if len(terms) > 1 else "", "(ite ", expr, f" {_integer(weight)} 0)"])
+        if len(terms) > 1:
+            tokens.append(")")
+        tokens.append(f" {bound})")
+        return tokens
+
+    def _remember(self, table, key, value):
+        table[key] = value
+        if self.max_entries is not None and len(table) > self.max_entries:
+            table.popitem(last=False)
+
+
+def write_smt2(expressions, out, logic=None, check_sat=True, **options):
+    """
+    Writes the expressions as the assertions of an SMT-LIB2 script.
+    :param out: a path, anything with write(), or a socket, see SMT2Emitter
+    :param logic: written with set-logic when given, e.g. "QF_LIA"
+    :param options: keyword arguments of SMT2Emitter
+    """
+    emitter = SMT2Emitter(out, **options)
+    try:
+        if logic is not None:
+            emitter.set_logic(logic)
+        for expression in expressions:
+            emitter.assert_expr(expression)
+        if check_sat:
+            emitter.check_sat()
+    finally:
+        emitter.close()
@@ -0,0 +1,185 @@
+"""
+Evaluates an SMTs expression on many assignments at once with numpy.
+
+The expression DAG is compiled once into a straight-line program with one numpy step per node, shared subterms
+are computed once per batch and every intermediate array is dropped after its last use.
+The assignments are the rows of a 2-D array, one column per variable:
+
+    evaluator = compile_expression(And(Or(Bool("a"), Bool("b")), PbLe([(Bool("a"), 1), (Bool("c"), 1)], 1)))
+    evaluator.variables  # ['a', 'b', 'c'], the column order
+    evaluator(np.array([[True, False, True], [False, True, False]]))  # array([False,  True])
+
+    satisfying_assignments(global_constraints, ["a", "b", "c"])  # every satisfying row as an int, bit i = column i
+"""
+import numpy as np
+
+from .SMTs import (Expression, BoolVal, Bool, Int, Const, Not, And, Or, Distinct, PbEq, Eq, Implies,
+                   _PseudoBoolean)
+
+DEFAULT_CHUNK_SIZE = 1 << 16  # rows per batch of satisfying_assignments
+
+
+def _topological_order(root):
+    """Every node of the DAG once, children before parents."""
+    order = []
+    visited = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+            continue
+        if node in visited:
+            continue
+        visited.add(node)
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(node.children()))
+    return order
+
+
+def _and(*args):
+    if len(args) == 1:
+        return np.asarray(args[0], dtype=bool)
+    out = np.logical_and(args[0], args[1])
+    for arg in args[2:]:
+        np.logical_and(out, arg, out=out)
+    return out
+
+
+def _or(*args):
+    if len(args) == 1:
+        return np.asarray(args[0], dtype=bool)
+    out = np.logical_or(args[0], args[1])
+    for arg in args[2:]:
+        np.logical_or(out, arg, out=out)
+    return out
+
+
+def _distinct(rows, *args):
+    if len(args) < 2:
+        return np.ones(rows, dtype=bool)
+    if len(args) == 2:
+        return np.not_equal(args[0], args[1])
+    stacked = np.sort(np.column_stack([np.broadcast_to(arg, (rows,)) for arg in args]), axis=1)
+    return (stacked[:, 1:] != stacked[:, :-1]).all(axis=1)
+
+
+def _weighted_sum(rows, weights, *args):
+    total = np.zeros(rows, dtype=np.int64)
+    for weight, arg in zip(weights, args):
+        total += np.multiply(arg, weight, dtype=np.int64)
+    return total
+
+
+class VectorizedEvaluator:
+    def __init__(self, expression, variables=None):
+        """
+        :param expression: the SMTs expression
+        :param variables: the column order, defaults to the sorted variable names of the expression.
+                          It may have more names than the expression uses
+        """
+        self.expression = expression
+        names = expression.get_predicate_name()
+        names = {names} if isinstance(names, str) else names
+        self.variables = sorted(names) if variables is None else list(variables)
+        missing = names - set(self.variables)
+        if missing:
+            raise ValueError(f"No column for the variables {sorted(missing)}")
+        self._compile()
+
+    def _compile(self):
+        """
+        Lowers the DAG into self._program, a list of (node register, step, argument registers), and the registers
+        every step can free afterwards.
+        """
+        column = {name: i for i, name in enumerate(self.variables)}
+        order = _topological_order(self.expression)
+        register = {node: i for i, node in enumerate(order)}
+        self._registers = len(order)
+        self._program = []
+        for node in order:
+            args = [register[child] for child in node.children()]
+            self._program.append((register[node], self._step(node, column), args))
+        # free every register after the step that reads it last (the result register is never read)
+        last_use = {}
+        for position, (_, _, args) in enumerate(self._program):
+            for arg in args:
+                last_use[arg] = position
+        self._frees = [[] for _ in self._program]
+        for arg, position in last_use.items():
+            self._frees[position].append(arg)
+
+    @staticmethod
+    def _step(node, column):
+        """:return: function (values, *argument arrays) -> the array of `node`"""
+        if isinstance(node, (Bool, Int)):
+            index = column[node.name]
+            return lambda values: values[:, index]
+        if isinstance(node, (BoolVal, Const)):
+            value = node.value
+            return lambda values: np.full(len(values), value)
+        if isinstance(node, Not):
+            return lambda values, arg: np.logical_not(arg)
+        if isinstance(node, And):
+            return (lambda values, *args: _and(*args)) if node.args else lambda values: np.ones(len(values), bool)
+        if isinstance(node, Or):
+            return (lambda values, *args: _or(*args)) if node.args else lambda values: np.zeros(len(values), bool)
+        if isinstance(node, Implies):
+            return lambda values, premise, conclusion: np.logical_or(np.logical_not(premise), conclusion)
+        if isinstance(node, Eq):
+            return lambda values, left, right: np.equal(left, right)
+        if isinstance(node, Distinct):
+            return lambda values, *args: _distinct(len(values), *args)
+        if isinstance(node, _PseudoBoolean):
+            weights = np.array([weight for _, weight in node.expr_weights], dtype=np.int64)
+            compare = np.equal if isinstance(node, PbEq) else np.less_equal
+            bound = node.equal_val
+            leaves = [child for child in node.children() if isinstance(child, (Bool, Int))]
+            if len(leaves) == len(weights) and len(weights) > 0:
+                # only variables: one matrix product over their columns, the arguments are not needed
+                columns = [column[leaf.name] for leaf in leaves]
+                return lambda values, *args: compare(values[:, columns].astype(np.int64) @ weights, bound)
+            return lambda values, *args: compare(_weighted_sum(len(values), weights, *args), bound)
+        raise TypeError(f"Cannot vectorize {type(node).__name__}")
+
+    def __call__(self, values):
+        """
+        :param values: 2-D array, one row per assignment, one column per name in self.variables
+        :return: 1-D array with the value of the expression for every row
+        """
+        values = np.asarray(values)
+        if values.ndim != 2 or values.shape[1] != len(self.variables):
+            raise ValueError(f"Expected a 2-D array with {len(self.variables)} columns, got shape {values.shape}")
+        registers = [None] * self._registers
+        for (out, step, args), frees in zip(self._program, self._frees):
+            registers[out] = step(values, *[registers[arg] for arg in args])
+            for arg in frees:
+                registers[arg] = None
+        return registers[self._program[-1][0]]
+
+
+def compile_expression(expression: Expression, variables=None) -> VectorizedEvaluator:
+    """See VectorizedEvaluator."""
+    return VectorizedEvaluator(expression, variables)
+
+
+def assignment_rows(start, stop, count):
+    """The boolean assignments start..stop-1 of `count` variables as rows, bit i of the row number is column i."""
+    numbers = np.arange(start, stop, dtype=np.int64)
+    return ((numbers[:, None] >> np.arange(count, dtype=np.int64)) & 1).astype(bool)
+
+
+def satisfying_assignments(expression, variables, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Every assignment of the boolean `variables` that satisfies `expression`, by evaluating all 2^len(variables)
+    of them in chunks of chunk_size rows.
+    :return: 1-D int64 array of the satisfying assignments, bit i is variables[i] (as in assignments._bits)
+    """
+    evaluator = compile_expression(expression, variables)
+    total = 1 << len(variables)
+    found = []
+    for start in range(0, total, chunk_size):
+        stop = min(start + chunk_size, total)
+        satisfied = np.broadcast_to(evaluator(assignment_rows(start, stop, len(variables))), (stop - start,))
+        found.append(np.flatnonzero(satisfied) + start)
+    return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
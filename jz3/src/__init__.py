@@ -1,2 +1,9 @@
 from . import config
 from . import run_solvers
+from . import solver_pool
+from . import result_cache
+from . import async_solvers
+from . import assignments
+from . import smt2_writer
+from . import export
+from . import recommender
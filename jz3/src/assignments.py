@@ -0,0 +1,172 @@
+"""
+Picks diverse assignments of the condition variables for benchmark mode.
+
+The assignments should be far apart in Hamming distance, so the benchmarked encodings differ as much as possible.
+Instead of re-maximizing the smallest distance with z3.Optimize for every new assignment, a pool of feasible
+assignments is collected with cheap SAT checks and the assignments are picked from it greedily:
+- "allsat": every feasible assignment (AllSAT with blocking clauses), for small spaces, when there are more than
+  count of them (or pool_limit cut the enumeration short) the assignments are picked from them as with "greedy"
+- "greedy": max-min distance picks from the AllSAT pool
+- "random": max-min distance picks from a pool of random-restart samples, for large spaces
+- "auto" (default): AllSAT up to 4 * count assignments, "allsat" or "greedy" when that covers the whole
+  space, "random" otherwise
+
+    models, report = diverse_assignments(global_constraints, variables, count=10)
+    report  # {"strategy": "greedy", "time": 0.004, "pool_size": 96, "exhaustive": True, "count": 10}
+"""
+import random
+import time
+
+import z3
+
+ENUMERATION_STRATEGIES = ("auto", "allsat", "greedy", "random")
+DEFAULT_POOL_LIMIT = 64
+MAX_STALLED_TRIES = 16  # random sampling gives up after this many tries in a row found nothing new
+
+
+def condition_variables(conditions):
+    """The boolean constants the conditions are made of, sorted by name."""
+    variables = {}
+    stack = list(conditions)
+    while stack:
+        expr = stack.pop()
+        if z3.is_const(expr) and expr.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+            if z3.is_bool(expr):
+                variables[expr.get_id()] = expr
+        else:
+            stack.extend(expr.children())
+    return sorted(variables.values(), key=str)
+
+
+def _bits(model, variables):
+    """The assignment of `variables` in `model` as an int, bit i is variables[i]."""
+    bits = 0
+    for i, var in enumerate(variables):
+        if z3.is_true(model.eval(var, model_completion=True)):
+            bits |= 1 << i
+    return bits
+
+
+def _literals(bits, variables):
+    return [var if bits >> i & 1 else z3.Not(var) for i, var in enumerate(variables)]
+
+
+def allsat_pool(solver, variables, limit, pool=None):
+    """
+    AllSAT over `variables` with blocking clauses, in a push/pop scope of `solver`.
+    :param pool: dict bits -> model to add to, its assignments are blocked from the start
+    :return: (dict bits -> model, True when every feasible assignment is in it)
+    """
+    pool = {} if pool is None else pool
+    solver.push()
+    try:
+        for bits in pool:
+            solver.add(z3.Not(z3.And(_literals(bits, variables))))
+        while len(pool) < limit:
+            if solver.check() != z3.sat:
+                return pool, True
+            model = solver.model()
+            bits = _bits(model, variables)
+            pool[bits] = model
+            solver.add(z3.Not(z3.And(_literals(bits, variables))))
+        return pool, solver.check() != z3.sat
+    finally:
+        solver.pop()
+
+
+def random_pool(solver, variables, limit, seed=0, pool=None):
+    """
+    Random-restart sampling: every try asks for a uniformly random assignment as assumptions, the literals of
+    the unsat core are dropped until the rest is feasible, and the solver fills them in.
+    Stops after MAX_STALLED_TRIES tries in a row that only found assignments already in the pool.
+    :return: dict bits -> model
+    """
+    pool = {} if pool is None else pool
+    rng = random.Random(seed)
+    stalled = 0
+    while len(pool) < limit and stalled < MAX_STALLED_TRIES:
+        target = [var if rng.random() < 0.5 else z3.Not(var) for var in variables]
+        while True:
+            result = solver.check(*target)
+            if result != z3.unsat:
+                break
+            core = {literal.get_id() for literal in solver.unsat_core()}
+            if not core:  # infeasible without any assumption
+                return pool
+            target = [literal for literal in target if literal.get_id() not in core]
+        stalled += 1
+        if result == z3.sat:
+            model = solver.model()
+            bits = _bits(model, variables)
+            if bits not in pool:
+                pool[bits] = model
+                stalled = 0
+    return pool
+
+
+def greedy_max_min(pool, count, first):
+    """
+    Farthest point picks: starting with `first`, every next assignment has the largest Hamming distance to
+    the closest assignment picked before it.
+    :param pool: iterable of assignments as ints
+    :return: list of up to `count` assignments
+    """
+    candidates = [bits for bits in pool if bits != first]
+    picked = [first]
+    distances = [(bits ^ first).bit_count() for bits in candidates]
+    while len(picked) < count and candidates:
+        best = max(range(len(candidates)), key=distances.__getitem__)
+        if distances[best] == 0:
+            break
+        bits = candidates.pop(best)
+        distances.pop(best)
+        picked.append(bits)
+        distances = [min(distance, (other ^ bits).bit_count()) for distance, other in zip(distances, candidates)]
+    return picked
+
+
+def diverse_assignments(global_constraints, variables, count, first=None, strategy="auto",
+                        pool_limit=DEFAULT_POOL_LIMIT, seed=0):
+    """
+    :param global_constraints: the constraints every assignment has to satisfy
+    :param variables: the condition variables (z3 Bool constants) the distance is measured over
+    :param count: number of assignments wanted
+    :param first: optional model of the global constraints that is always picked first
+    :param strategy: one of ENUMERATION_STRATEGIES
+    :param pool_limit: largest number of assignments collected before picking
+    :return: (list of up to `count` models, report) the report has the strategy used, the time spent in seconds,
+             the pool size and whether the pool holds the whole feasible space
+    """
+    if strategy not in ENUMERATION_STRATEGIES:
+        raise ValueError(f"Unknown enumeration strategy {strategy!r}, expected one of {ENUMERATION_STRATEGIES}")
+    start_time = time.perf_counter()
+    solver = z3.Solver()
+    solver.add(global_constraints)
+    pool = {}
+    if first is None:
+        if solver.check() != z3.sat:
+            return [], {"strategy": strategy, "time": time.perf_counter() - start_time, "pool_size": 0,
+                        "exhaustive": True, "count": 0}
+        first = solver.model()
+    first_bits = _bits(first, variables)
+    pool[first_bits] = first
+
+    exhaustive = False
+    if strategy != "random":
+        allsat_limit = min(pool_limit, 4 * count) if strategy == "auto" else pool_limit
+        pool, exhaustive = allsat_pool(solver, variables, max(allsat_limit, count), pool)
+    if strategy == "auto":
+        if not exhaustive:
+            strategy = "random"
+        else:
+            strategy = "allsat" if len(pool) <= count else "greedy"
+    if strategy == "random":
+        pool = random_pool(solver, variables, max(pool_limit, count), seed, pool)
+
+    if strategy == "allsat" and exhaustive and len(pool) <= count:
+        picked = list(pool)
+    else:
+        picked = greedy_max_min(pool, count, first_bits)
+    report = {"strategy": strategy, "time": time.perf_counter() - start_time, "pool_size": len(pool),
+              "exhaustive": exhaustive, "count": len(picked)}
+    return [pool[bits] for bits in picked], report
@@ -0,0 +1,246 @@
+"""
+asyncio versions of the solver runners, for programs that run jz3 inside an event loop.
+
+The solvers are started with asyncio.create_subprocess_exec, so hundreds of solver processes can be
+in flight without a thread per call. Cancelling the awaiting task kills the solver process.
+
+    limiter = asyncio.Semaphore(8)  # at most 8 solver processes at once, shared by every call
+    results = await run_solvers_async(smt2_str=query, time_out=5, limiter=limiter)
+
+    async with contextlib.aclosing(iter_solver_results(smt2_str=query)) as stream:
+        async for solver, result in stream:  # in the order the solvers finish
+            ...
+
+    results = await race_queries_async([encoding1, encoding2], time_out=5)  # {(query index, solver): result}
+"""
+import asyncio
+import contextlib
+import inspect
+import os
+import signal
+import tempfile
+import time
+
+from . import run_solvers
+
+
+def _kill(process):
+    """
+    Kills an asyncio subprocess without reaping it. Process.kill() polls the child first, a solver that already
+    exited is then reaped behind the child watcher's back, which logs "Unknown child process pid" and reports
+    returncode 255. A child that exited but is not reaped yet is left to the watcher.
+    """
+    if process.returncode is not None:
+        return
+    if not hasattr(os, "waitid"):
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+        return
+    with contextlib.suppress(ChildProcessError, ProcessLookupError):
+        if os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+            os.kill(process.pid, signal.SIGKILL)
+
+
+async def _execute_async(command, time_out, input_text=None, cpu_limit=None, memory_limit=None):
+    """
+    asyncio counterpart of run_solvers._execute.
+    The child is reaped by asyncio, so only the wall time and the exit code are measured, not the CPU time and memory.
+    Without the CPU time a cpu_limit run only counts as timed out when the limit killed the solver (z3 catches
+    SIGXCPU and answers unknown instead).
+    :return: (did_timeout, combined_output, measurements)
+    """
+    start_ns = time.perf_counter_ns()
+    process = await asyncio.create_subprocess_exec(
+        *run_solvers._limited_command(command, cpu_limit, memory_limit),
+        stdin=asyncio.subprocess.PIPE if input_text is not None else None,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    run_solvers._apply_limits(process.pid, cpu_limit, memory_limit)
+    stdout, stderr = [], []
+
+    async def write_input():
+        try:
+            process.stdin.write(input_text.encode('utf-8'))
+            await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):  # the solver exited before reading all of its input
+            pass
+
+    async def read_lines():
+        async for line in process.stdout:
+            stdout.append(((time.perf_counter_ns() - start_ns) / 1e9, line.decode('utf-8')))
+
+    async def read_stderr():
+        stderr.append((await process.stderr.read()).decode('utf-8'))
+
+    tasks = [asyncio.ensure_future(read_lines()), asyncio.ensure_future(read_stderr())]
+    if input_text is not None:
+        tasks.append(asyncio.ensure_future(write_input()))
+    tasks.append(asyncio.ensure_future(process.wait()))
+    try:
+        _, pending = await asyncio.wait(tasks, timeout=time_out)
+        did_timeout = bool(pending)
+    finally:  # also on cancellation: kill the solver, its pipes then close and every task ends once it is reaped
+        _kill(process)
+        await asyncio.gather(*tasks, return_exceptions=True)
+    measurements = {"wall_time": (time.perf_counter_ns() - start_ns) / 1e9, "returncode": process.returncode,
+                    "output_lines": stdout}
+    if not did_timeout:
+        measurements["resource_limit"] = run_solvers._exceeded_limit(process.returncode, None, cpu_limit,
+                                                                     memory_limit)
+    combined_output = "".join(line for _, line in stdout) + "".join(stderr)  # capture all output
+    return did_timeout, combined_output, measurements
+
+
+async def run_cvc5_async(smt2_file: str = '', time_out: int = 5, smt2_str: str = '', cpu_limit=None,
+                         memory_limit=None, per_check_sat=False, get_model=False, get_unsat_core=False):
+    smt2_file, smt2_str = run_solvers.prepare_query(smt2_file, smt2_str, per_check_sat, get_model, get_unsat_core)
+    start_time = time.time()
+    did_timeout, combined_output, measurements = await _execute_async(
+        run_solvers.cvc5_command(smt2_file, smt2_str), time_out, smt2_str or None, cpu_limit, memory_limit)
+    return run_solvers.shared_code("CVC5", start_time, did_timeout, combined_output, smt2_file or '<stdin>',
+                                   time_out, measurements, get_model, get_unsat_core)
+
+
+async def run_z3_async(smt2_file: str = '', time_out: int = 5, smt2_str: str = '', cpu_limit=None,
+                       memory_limit=None, per_check_sat=False, get_model=False, get_unsat_core=False):
+    smt2_file, smt2_str = run_solvers.prepare_query(smt2_file, smt2_str, per_check_sat, get_model, get_unsat_core)
+    start_time = time.time()
+    did_timeout, combined_output, measurements = await _execute_async(
+        run_solvers.z3_command(smt2_file, smt2_str), time_out, smt2_str or None, cpu_limit, memory_limit)
+    return run_solvers.shared_code("Z3", start_time, did_timeout, combined_output, smt2_file or '<stdin>',
+                                   time_out, measurements, get_model, get_unsat_core)
+
+
+# Dictionary to map solver names to their corresponding coroutine functions
+async_solvers = {
+    "cvc5": run_cvc5_async,
+    "z3": run_z3_async
+}
+
+
+async def _call_runner_async(solver, run_function, smt2_file, smt2_str, time_out, verbose, limiter,
+                             run_options=None):
+    """
+    Awaits one runner. Plain (blocking) runners, e.g. the ones of run_solvers.solvers, run in a thread with their
+    own ProcessGroup, cancelling the task kills their solver process and waits until the thread has reaped it.
+    """
+    async with limiter if limiter is not None else contextlib.nullcontext():
+        if not inspect.iscoroutinefunction(run_function):
+            process_group = run_solvers.ProcessGroup()
+            run = asyncio.ensure_future(asyncio.to_thread(run_solvers._call_runner, solver, run_function, smt2_file,
+                                                          smt2_str, time_out, verbose, process_group, run_options))
+            try:
+                return await asyncio.shield(run)
+            except asyncio.CancelledError:
+                process_group.kill_all()
+                await asyncio.gather(run, return_exceptions=True)  # the thread reaps the killed solver
+                raise
+        if verbose:
+            print(f"Running {solver}...")
+        kwargs = run_solvers._runner_kwargs(run_function, time_out, run_options=run_options)
+        if not smt2_str:
+            return await run_function(smt2_file, **kwargs)
+        if run_solvers._accepts_kwarg(run_function, "smt2_str"):
+            return await run_function(smt2_file, smt2_str=smt2_str, **kwargs)
+        with tempfile.NamedTemporaryFile('w', suffix='.smt2', prefix='jz3-') as f:
+            f.write(smt2_str)
+            f.flush()
+            return await run_function(f.name, **kwargs)
+
+
+async def _named_result(solver, awaitable):
+    return solver, await awaitable
+
+
+async def iter_solver_results(smt2_file: str = '', smt2_str: str = '', verbose=False, time_out=5,
+                              solvers=async_solvers, limiter=None, run_options=None):
+    """
+    Starts all solvers at once and yields (solver, (time, did_timeout, ans)) as each one finishes.
+    Closing the generator early cancels (and kills) the solvers that are still running.
+    """
+    if smt2_file:
+        smt2_str = ''
+    tasks = [asyncio.ensure_future(_named_result(solver, _call_runner_async(
+        solver, run_function, smt2_file, smt2_str, time_out, verbose, limiter, run_options)))
+        for solver, run_function in solvers.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:  # cancel the runs still going and wait until their solvers are killed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_solvers_async(smt2_file: str = '', smt2_str: str = '', verbose=False, time_out=5,
+                            solvers=async_solvers, policy="benchmark", limiter=None, cache=None, cpu_limit=None,
+                            memory_limit=None, per_check_sat=False, get_model=False, get_unsat_core=False):
+    """
+    asyncio counterpart of run_solvers.run_solvers, the arguments mean the same.
+    solvers: may mix coroutine functions and plain runners
+    policy: "sequential", "benchmark" (default) or "race"
+    limiter: optional asyncio.Semaphore that bounds how many solvers run at once, share it between calls
+    """
+    if policy not in run_solvers.POLICIES:
+        raise ValueError(f"Unknown policy {policy!r}, expected one of {run_solvers.POLICIES}")
+    if smt2_file:
+        smt2_str = ''
+    limits = {name: value for name, value in (("cpu_limit", cpu_limit), ("memory_limit", memory_limit))
+              if value is not None}
+    result_options = run_solvers._result_options(per_check_sat, get_model, get_unsat_core)
+    run_options = dict(limits, **result_options)
+    if result_options:
+        cache = None  # the cache only keeps the (time, did_timeout, ans) of a run
+    results = {}
+    if cache is not None:
+        query, versions, results = run_solvers._lookup_cache(cache, smt2_file, smt2_str, solvers, time_out,
+                                                             verbose, limits)
+        if policy == "race" and any(result[2] in run_solvers.DEFINITIVE_ANSWERS for result in results.values()):
+            return results
+    uncached = {solver: run_function for solver, run_function in solvers.items() if solver not in results}
+
+    new_results = {}
+    if policy == "sequential":
+        for solver, run_function in uncached.items():
+            new_results[solver] = await _call_runner_async(solver, run_function, smt2_file, smt2_str, time_out,
+                                                           verbose, limiter, run_options)
+    else:
+        async with contextlib.aclosing(iter_solver_results(smt2_file, smt2_str, verbose, time_out, uncached,
+                                                           limiter, run_options)) as stream:
+            async for solver, result in stream:
+                new_results[solver] = result
+                if policy == "race" and result[2] in run_solvers.DEFINITIVE_ANSWERS:
+                    break
+
+    if cache is not None:
+        for solver, result in new_results.items():
+            cache.put(query, solver, versions[solver], time_out, result, limits)
+    results.update(new_results)
+    return {solver: results[solver] for solver in solvers if solver in results}
+
+
+async def race_queries_async(queries, time_out=5, solvers=async_solvers, limiter=None, cpu_limit=None,
+                             memory_limit=None, get_model=False, get_unsat_core=False):
+    """
+    asyncio counterpart of run_solvers.race_queries: every solver on every query at once, the runs still going
+    are cancelled (and killed) when one answers sat/unsat.
+    :return: dict (query index, solver) -> result of the runs that finished before (and including) the winner
+    """
+    run_options = {name: value for name, value in (("cpu_limit", cpu_limit), ("memory_limit", memory_limit))
+                   if value is not None}
+    run_options.update(run_solvers._result_options(get_model=get_model, get_unsat_core=get_unsat_core))
+    tasks = [asyncio.ensure_future(_named_result((index, solver), _call_runner_async(
+        solver, run_function, '', query, time_out, False, limiter, run_options)))
+        for index, query in enumerate(queries) for solver, run_function in solvers.items()]
+    results = {}
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, result = await next_done
+            results[key] = result
+            if result[2] in run_solvers.DEFINITIVE_ANSWERS:
+                break
+    finally:  # cancel the runs still going and wait until their solvers are killed
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return results
@@ -0,0 +1,227 @@
+"""
+jz3-bench: runs every solver on every SMT2 instance and stores the timings in sqlite.
+
+    jz3-bench problems_instances/particular_hard_instances_records/smt2_files --pattern "*" \
+        --solvers cvc5,z3 --time-out 5 --jobs 16 --pin-cpus --db argyle_time.db
+
+The table has the layout that analysis/scripts/plot_comparison.ConstraintPlotter reads:
+the encoding columns (is_classic, is_distinct, is_per_col, is_no_num, is_prefill) are filled from the
+encoding names in the file names (classic/argyle, distinct/PbEq, percol/inorder, is_bool/is_num,
+prefill/no_prefill), and files that only differ in those names share one instance_id, also across campaigns
+that append to the same table. The grid columns stay empty, a file does not know its grid; the `instance` and
+`file` columns hold the file path without and with the encoding names, and `features` the
+recommender.formula_features of the file (JSON), what the encoding recommender learns from.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import run_solvers
+
+ENCODING_COLUMNS = [  # (column, name when true, name when false)
+    ("is_classic", "classic", "argyle"),
+    ("is_distinct", "distinct", "PbEq"),
+    ("is_per_col", "percol", "inorder"),
+    ("is_no_num", "is_bool", "is_num"),
+    ("is_prefill", "prefill", "no_prefill"),
+]
+COMMIT_EVERY = 100
+RECORD_COLUMNS = [("instance", "TEXT"), ("file", "TEXT"), ("features", "TEXT")]
+
+
+def find_instances(paths, pattern="*.smt2"):
+    """Expands files, directories (searched recursively with `pattern`) and globs into a sorted list of files."""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob.glob(os.path.join(path, "**", pattern), recursive=True))
+        elif os.path.isfile(path):
+            files.add(path)
+        else:
+            files.update(glob.glob(path, recursive=True))
+    return sorted(f for f in files if os.path.isfile(f))
+
+
+def _name_pattern(name):
+    return re.compile(rf"(?<![A-Za-z]){re.escape(name)}(?![A-Za-z])")
+
+
+_ENCODING_PATTERNS = [(column, _name_pattern(true_name), _name_pattern(false_name))
+                      for column, true_name, false_name in ENCODING_COLUMNS]
+
+
+def encoding_flags(file_name):
+    """:return: dict column -> True/False/None (not in the file name)"""
+    flags = {}
+    for column, true_pattern, false_pattern in _ENCODING_PATTERNS:
+        # "no_prefill" also contains "prefill", so the false name is looked at first
+        if false_pattern.search(file_name):
+            flags[column] = False
+        elif true_pattern.search(file_name):
+            flags[column] = True
+        else:
+            flags[column] = None
+    return flags
+
+
+def instance_key(file_path):
+    """The file path without its encoding names, files of one instance in different encodings share it."""
+    key = file_path
+    for _, true_pattern, false_pattern in _ENCODING_PATTERNS:
+        key = false_pattern.sub("", key)
+        key = true_pattern.sub("", key)
+    return key
+
+
+def create_table(conn, table, solver_names):
+    solver_columns = "".join(f", {name}_time FLOAT, {name}_is_timeout BOOL, {name}_state STRING"
+                             for name in solver_names)
+    encoding_columns = "".join(f", {column} BOOL" for column, _, _ in ENCODING_COLUMNS)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (ID INTEGER PRIMARY KEY AUTOINCREMENT, instance_id INT, "
+                 f"grid TEXT, idx STRING, try_Val INT, assert_equals BOOL, is_sat STRING"
+                 f"{encoding_columns}{solver_columns})")
+    # tables of older campaigns (or other solvers) get the missing columns
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    wanted = RECORD_COLUMNS + [(f"{name}_{field}", kind) for name in solver_names
+                             for field, kind in (("time", "FLOAT"), ("is_timeout", "BOOL"), ("state", "STRING"))]
+    for column, kind in wanted:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+
+def _instance_ids(conn, table, keys):
+    """
+    :return: dict instance key -> instance_id, the ids of the instances already in the table are kept and the
+             new ones continue after the largest id
+    """
+    ids = dict(conn.execute(f"SELECT instance, MIN(instance_id) FROM {table} WHERE instance IS NOT NULL "
+                            f"GROUP BY instance"))
+    next_id = conn.execute(f"SELECT COALESCE(MAX(instance_id) + 1, 0) FROM {table}").fetchone()[0]
+    for key in sorted(set(keys) - set(ids)):
+        ids[key] = next_id
+        next_id += 1
+    return ids
+
+
+_worker_solvers = None
+
+
+def _init_worker(solver_names, counter, cpus):
+    global _worker_solvers
+    _worker_solvers = {name: run_solvers.solvers[name] for name in solver_names}
+    if cpus:
+        with counter.get_lock():
+            worker_index = counter.value
+            counter.value += 1
+        os.sched_setaffinity(0, {cpus[worker_index % len(cpus)]})  # the solver processes inherit it
+
+
+def file_features(file_path):
+    """:return: the recommender.formula_features of the assertions of an SMT2 file, None when z3 cannot parse it"""
+    import z3
+    from .recommender import formula_features  # the recommender imports this module
+    try:
+        return formula_features(z3.parse_smt2_file(file_path, ctx=z3.Context()))
+    except z3.Z3Exception:
+        return None
+
+
+def _run_instance(file_path, time_out, cpu_limit, memory_limit):
+    results = run_solvers.run_solvers(smt2_file=file_path, time_out=time_out, solvers=_worker_solvers,
+                                      cpu_limit=cpu_limit, memory_limit=memory_limit)
+    return file_path, results, file_features(file_path)
+
+
+def run_campaign(files, solver_names, db_path, table="benchmark_results", time_out=5, jobs=None,
+                 pin_cpus=False, cpu_limit=None, memory_limit=None, verbose=False):
+    """
+    Runs every solver on every file in a process pool, one instance per worker at a time.
+    The solvers of one instance run one after the other, so a pinned worker keeps its CPU to itself.
+    :return: number of instances written
+    """
+    unknown = [name for name in solver_names if name not in run_solvers.solvers]
+    if unknown:
+        raise ValueError(f"Unknown solvers {unknown}, expected some of {list(run_solvers.solvers)}")
+    jobs = jobs or os.cpu_count()
+    cpus = []
+    if pin_cpus:
+        if not hasattr(os, "sched_setaffinity"):
+            raise NotImplementedError(f"CPU pinning is not supported on {sys.platform}")
+        cpus = sorted(os.sched_getaffinity(0))
+        jobs = min(jobs, len(cpus))
+
+    conn = sqlite3.connect(db_path)
+    create_table(conn, table, solver_names)
+    instance_ids = _instance_ids(conn, table, [instance_key(f) for f in files])
+    columns = (["instance_id", "instance", "file", "features", "is_sat"] +
+               [column for column, _, _ in ENCODING_COLUMNS] +
+               [f"{name}_{field}" for name in solver_names for field in ("time", "is_timeout", "state")])
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    written = 0
+    counter = multiprocessing.Value("i", 0)
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(solver_names, counter, cpus)) as executor:
+            futures = {executor.submit(_run_instance, f, time_out, cpu_limit, memory_limit): f for f in files}
+            for future in as_completed(futures):
+                file_path = futures[future]
+                try:
+                    _, results, features = future.result()
+                except Exception as exc:  # e.g. a crashed worker, the instance is recorded as an error
+                    print(f"{file_path} failed: {exc!r}", file=sys.stderr)
+                    results, features = {name: (None, None, "error") for name in solver_names}, None
+                answers = [results[name][2] for name in solver_names]
+                is_sat = next((answer for answer in answers if answer in run_solvers.DEFINITIVE_ANSWERS),
+                              answers[0])
+                flags = encoding_flags(os.path.basename(file_path))
+                key = instance_key(file_path)
+                row = ([instance_ids[key], key, file_path, features and json.dumps(features), is_sat] +
+                       [flags[column] for column, _, _ in ENCODING_COLUMNS] +
+                       [value for name in solver_names for value in results[name][:3]])
+                conn.execute(insert, row)
+                written += 1
+                if written % COMMIT_EVERY == 0:
+                    conn.commit()
+                if verbose:
+                    print(f"[{written}/{len(files)}] {file_path}: {answers}")
+    finally:  # keep what was written, also when the campaign is interrupted
+        conn.commit()
+        conn.close()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="jz3-bench", description="Benchmark SMT solvers on SMT2 instances.")
+    parser.add_argument("paths", nargs="+", help="SMT2 files, directories or glob patterns")
+    parser.add_argument("--pattern", default="*.smt2", help="file pattern used inside directories (default *.smt2)")
+    parser.add_argument("--solvers", default=",".join(run_solvers.solvers),
+                        help="comma separated solver names (default %(default)s)")
+    parser.add_argument("--time-out", type=float, default=5, help="seconds per solver and instance")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--pin-cpus", action="store_true", help="pin every worker to its own CPU")
+    parser.add_argument("--cpu-limit", type=float, default=None, help="CPU seconds limit of every solver process")
+    parser.add_argument("--memory-limit", type=int, default=None, help="memory limit in bytes of every solver process")
+    parser.add_argument("--db", default="benchmark_results.db", help="sqlite file the results are added to")
+    parser.add_argument("--table", default="benchmark_results")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    args = parser.parse_args(argv)
+
+    files = find_instances(args.paths, args.pattern)
+    if not files:
+        parser.error("no SMT2 instances found")
+    solver_names = [name.strip() for name in args.solvers.split(",") if name.strip()]
+    written = run_campaign(files, solver_names, args.db, args.table, args.time_out, args.jobs, args.pin_cpus,
+                           args.cpu_limit, args.memory_limit, args.verbose)
+    print(f"Wrote {written} instances to {args.db}:{args.table}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+Turns assertions into the SMT2 text the external solvers get.
+
+- infer_logic picks the smallest SMT-LIB logic the assertions fit in, so the solvers can use their fast paths for
+  it (and do not reject bit-vectors or uninterpreted functions under a fixed QF_LIA)
+- preprocess optionally runs a z3 tactic pipeline first and reports how much the formula shrank.
+  The tactics keep satisfiability, not models, so sat/unsat answers stay comparable
+- read_model and read_unsat_core map the (get-model) / (get-unsat-core) responses of an external solver
+  (SolverResult.model / unsat_core) back to the z3 expressions the script was written from
+
+    smt2_str, stats = to_smt2(solver.assertions(), tactics=DEFAULT_TACTICS)
+    stats  # {"logic": "QF_LIA", "tactics": [...], "size_before": 5400, "size_after": 3100, ...}
+
+    smt2_str, _ = to_smt2(exprs, named=True)
+    result = run_solvers.run_cvc5(smt2_str=smt2_str, get_model=True, get_unsat_core=True)
+    read_model(result.model, exprs)  # {x: 4, y: 0}
+    read_unsat_core(result.unsat_core, exprs)  # [x > 3, x < 2]
+"""
+import time
+from io import StringIO
+
+import z3
+
+from .smt2_writer import SMT2Writer
+
+DEFAULT_TACTICS = ("simplify", "propagate-values", "solve-eqs", "elim-uncnstr")
+FALLBACK_LOGIC = "ALL"
+ASSERTION_PREFIX = "jz3!a"  # to_smt2(named=True) names the i-th assertion jz3!a<i>
+KNOWN_LOGICS = {
+    "QF_UF", "QF_LIA", "QF_NIA", "QF_LRA", "QF_NRA", "QF_LIRA", "QF_NIRA",
+    "QF_UFLIA", "QF_UFNIA", "QF_UFLRA", "QF_UFNRA", "QF_UFLIRA",
+    "QF_BV", "QF_UFBV", "QF_ABV", "QF_AUFBV", "QF_AX", "QF_ALIA", "QF_AUFLIA",
+    "UF", "LIA", "NIA", "LRA", "NRA", "UFLIA", "UFNIA", "UFLRA", "UFNRA",
+    "BV", "UFBV", "ABV", "AUFBV", "AUFLIA", "AUFLIRA", "AUFNIRA",
+}
+_NONLINEAR_OPS = (z3.Z3_OP_MUL, z3.Z3_OP_DIV, z3.Z3_OP_IDIV, z3.Z3_OP_MOD, z3.Z3_OP_REM, z3.Z3_OP_POWER)
+
+
+def _is_numeral(expr):
+    return z3.is_int_value(expr) or z3.is_rational_value(expr) or z3.is_algebraic_value(expr)
+
+
+def _logic_features(exprs):
+    features = set()
+    visited = set()
+    stack = list(exprs)
+    while stack:
+        expr = stack.pop()
+        key = expr.get_id()
+        if key in visited:
+            continue
+        visited.add(key)
+        if z3.is_quantifier(expr):
+            features.add("quantifiers")
+            stack.append(expr.body())
+            continue
+        if not z3.is_app(expr):
+            continue
+        sort_kind = expr.sort().kind()
+        if sort_kind == z3.Z3_INT_SORT:
+            features.add("int")
+        elif sort_kind == z3.Z3_REAL_SORT:
+            features.add("real")
+        elif sort_kind == z3.Z3_BV_SORT:
+            features.add("bv")
+        elif sort_kind == z3.Z3_ARRAY_SORT:
+            features.add("arrays")
+        elif sort_kind == z3.Z3_UNINTERPRETED_SORT:
+            features.add("uf")
+        elif sort_kind not in (z3.Z3_BOOL_SORT,):
+            features.add("other")  # strings, floating point, datatypes, ...
+        decl = expr.decl()
+        if decl.kind() == z3.Z3_OP_UNINTERPRETED and decl.arity() > 0:
+            features.add("uf")
+        elif decl.kind() in _NONLINEAR_OPS and sort_kind in (z3.Z3_INT_SORT, z3.Z3_REAL_SORT):
+            # only a product with at most one non-numeral factor (or a division by a numeral) is linear
+            args = expr.children()
+            if (sum(not _is_numeral(arg) for arg in args) > 1 or
+                    (decl.kind() != z3.Z3_OP_MUL and not _is_numeral(args[-1]))):
+                features.add("nonlinear")
+        elif decl.kind() in (z3.Z3_OP_TO_REAL, z3.Z3_OP_TO_INT, z3.Z3_OP_IS_INT):
+            features.update(("int", "real"))
+        stack.extend(expr.children())
+    return features
+
+
+def infer_logic(exprs):
+    """
+    :param exprs: z3 assertions
+    :return: the smallest SMT-LIB logic name that covers them, FALLBACK_LOGIC ("ALL") when there is none
+    """
+    features = _logic_features(exprs)
+    if "other" in features:
+        return FALLBACK_LOGIC
+    arithmetic = ("I" if "int" in features else "") + ("R" if "real" in features else "")
+    if arithmetic:
+        arithmetic = ("N" if "nonlinear" in features else "L") + arithmetic + "A"
+    theories = ("UF" if "uf" in features else "") + ("BV" if "bv" in features else "") + arithmetic
+    if "arrays" in features:
+        theories = "A" + theories if theories else "AX"  # e.g. QF_ALIA, QF_AUFBV, only arrays is QF_AX
+    logic = ("" if "quantifiers" in features else "QF_") + (theories or "UF")  # propositional is QF_UF
+    return logic if logic in KNOWN_LOGICS else FALLBACK_LOGIC
+
+
+def dag_size(exprs):
+    """Number of distinct subterms of the assertions."""
+    visited = set()
+    stack = list(exprs)
+    while stack:
+        expr = stack.pop()
+        key = expr.get_id()
+        if key in visited:
+            continue
+        visited.add(key)
+        if z3.is_quantifier(expr):
+            stack.append(expr.body())
+        elif z3.is_app(expr):
+            stack.extend(expr.children())
+    return len(visited)
+
+
+def preprocess(exprs, tactics=DEFAULT_TACTICS):
+    """
+    Runs the tactics one after the other on the assertions.
+    :param tactics: z3 tactic names, e.g. DEFAULT_TACTICS
+    :return: (list of assertions, stats) the stats have the sizes before and after and the seconds it took
+    """
+    exprs = list(exprs)
+    start_time = time.perf_counter()
+    goal = z3.Goal()
+    goal.add(*exprs)
+    subgoals = z3.Then(*tactics)(goal) if len(tactics) > 1 else z3.Tactic(tactics[0])(goal)
+    if len(subgoals) == 1:
+        result = list(subgoals[0])
+    else:  # a tactic split the goal into cases
+        result = [z3.Or([z3.And(list(subgoal)) for subgoal in subgoals])]
+    stats = {"tactics": list(tactics), "time": time.perf_counter() - start_time,
+             "assertions_before": len(exprs), "assertions_after": len(result),
+             "size_before": dag_size(exprs), "size_after": dag_size(result)}
+    return result, stats
+
+
+def to_smt2(exprs, logic=None, tactics=None, named=False):
+    """
+    The SMT2 script that checks the assertions.
+    :param logic: SMT-LIB logic, inferred from the (preprocessed) assertions when None
+    :param tactics: optional tactic names to preprocess the assertions with, see preprocess
+    :param named: name the assertions for unsat cores, see read_unsat_core
+    :return: (smt2_str, stats) stats has the logic and, with tactics, the preprocess stats
+    """
+    exprs = list(exprs)
+    stats = {}
+    if tactics:
+        exprs, stats = preprocess(exprs, tactics)
+    stats["logic"] = logic or infer_logic(exprs)
+    output = StringIO()
+    writer = SMT2Writer(output)
+    writer.set_logic(stats["logic"])
+    for i, expr in enumerate(exprs):
+        writer.assert_expr(expr, f"|{ASSERTION_PREFIX}{i}|" if named else None)
+    writer.check_sat()
+    return output.getvalue(), stats
+
+
+def _constants(exprs):
+    """The uninterpreted constants of the assertions by name."""
+    constants = {}
+    visited = set()
+    stack = list(exprs)
+    while stack:
+        expr = stack.pop()
+        key = expr.get_id()
+        if key in visited:
+            continue
+        visited.add(key)
+        if z3.is_quantifier(expr):
+            stack.append(expr.body())
+        elif z3.is_app(expr):
+            if expr.num_args() == 0 and expr.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                constants[expr.decl().name()] = expr
+            stack.extend(expr.children())
+    return constants
+
+
+def _parse_values(values, constants):
+    """:return: dict constant -> z3 value, parsed by z3 in one go"""
+    names = list(values)
+    script = "".join(f"(assert (= {constants[name].sexpr()} {values[name]}))" for name in names)
+    decls = {name: constants[name] for name in names}
+    return {constants[name]: equality.arg(1) for name, equality in
+            zip(names, z3.parse_smt2_string(script, decls=decls))}
+
+
+def read_model(model, exprs):
+    """
+    Maps the model of an external solver back to z3.
+    :param model: dict constant name -> value text, SolverResult.model
+    :param exprs: the assertions the script was written from
+    :return: dict z3 constant of `exprs` -> z3 value, constants the model has no (readable) value for are left out,
+             e.g. the elements of uninterpreted sorts
+    """
+    constants = _constants(exprs)
+    values = {name: value for name, value in (model or {}).items() if name in constants}
+    try:
+        return _parse_values(values, constants)
+    except z3.Z3Exception:  # one value z3 cannot read, the others still can be
+        result = {}
+        for name, value in values.items():
+            try:
+                result.update(_parse_values({name: value}, constants))
+            except z3.Z3Exception:
+                pass
+        return result
+
+
+def read_unsat_core(unsat_core, exprs):
+    """
+    :param unsat_core: the assertion names of SolverResult.unsat_core, of a script written with to_smt2(named=True)
+                       and without tactics
+    :param exprs: the assertions the script was written from
+    :return: the assertions of `exprs` in the core
+    """
+    exprs = list(exprs)
+    core = []
+    for name in unsat_core or ():
+        if name.startswith(ASSERTION_PREFIX) and name[len(ASSERTION_PREFIX):].isdigit():
+            index = int(name[len(ASSERTION_PREFIX):])
+            if index < len(exprs):
+                core.append(exprs[index])
+    return core
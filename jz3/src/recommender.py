@@ -0,0 +1,180 @@
+"""
+Recommends the condition-variable assignment (encoding) and solver that are likely fastest, from earlier benchmark
+records, so production runs can try the fast encoding first instead of exploring.
+
+A record is one benchmarked encoding of one instance:
+    {"features": {"terms": 5400, ...}, "assignment": {"classic": True, "argyle": False, ...},
+     "times": {"z3": (0.8, False), "cvc5": (5.0, True)}}
+Records come from the sqlite tables written by jz3-bench (load_records, the `features` column holds the
+formula_features of the benchmarked file), or from the runs of check_conditional_constraints(strategy="predicted")
+itself, with the formula_features of the assertions each assignment turns on. Both describe the formula that was
+solved, so they are compared like with like.
+
+The model is a nearest neighbour average: every candidate assignment is scored with the PAR-2 time (a timeout
+counts twice the time out) of the `neighbours` records whose encoding agrees with it and whose features are the
+closest to the candidate's formula (only the feature names both sides have are compared).
+Records without comparable features, e.g. the rows of the older tables like argyle_time.db that only have the
+grid, are only used when no comparable record agrees: the score is then the global PAR-2 mean of the encoding.
+
+    recommender = EncodingRecommender.from_database("argyle_time.db")
+    ranking = recommender.rank([formula_features(assertions) for assertions in encodings], candidates)
+"""
+import json
+import math
+import os
+import sqlite3
+from collections import Counter
+
+import z3
+
+from .bench import ENCODING_COLUMNS
+
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "analysis", "scripts", "argyle_time.db")
+TIMEOUT_PENALTY = 2  # PAR-2
+_ARITHMETIC_OPS = {z3.Z3_OP_ADD, z3.Z3_OP_SUB, z3.Z3_OP_MUL, z3.Z3_OP_DIV, z3.Z3_OP_IDIV, z3.Z3_OP_MOD,
+                   z3.Z3_OP_LE, z3.Z3_OP_LT, z3.Z3_OP_GE, z3.Z3_OP_GT, z3.Z3_OP_UMINUS}
+
+
+def formula_features(exprs):
+    """
+    Cheap structural features of the assertions: number of distinct terms and variables, the share of
+    arithmetic terms and a histogram of the operators ("op:<name>", as a share of all terms).
+    """
+    visited = set()
+    variables = set()
+    ops = Counter()
+    stack = list(exprs)
+    while stack:
+        expr = stack.pop()
+        key = expr.get_id()
+        if key in visited:
+            continue
+        visited.add(key)
+        if z3.is_quantifier(expr):
+            ops["quantifier"] += 1
+            stack.append(expr.body())
+            continue
+        if not z3.is_app(expr):
+            continue
+        decl = expr.decl()
+        if decl.kind() == z3.Z3_OP_UNINTERPRETED:
+            if expr.num_args() == 0:
+                variables.add(key)
+        elif expr.num_args() > 0:
+            ops[decl.name()] += 1
+            if decl.kind() in _ARITHMETIC_OPS:
+                ops["arithmetic"] += 1
+        stack.extend(expr.children())
+    terms = max(len(visited), 1)
+    features = {"terms": len(visited), "vars": len(variables), "arith_density": ops.pop("arithmetic", 0) / terms}
+    features.update((f"op:{name}", count / terms) for name, count in ops.items())
+    return features
+
+
+def load_records(db_path, table=None):
+    """
+    Reads the records of a benchmark table with the ConstraintPlotter layout (see bench.create_table).
+    :param table: defaults to every table that has the encoding columns
+    :return: list of records
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = [table] if table else [name for name, in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+        records = []
+        for name in tables:
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({name})")]
+            if not all(column in columns for column, _, _ in ENCODING_COLUMNS):
+                continue
+            solver_names = [column[:-len("_time")] for column in columns if column.endswith("_time")
+                            and f"{column[:-len('_time')]}_is_timeout" in columns]
+            for row in conn.execute(f"SELECT * FROM {name}"):
+                row = dict(zip(columns, row))
+                assignment = {}
+                for column, true_name, false_name in ENCODING_COLUMNS:
+                    if row[column] is not None:
+                        assignment[true_name] = bool(row[column])
+                        assignment[false_name] = not row[column]
+                times = {solver: (row[f"{solver}_time"], bool(row[f"{solver}_is_timeout"]))
+                         for solver in solver_names if row[f"{solver}_time"] is not None}
+                features = json.loads(row["features"]) if row.get("features") else {}
+                records.append({"features": features, "assignment": assignment, "times": times})
+        return records
+    finally:
+        conn.close()
+
+
+def _distance(features, other):
+    """Mean relative difference of the shared features, inf when there are none: the records are not comparable."""
+    shared = [name for name in features if name in other]
+    if not shared:
+        return math.inf
+    return sum(abs(features[name] - other[name]) / (abs(features[name]) + abs(other[name]) + 1e-9)
+               for name in shared) / len(shared)
+
+
+def _agrees(assignment, record_assignment):
+    shared = [name for name in assignment if name in record_assignment]
+    return bool(shared) and all(bool(assignment[name]) == record_assignment[name] for name in shared)
+
+
+class EncodingRecommender:
+    def __init__(self, records=(), neighbours=50):
+        """
+        :param records: the training records, see the module docstring
+        :param neighbours: number of records with the closest features that vote
+        """
+        self.records = list(records)
+        self.neighbours = neighbours
+
+    @classmethod
+    def from_database(cls, db_path=DEFAULT_DATABASE, table=None, **kwargs):
+        """A recommender trained on a benchmark database, an empty one when the file does not exist."""
+        return cls(load_records(db_path, table) if os.path.exists(db_path) else (), **kwargs)
+
+    def add(self, features, assignment, solver_results):
+        """
+        Learns from a new run.
+        :param assignment: dict condition variable name -> bool
+        :param solver_results: dict solver -> (time, did_timeout, ans) as run_solvers returns it
+        """
+        self.records.append({"features": dict(features),
+                             "assignment": {str(name): bool(value) for name, value in assignment.items()},
+                             "times": {solver: (result[0], bool(result[1])) for solver, result in
+                                       solver_results.items()}})
+
+    def rank(self, features, candidates, solvers=None):
+        """
+        :param features: formula_features of the formula of every candidate (list), or one dict for all of them
+        :param candidates: the assignments to choose from, dicts condition variable name -> bool
+        :param solvers: optional solver names to choose from
+        :return: [(score, candidate index, solver)] best first, score is the mean PAR-2 seconds of the nearest
+                 agreeing records (inf when no record agrees, solver None then)
+        """
+        if isinstance(features, dict):
+            features = [features] * len(candidates)
+        ranking = []
+        for index, (candidate, candidate_features) in enumerate(zip(candidates, features)):
+            agreeing = [(_distance(candidate_features, record["features"]), position, record)
+                        for position, record in enumerate(self.records)
+                        if _agrees(candidate, record["assignment"])]
+            comparable = sorted(entry for entry in agreeing if entry[0] != math.inf)
+            # without comparable records every agreeing record votes, the global best of the encoding
+            nearest = [record for _, _, record in comparable[:self.neighbours]] if comparable else \
+                [record for _, _, record in agreeing]
+            times = {}
+            for record in nearest:
+                for solver, (time, timed_out) in record["times"].items():
+                    if solvers is None or solver in solvers:
+                        times.setdefault(solver, []).append(time * TIMEOUT_PENALTY if timed_out else time)
+            scores = [(sum(values) / len(values), solver) for solver, values in times.items()]
+            score, solver = min(scores) if scores else (math.inf, None)
+            ranking.append((score, index, solver))
+        ranking.sort(key=lambda entry: (entry[0], entry[1]))
+        return ranking
+
+    def predict(self, features, candidates, solvers=None):
+        """:return: (candidate index, solver) of the best ranked candidate, (0, None) without any agreeing record"""
+        _, index, solver = self.rank(features, candidates, solvers)[0]
+        return index, solver
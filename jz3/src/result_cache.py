@@ -0,0 +1,112 @@
+"""
+Persistent cache of solver results, so re-running a benchmark only pays for the queries that changed.
+
+Results are keyed by the sha256 of the normalized SMT2 text (comments and layout removed),
+the solver name, the solver version and the resource limits (cpu_limit, memory_limit) of the run, a run under
+limits never answers for a run without them. The time out is stored next to the result:
+- a timeout is only reused when the new time out is <= the cached one
+- an answer is reused for any time out, when it took longer than the new time out it is reported as a timeout
+The file is kept below `max_entries` rows by dropping the least recently used results.
+
+    cache = ResultCache("results.db")
+    run_solvers.run_solvers(smt2_str=query, cache=cache)
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from .sexpr import iter_commands, iter_tokens
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "jz3", "results.db")
+UNCACHED_ANSWERS = ("error", "resource_limit")
+
+
+def normalize_smt2(smt2_str: str) -> str:
+    """
+    Drops comments and collapses the whitespace between tokens, so formatting changes do not invalidate the cache.
+    String literals and quoted symbols are kept as they are, whitespace in there is part of the query.
+    """
+    return "\n".join(" ".join(iter_tokens(command)) for command in iter_commands(smt2_str))
+
+
+def smt2_key(smt2_str: str, solver: str, version: str, limits=None) -> str:
+    """:param limits: optional dict of the resource limits of the run, e.g. {"cpu_limit": 10}"""
+    digest = hashlib.sha256()
+    limits_text = ",".join(f"{name}={value}" for name, value in sorted((limits or {}).items()) if value is not None)
+    for part in (solver, version, limits_text, normalize_smt2(smt2_str)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 100_000):
+        """
+        :param path: sqlite file, created if missing. Use ":memory:" for a cache that lives in this process only
+        :param max_entries: least recently used results are dropped beyond this number
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()  # run_solvers may use the cache from its worker threads
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY, solver TEXT, version TEXT, time_out REAL,
+                time REAL, timed_out BOOL, answer TEXT, last_used REAL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._conn.commit()
+
+    def get(self, smt2_str: str, solver: str, version: str, time_out, limits=None):
+        """
+        :param limits: the resource limits of the run, see smt2_key
+        :return: (time, did_timeout, ans) valid for `time_out`, or None when the query has to be run
+        """
+        key = smt2_key(smt2_str, solver, version, limits)
+        with self._lock:
+            row = self._conn.execute("SELECT time_out, time, timed_out, answer FROM results WHERE key=?",
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            cached_time_out, cached_time, timed_out, answer = row
+            if timed_out and time_out > cached_time_out:
+                return None  # it might finish with the longer time out
+            self._conn.execute("UPDATE results SET last_used=? WHERE key=?", (time.time(), key))
+            self._conn.commit()
+        if timed_out or cached_time > time_out:
+            return time_out, True, "timeout"
+        return cached_time, False, answer
+
+    def put(self, smt2_str: str, solver: str, version: str, time_out, result, limits=None):
+        """Stores the (time, did_timeout, ans) of one run. Errors are not cached."""
+        total_time, did_timeout, answer = result[:3]
+        if answer in UNCACHED_ANSWERS:
+            return
+        key = smt2_key(smt2_str, solver, version, limits)
+        with self._lock:
+            row = self._conn.execute("SELECT time_out, timed_out FROM results WHERE key=?", (key,)).fetchone()
+            if row is not None and did_timeout and (not row[1] or row[0] >= time_out):
+                return  # the cached result already says more than this timeout
+            self._conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (key, solver, version, time_out, total_time, bool(did_timeout), answer,
+                                time.time()))
+            self._conn.execute("""
+                DELETE FROM results WHERE key IN (
+                    SELECT key FROM results ORDER BY last_used ASC
+                    LIMIT max(0, (SELECT COUNT(*) FROM results) - ?))""", (self.max_entries,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -2,81 +2,568 @@ import subprocess
 import time
 import os
 import sys
+import functools
+import math
+import signal
+import inspect
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 import warnings
 
+import z3
+
+from .sexpr import iter_commands, command_name, iter_sexprs, to_text, symbol_name
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 class SMTFileErrorWarning(UserWarning):
     pass
 
-def run_cvc5(smt2_file, time_out: int = 5):
+
+CHECK_SAT_COMMANDS = ("check-sat", "check-sat-assuming")
+CHECK_SAT_ANSWERS = ("sat", "unsat", "unknown")
+CHECK_SAT_MARKER = "jz3-check-sat-"
+
+
+class SolverResult(tuple):
+    """
+    The (time, did_timeout, ans) tuple of one solver run, with the measured resource usage as attributes:
+    - wall_time: monotonic wall clock seconds (perf_counter_ns), also measured when the run timed out
+    - user_time, sys_time: CPU seconds of the solver process, None when they could not be measured
+    - max_rss: peak resident set size of the solver process in bytes, None when it could not be measured
+    - returncode: exit code of the process, negative for the signal that killed it
+    - check_sats: list of (answer, seconds) with one entry per check-sat of the script, see parse_check_sats
+    - model: dict constant name -> value text of the (get-model) response of a sat run, see parse_model,
+      None when it was not asked for (get_model)
+    - unsat_core: list of the assertion names of the (get-unsat-core) response of an unsat run, None when it was
+      not asked for (get_unsat_core)
+    """
+    def __new__(cls, total_time, did_timeout, ans, wall_time=None, user_time=None, sys_time=None, max_rss=None,
+                returncode=None, check_sats=None, model=None, unsat_core=None):
+        result = super().__new__(cls, (total_time, did_timeout, ans))
+        result.check_sats = check_sats if check_sats is not None else []
+        result.model = model
+        result.unsat_core = unsat_core
+        result.wall_time = wall_time
+        result.user_time = user_time
+        result.sys_time = sys_time
+        result.max_rss = max_rss
+        result.returncode = returncode
+        return result
+
+    def __getnewargs__(self):  # keeps the attributes when results are pickled between processes
+        return tuple(self)
+
+    @property
+    def cpu_time(self):
+        if self.user_time is None:
+            return None
+        return self.user_time + self.sys_time
+
+
+class ProcessGroup:
+    """
+    Keeps track of the solver processes started for one `run_solvers` call,
+    so that the losing solvers of a race can be killed once a winner is known.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self.cancelled = False
+
+    def register(self, process):
+        with self._lock:
+            if self.cancelled:
+                process.kill()
+            self._processes.add(process)
+
+    def unregister(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def kill_all(self):
+        with self._lock:
+            self.cancelled = True
+            for process in self._processes:
+                process.kill()
+
+
+def _rlimits(cpu_limit=None, memory_limit=None):
+    """
+    :param cpu_limit: CPU seconds (RLIMIT_CPU), the process gets SIGXCPU when it runs out and SIGKILL a second later
+    :param memory_limit: bytes of address space (RLIMIT_AS)
+    :return: list of (resource, (soft, hard))
+    """
+    if cpu_limit is None and memory_limit is None:
+        return []
+    if resource is None:
+        raise NotImplementedError(f"resource limits are not supported on {sys.platform}")
+    limits = []
+    if cpu_limit is not None:
+        seconds = max(1, math.ceil(cpu_limit))
+        limits.append((resource.RLIMIT_CPU, (seconds, seconds + 1)))
+    if memory_limit is not None:
+        limits.append((resource.RLIMIT_AS, (memory_limit, memory_limit)))
+    return limits
+
+
+def _limited_command(command, cpu_limit=None, memory_limit=None):
+    """
+    The command that starts the solver under the limits. No preexec_fn: the runners start their processes from
+    worker threads, where it is not safe. With resource.prlimit (linux) the command stays as it is and
+    _apply_limits sets the limits right after the spawn, without it a shell sets them with ulimit and execs
+    the solver.
+    """
+    limits = _rlimits(cpu_limit, memory_limit)
+    if not limits or hasattr(resource, "prlimit"):
+        return command
+    settings = []
+    for limit, (soft, _) in limits:
+        if limit == resource.RLIMIT_CPU:
+            settings.append(f"ulimit -t {soft}")
+        else:
+            settings.append(f"ulimit -v {max(1, soft // 1024)}")
+    return ["/bin/sh", "-c", "; ".join(settings) + '; exec "$@"', "sh", *command]
+
+
+def _apply_limits(pid, cpu_limit=None, memory_limit=None):
+    """Sets the limits on a started solver process, see _limited_command."""
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    for limit, values in _rlimits(cpu_limit, memory_limit):
+        try:
+            resource.prlimit(pid, limit, values)
+        except ProcessLookupError:  # it already exited
+            return
+
+
+def _exceeded_limit(returncode, cpu_time=None, cpu_limit=None, memory_limit=None):
+    """
+    Which limit a solver process ran into, for processes that jz3 did not kill itself.
+    :return: "cpu" when it used up its CPU time (z3 catches SIGXCPU and answers unknown, others die of it),
+             "memory" when it died of a signal under a memory limit, else None
+    """
+    if cpu_limit is not None:
+        # the kernel counts a little more CPU time than the rusage shows
+        if cpu_time is not None and cpu_time >= 0.95 * max(1, math.ceil(cpu_limit)):
+            return "cpu"
+        if returncode == -getattr(signal, "SIGXCPU", 0) or (cpu_time is None and returncode == -signal.SIGKILL):
+            return "cpu"
+    if memory_limit is not None and returncode is not None and returncode < 0:
+        return "memory"
+    return None
+
+
+class _MeasuredProcess:
+    """
+    A solver process that is reaped with os.wait4 to get its resource usage.
+    Killing goes through a lock, so the pid is never signalled after it was reaped.
+    """
+    def __init__(self, process):
+        self.process = process
+        self._lock = threading.Lock()
+        self._reaped = False
+
+    def kill(self):
+        with self._lock:
+            if not self._reaped:
+                os.kill(self.process.pid, signal.SIGKILL)
+
+    def wait(self):
+        """:return: the resource.struct_rusage of the process, None when wait4 is not available"""
+        if not hasattr(os, "wait4"):
+            self.process.wait()
+            return None
+        if hasattr(os, "waitid"):  # block until exit without reaping, kill() stays safe meanwhile
+            os.waitid(os.P_PID, self.process.pid, os.WEXITED | os.WNOWAIT)
+        with self._lock:
+            _, status, rusage = os.wait4(self.process.pid, 0)
+            self._reaped = True
+            self.process.returncode = os.waitstatus_to_exitcode(status)
+        return rusage
+
+
+def _read_stream(stream, chunks):
+    chunks.append(stream.read())
+
+
+def _read_lines(stream, lines, start_ns):
+    """Reads the solver output line by line, with the time (seconds since start) each line arrived."""
+    for line in stream:
+        lines.append(((time.perf_counter_ns() - start_ns) / 1e9, line))
+
+
+def _write_stream(stream, text):
+    try:
+        stream.write(text)
+        stream.close()
+    except (BrokenPipeError, OSError):  # the solver exited before reading all of its input
+        pass
+
+
+def _execute(command, time_out, process_group=None, input_text=None, cpu_limit=None, memory_limit=None):
+    """
+    Runs one solver command and collects everything it printed.
+    :param command: argument list handed to subprocess.Popen
+    :param time_out: in seconds
+    :param process_group: optional ProcessGroup that may kill the process early
+    :param input_text: if given, fed to the solver through its stdin pipe
+    :param cpu_limit: optional CPU seconds limit (RLIMIT_CPU)
+    :param memory_limit: optional address space limit in bytes (RLIMIT_AS)
+    :return: (did_timeout, combined_output, measurements), measurements is a dict of the SolverResult attributes
+             plus "output_lines", the timestamped stdout lines, and "resource_limit", the limit the process ran
+             into (see _exceeded_limit)
+    """
+    start_ns = time.perf_counter_ns()
+    process = subprocess.Popen(_limited_command(command, cpu_limit, memory_limit),
+                               stdin=subprocess.PIPE if input_text is not None else None,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    _apply_limits(process.pid, cpu_limit, memory_limit)
+    measured = _MeasuredProcess(process)
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        measured.kill()
+
+    timer = threading.Timer(time_out, on_timeout)
+    stdout, stderr = [], []
+    io_threads = [threading.Thread(target=_read_lines, args=(process.stdout, stdout, start_ns), daemon=True),
+                  threading.Thread(target=_read_stream, args=(process.stderr, stderr), daemon=True)]
+    if input_text is not None:
+        io_threads.append(threading.Thread(target=_write_stream, args=(process.stdin, input_text), daemon=True))
+    if process_group is not None:
+        process_group.register(measured)
+    try:
+        timer.start()
+        for thread in io_threads:
+            thread.start()
+        rusage = measured.wait()
+        wall_time = (time.perf_counter_ns() - start_ns) / 1e9
+    finally:
+        timer.cancel()
+        if process_group is not None:
+            process_group.unregister(measured)
+    for thread in io_threads:
+        thread.join()
+    for stream in (process.stdout, process.stderr):
+        stream.close()
+
+    measurements = {"wall_time": wall_time, "returncode": process.returncode, "output_lines": stdout}
+    if rusage is not None:
+        # ru_maxrss is in kilobytes on linux and in bytes on macOS
+        max_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+        measurements.update(user_time=rusage.ru_utime, sys_time=rusage.ru_stime, max_rss=max_rss)
+    if not timed_out.is_set() and not (process_group is not None and process_group.cancelled):
+        cpu_time = rusage.ru_utime + rusage.ru_stime if rusage is not None else None
+        measurements["resource_limit"] = _exceeded_limit(process.returncode, cpu_time, cpu_limit, memory_limit)
+    combined_output = "".join(line for _, line in stdout) + "".join(stderr)  # capture all output
+    return timed_out.is_set(), combined_output, measurements
+
+
+def get_cvc5_path():
     if sys.platform == "darwin":  # macOS
-        cvc_path = get_executable_path("cvc5-macOS-arm64")
+        return get_executable_path("cvc5-macOS-arm64")
     elif sys.platform == "linux":  # linux
-        cvc_path = get_executable_path("cvc5-linux-x86")
+        return get_executable_path("cvc5-linux-x86")
     else:
         raise NotImplementedError(f"{sys.platform} is not currently supported")
-    command = [cvc_path, smt2_file, "--lang", "smt2"]
-    start_time = time.time()
-    did_timeout = False
-    try:
-        result = subprocess.run(command,
-                                capture_output=True, text=True, timeout=time_out)
-        combined_output = ((result.stdout if result.stdout is not None else "") +
-                           (result.stderr if result.stderr is not None else ""))  # capture all output
-    except subprocess.TimeoutExpired as exc:
-        did_timeout = True
-        combined_output = ((exc.stdout.decode('utf-8') if exc.stdout else "") +
-                           (exc.stderr.decode('utf-8') if exc.stderr else ""))  # capture all output
-    ans = "timeout"
 
-    end_time = time.time()
-    total_time = end_time - start_time
-    if not did_timeout:
-        if "unsat" in combined_output:
-            ans = "unsat"
-        elif "sat" in combined_output:
-            ans = "sat"
-        elif "error" in combined_output.lower() or "unsupported" in combined_output.lower():
-            ans = "error"
-            warning_message = f"CVC5 encountered an error while processing {smt2_file}:\n{combined_output}"
-            warnings.warn(warning_message, SMTFileErrorWarning)
-        else:
-            ans = "unknown"
-    else:
-        total_time = time_out
-    return (total_time, did_timeout, ans)
+
+def cvc5_command(smt2_file='', smt2_str=''):
+    cvc_path = get_cvc5_path()
+    if smt2_str:  # read the query from stdin
+        return [cvc_path, "--lang", "smt2", "-"]
+    return [cvc_path, smt2_file, "--lang", "smt2"]
+
+
+def z3_command(smt2_file='', smt2_str=''):
+    if smt2_str:  # read the query from stdin
+        return ["z3", "-smt2", "-in"]
+    return ["z3", "-smt2", smt2_file]
+
+
+def mark_check_sats(smt2_str):
+    """
+    Adds an (echo) marker after every check-sat of a script, so that every response can be matched to its
+    check-sat even when one of them fails with an error.
+    """
+    commands = []
+    count = 0
+    for command in iter_commands(smt2_str):
+        commands.append(command)
+        if command_name(command) in CHECK_SAT_COMMANDS:
+            commands.append(f'(echo "{CHECK_SAT_MARKER}{count}")')
+            count += 1
+    return "\n".join(commands) + "\n"
+
+
+def request_results(smt2_str, get_model=False, get_unsat_core=False):
+    """
+    Turns on the model / unsat core production at the start of a script and asks for them after its last command.
+    The unsat core is over the assertions the script names with (! ... :named ...).
+    """
+    options = []
+    requests = []
+    if get_model:
+        options.append("(set-option :produce-models true)")
+        requests.append("(get-model)")
+    if get_unsat_core:
+        options.append("(set-option :produce-unsat-cores true)")
+        requests.append("(get-unsat-core)")
+    return "\n".join(options + [smt2_str.rstrip()] + requests) + "\n"
+
+
+def prepare_query(smt2_file='', smt2_str='', per_check_sat=False, get_model=False, get_unsat_core=False):
+    """
+    :return: (smt2_file, smt2_str) to hand to the solver, with check-sat markers added if per_check_sat and the
+             requests of request_results if get_model / get_unsat_core
+    """
+    if not (per_check_sat or get_model or get_unsat_core):
+        return smt2_file, smt2_str
+    if not smt2_str:
+        with open(smt2_file) as f:
+            smt2_str = f.read()
+    if per_check_sat:
+        smt2_str = mark_check_sats(smt2_str)
+    if get_model or get_unsat_core:
+        smt2_str = request_results(smt2_str, get_model, get_unsat_core)
+    return '', smt2_str
+
+
+def parse_check_sats(output_lines):
+    """
+    Splits the solver output into one response per check-sat.
+    :param output_lines: list of (seconds since the solver started, line), as collected by _execute
+    :return: list of (answer, seconds), seconds is the time since the previous response (or since the start).
+             The times are only as precise as the solver flushes its output, z3 and cvc5 flush after every response.
+    """
+    responses = []
+    previous_time = 0.0
+    lines = [(line_time, line.strip()) for line_time, line in output_lines]
+    marked = any(line.strip('"').startswith(CHECK_SAT_MARKER) for _, line in lines)
+    answer = None
+    for line_time, line in lines:
+        if marked:
+            if line.strip('"').startswith(CHECK_SAT_MARKER):
+                responses.append((answer or "unknown", line_time - previous_time))
+                previous_time = line_time
+                answer = None
+            elif line in CHECK_SAT_ANSWERS:
+                answer = line
+            elif line.startswith("(error") and answer is None:
+                answer = "error"
+        elif line in CHECK_SAT_ANSWERS:
+            responses.append((line, line_time - previous_time))
+            previous_time = line_time
+    return responses
+
+
+def parse_model(output):
+    """
+    The last (get-model) response in the solver output, also in the older z3 format (model (define-fun ...) ...).
+    :return: dict constant name -> value text, e.g. {"x": "(- 5)"}, functions with arguments are left out.
+             None when the output has no model
+    """
+    model = None
+    for response in iter_sexprs(output):
+        if not isinstance(response, list):
+            continue
+        entries = response[1:] if response[:1] == ["model"] else response
+        if all(isinstance(entry, list) and entry and entry[0] != "error" for entry in entries):
+            model = {symbol_name(entry[1]): to_text(entry[4]) for entry in entries
+                     if entry[0] == "define-fun" and len(entry) == 5 and entry[2] == []}
+    return model
+
+
+def parse_unsat_core(output):
+    """
+    The last (get-unsat-core) response in the solver output.
+    :return: list of the names of the assertions in the core, None when the output has no core
+    """
+    core = None
+    for response in iter_sexprs(output):
+        if isinstance(response, list) and response[:1] != ["error"] and all(isinstance(name, str)
+                                                                             for name in response):
+            core = [symbol_name(name) for name in response]
+    return core
+
+
+def run_cvc5(smt2_file='', time_out: int = 5, process_group=None, smt2_str: str = '', cpu_limit=None,
+             memory_limit=None, per_check_sat=False, get_model=False, get_unsat_core=False):
+    smt2_file, smt2_str = prepare_query(smt2_file, smt2_str, per_check_sat, get_model, get_unsat_core)
+    command = cvc5_command(smt2_file, smt2_str)
+    start_time = time.time()
+    did_timeout, combined_output, measurements = _execute(command, time_out, process_group, smt2_str or None,
+                                                          cpu_limit, memory_limit)
+    return shared_code("CVC5", start_time, did_timeout, combined_output, smt2_file or '<stdin>', time_out,
+                       measurements, get_model, get_unsat_core)
 
 
-def run_z3(smt2_file: str, time_out: int = 5):
+def run_z3(smt2_file: str = '', time_out: int = 5, process_group=None, smt2_str: str = '', cpu_limit=None,
+           memory_limit=None, per_check_sat=False, get_model=False, get_unsat_core=False):
     """
-    :param smt_log_file_path:
+    :param smt2_file: path of the smt2 file, ignored when smt2_str is given
     :param time_out: in seconds
-    :return:
+    :param process_group: optional ProcessGroup that may kill the process early (used by race mode)
+    :param smt2_str: query text, piped to z3 through stdin instead of going through a file
+    :param cpu_limit: optional CPU seconds limit (RLIMIT_CPU) of the solver process
+    :param memory_limit: optional address space limit in bytes (RLIMIT_AS) of the solver process
+    :param per_check_sat: mark every check-sat with an (echo) so SolverResult.check_sats stays aligned on errors
+    :param get_model: ask for the model at the end, SolverResult.model has it when the answer is sat
+    :param get_unsat_core: ask for the unsat core at the end, SolverResult.unsat_core has the names of the
+                           core assertions when the answer is unsat
+    :return: SolverResult
     """
+    smt2_file, smt2_str = prepare_query(smt2_file, smt2_str, per_check_sat, get_model, get_unsat_core)
     start_time = time.time()
+    command = z3_command(smt2_file, smt2_str)
+    did_timeout, combined_output, measurements = _execute(command, time_out, process_group, smt2_str or None,
+                                                          cpu_limit, memory_limit)
+    return shared_code("Z3",start_time,did_timeout,combined_output,smt2_file or '<stdin>',time_out,measurements,
+                       get_model, get_unsat_core)
+
+
+class _Z3Interrupter:
+    """Lets a ProcessGroup (or the time out timer) stop an in-process z3 run like it kills a solver process."""
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.interrupted = False
+
+    def kill(self):
+        self.interrupted = True
+        try:
+            self.ctx.interrupt()
+        except z3.Z3Exception:  # the error of the last command is still pending on the context
+            pass
+
+
+def _split_at_check_sats(smt2_str):
+    """Groups the commands of a script into chunks that each end with a check-sat (except maybe the last)."""
+    chunks, commands = [], []
+    for command in iter_commands(smt2_str):
+        commands.append(command)
+        if command_name(command) in CHECK_SAT_COMMANDS:
+            chunks.append("\n".join(commands))
+            commands = []
+    if commands:
+        chunks.append("\n".join(commands))
+    return chunks
+
+
+def run_z3_api(smt2_file: str = '', time_out: int = 5, process_group=None, smt2_str: str = '', rlimit=None,
+               per_check_sat=False, get_model=False, get_unsat_core=False):
+    """
+    Runs the query with the z3 python bindings on a fresh z3.Context, no z3 binary and no process involved.
+    The script is evaluated one check-sat at a time, so every check-sat is timed (SolverResult.check_sats).
+    z3 releases the GIL while it solves, so the benchmark and race policies of run_solvers run it in a worker
+    thread next to the external solvers:
+        run_solvers(smt2_str=query, solvers={"cvc5": run_cvc5, "z3": run_z3_api}, policy="benchmark")
+    The time out interrupts the context instead of setting z3's :timeout, because set-option changes z3's global
+    parameters and would cut short the runs of the other threads.
+    :param rlimit: optional z3 resource limit, a machine independent alternative to the time out. z3 only takes
+                   it per solver object, so the script is loaded into a z3.Solver and its final assertions are
+                   checked once (not together with per_check_sat). Running out of it is reported as a timeout.
+                   The model and unsat core requests are ignored then.
+    :return: SolverResult, without CPU time and memory since z3 runs in this process
+    """
+    smt2_file, smt2_str = prepare_query(smt2_file, smt2_str, per_check_sat, get_model, get_unsat_core)
+    if not smt2_str:
+        with open(smt2_file) as f:
+            smt2_str = f.read()
+    start_time = time.time()
+    start_ns = time.perf_counter_ns()
+    ctx = z3.Context()
+    interrupter = _Z3Interrupter(ctx)
+    timer = threading.Timer(time_out, interrupter.kill)
+    if process_group is not None:
+        process_group.register(interrupter)
+    output_lines = []
     did_timeout = False
+    if rlimit is not None and per_check_sat:
+        raise ValueError("rlimit checks the final assertions once, it cannot be combined with per_check_sat")
     try:
-        result = subprocess.run(["z3", "-smt2", smt2_file],
-                                capture_output=True, text=True, timeout=time_out)
-        combined_output = ((result.stdout if result.stdout is not None else "") +
-                           (result.stderr if result.stderr is not None else ""))  # capture all output
-        # print(f'z3 std output: {result.stdout}'
-        #       f'z3 stderr output: {result.stderr}')
-    except subprocess.TimeoutExpired as exc:
-        did_timeout = True
-        combined_output = ''
-        result = exc
-    return shared_code("Z3",start_time,did_timeout,combined_output,smt2_file,time_out)
-def shared_code(solvername,start_time,did_timeout,combined_output,smt2_file,time_out):
+        timer.start()
+        if rlimit is not None:
+            solver = z3.Solver(ctx=ctx)
+            solver.set("rlimit", int(rlimit))
+            try:
+                solver.from_string(smt2_str)
+                answer = str(solver.check())
+            except z3.Z3Exception as exc:
+                answer = (exc.value.decode('utf-8') if isinstance(exc.value, bytes) else str(exc.value)).strip()
+            output_lines.append(((time.perf_counter_ns() - start_ns) / 1e9, answer + "\n"))
+            if answer == "unknown":
+                did_timeout = not (process_group is not None and process_group.cancelled)
+            chunks = []
+        else:
+            chunks = _split_at_check_sats(smt2_str)
+        for chunk in chunks:
+            if interrupter.interrupted:
+                did_timeout = not (process_group is not None and process_group.cancelled)
+                break
+            try:
+                output = z3.Z3_eval_smtlib2_string(ctx.ref(), chunk)
+            except z3.Z3Exception as exc:  # the output up to and including the error message
+                output = exc.value.decode('utf-8') if isinstance(exc.value, bytes) else str(exc.value)
+            line_time = (time.perf_counter_ns() - start_ns) / 1e9
+            output_lines.extend((line_time, line) for line in output.splitlines(keepends=True))
+            if output.rstrip().endswith("unknown"):
+                reason = z3.Z3_eval_smtlib2_string(ctx.ref(), "(get-info :reason-unknown)")
+                if interrupter.interrupted or any(word in reason for word in ("canceled", "timeout", "resource")):
+                    did_timeout = not (process_group is not None and process_group.cancelled)
+                    break
+    finally:
+        timer.cancel()
+        if process_group is not None:
+            process_group.unregister(interrupter)
+    measurements = {"wall_time": (time.perf_counter_ns() - start_ns) / 1e9, "output_lines": output_lines}
+    combined_output = "".join(line for _, line in output_lines)
+    return shared_code("Z3", start_time, did_timeout, combined_output, smt2_file or '<stdin>', time_out,
+                       measurements, get_model, get_unsat_core)
+
+
+run_z3_api.version = z3.get_full_version()
+
+
+def shared_code(solvername,start_time,did_timeout,combined_output,smt2_file,time_out,measurements=None,
+                get_model=False, get_unsat_core=False):
+    """
+    :param measurements: optional resource usage from _execute, the wall time in there replaces the
+                         time.time() delta since start_time
+    :param get_model, get_unsat_core: the run asked for them, parse the model of a sat answer / the core of an
+                                      unsat answer from the output
+    :return: SolverResult. The output is read as a stream of responses: unsat if any check-sat answered unsat,
+             else sat if any answered sat. Only whole answer lines count, an error message that mentions
+             "unsat" is an error. SolverResult.check_sats holds the (answer, seconds) of every check-sat
+             that answered, also when the run timed out later on. A run that used up its cpu_limit without an
+             answer timed out, one that died of its memory_limit answers "resource_limit".
+    """
+    measurements = dict(measurements or {})
+    output_lines = measurements.pop("output_lines", None)
+    resource_limit = measurements.pop("resource_limit", None)
+    if output_lines is None:
+        output_lines = [(0.0, line) for line in combined_output.splitlines(keepends=True)]
+    check_sats = parse_check_sats(output_lines)
+    answers = {answer for answer, _ in check_sats}
+    if resource_limit == "cpu" and not answers & set(DEFINITIVE_ANSWERS):
+        did_timeout = True  # out of CPU time is a timeout
     ans = "timeout"
     end_time = time.time()
-    total_time = end_time - start_time
+    total_time = measurements.get("wall_time", end_time - start_time)
     if not did_timeout:
-        if "unsat" in combined_output:
+        if resource_limit == "memory":
+            ans = "resource_limit"
+        elif "unsat" in answers:
             ans = "unsat"
-        elif "sat" in combined_output:
+        elif "sat" in answers:
             ans = "sat"
-        elif "error" in combined_output.lower() or "unsupported" in combined_output.lower():
+        elif "error" in answers or "error" in combined_output.lower() or "unsupported" in combined_output.lower():
             ans = "error"
             warning_message = f"{solvername} encountered an error while processing {smt2_file}:\n{combined_output}"
             warnings.warn(warning_message, SMTFileErrorWarning)
@@ -84,7 +571,12 @@ def shared_code(solvername,start_time,did_timeout,combined_output,smt2_file,time
             ans = "unknown"
     else:
         total_time = time_out
-    return total_time, did_timeout, ans
+    stdout = "".join(line for _, line in output_lines) if output_lines else combined_output
+    if get_model and ans == "sat":
+        measurements["model"] = parse_model(stdout)
+    if get_unsat_core and ans == "unsat":
+        measurements["unsat_core"] = parse_unsat_core(stdout)
+    return SolverResult(total_time, did_timeout, ans, check_sats=check_sats, **measurements)
 
 
 def run_yices(smt2_file):
@@ -104,25 +596,202 @@ solvers = {
 }
 
 
-def run_solvers(smt2_file:str='', smt2_str:str='', verbose=False, time_out=5, solvers = solvers):
+POLICIES = ("sequential", "benchmark", "race")
+DEFINITIVE_ANSWERS = ("sat", "unsat")
+
+
+def _result_options(per_check_sat=False, get_model=False, get_unsat_core=False):
+    """The run options that add to the (time, did_timeout, ans) of a run, runs with them are not cached."""
+    return {name: True for name, value in (("per_check_sat", per_check_sat), ("get_model", get_model),
+                                           ("get_unsat_core", get_unsat_core)) if value}
+
+
+def _accepts_kwarg(run_function, name):
+    """Whether a (possibly user supplied) runner can take the keyword argument `name`."""
+    try:
+        parameters = inspect.signature(run_function).parameters
+    except (TypeError, ValueError):
+        return False
+    return name in parameters or any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values())
+
+
+def _runner_kwargs(run_function, time_out, process_group=None, run_options=None):
+    kwargs = {"time_out": time_out}
+    if process_group is not None and _accepts_kwarg(run_function, "process_group"):
+        kwargs["process_group"] = process_group
+    for name, value in (run_options or {}).items():
+        if _accepts_kwarg(run_function, name):
+            kwargs[name] = value
+    return kwargs
+
+
+def _call_runner(solver, run_function, smt2_file, smt2_str, time_out, verbose, process_group=None,
+                 run_options=None):
+    """
+    Calls one runner. A query given as text is piped to runners that take `smt2_str`,
+    every other runner gets its own temporary file that is removed afterwards.
+    run_options (e.g. cpu_limit) are only handed to the runners that take them.
     """
+    if verbose:
+        print(f"Running {solver}...")
+    kwargs = _runner_kwargs(run_function, time_out, process_group, run_options)
+    if not smt2_str:
+        return run_function(smt2_file, **kwargs)
+    if _accepts_kwarg(run_function, "smt2_str"):
+        return run_function(smt2_file, smt2_str=smt2_str, **kwargs)
+    with tempfile.NamedTemporaryFile('w', suffix='.smt2', prefix='jz3-') as f:
+        f.write(smt2_str)
+        f.flush()
+        return run_function(f.name, **kwargs)
+
+
+def run_solvers(smt2_file:str='', smt2_str:str='', verbose=False, time_out=5, solvers = solvers,
+                policy="sequential", max_workers=None, cache=None, cpu_limit=None, memory_limit=None,
+                per_check_sat=False, get_model=False, get_unsat_core=False):
+    """
+    smt2_file: path of the query, takes precedence over smt2_str
+    smt2_str: query text. It is piped to the solvers through stdin (runners without a `smt2_str` argument
+              get a private temporary file), so concurrent calls never share an input file.
     time_out: in seconds
     solver: user defined dict that's similar to "solver", and they can call shared_func to define their own
+    policy: how the solvers are scheduled
+        "sequential": one solver after the other (wall time is the sum of all solvers)
+        "benchmark": all solvers at once in a worker pool, waits for every solver and returns all timings
+        "race": all solvers at once, returns as soon as one solver answers sat/unsat and kills the others.
+                The returned dict then only holds the solvers that finished before (and including) the winner.
+    max_workers: size of the worker pool for "benchmark" and "race", defaults to one worker per solver
+    cache: optional result_cache.ResultCache, solvers with a usable cached result are not run again
+    cpu_limit: optional CPU seconds limit (RLIMIT_CPU) of every solver process
+    memory_limit: optional address space limit in bytes (RLIMIT_AS) of every solver process
+    The built in runners return SolverResult tuples, which also carry the CPU time and peak memory of the
+    solver. Compare encodings on those on noisy hosts, the wall time depends on the load of the machine.
+    per_check_sat: mark every check-sat of the script, so SolverResult.check_sats has exactly one
+                   (answer, seconds) per check-sat, e.g. for the push/pop scripts of Solver.generate_smtlib
+    get_model: ask the runners that take it for the model, SolverResult.model of a sat answer has it
+    get_unsat_core: ask the runners that take it for the unsat core over the :named assertions,
+                    SolverResult.unsat_core of an unsat answer has it
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy {policy!r}, expected one of {POLICIES}")
+    if smt2_file:
+        smt2_str = ''
+    limits = {name: value for name, value in (("cpu_limit", cpu_limit), ("memory_limit", memory_limit))
+              if value is not None}
+    result_options = _result_options(per_check_sat, get_model, get_unsat_core)
+    run_options = dict(limits, **result_options)
+    if cache is None or result_options:  # the cache only keeps the (time, did_timeout, ans) of a run
+        return _run_policy(smt2_file, smt2_str, verbose, time_out, solvers, policy, max_workers, run_options)
+
+    query, versions, results = _lookup_cache(cache, smt2_file, smt2_str, solvers, time_out, verbose, limits)
+    if policy == "race" and any(result[2] in DEFINITIVE_ANSWERS for result in results.values()):
+        return results
+    uncached = {solver: run_function for solver, run_function in solvers.items() if solver not in results}
+    new_results = _run_policy(smt2_file, smt2_str, verbose, time_out, uncached, policy, max_workers, run_options)
+    for solver, result in new_results.items():
+        cache.put(query, solver, versions[solver], time_out, result, limits)
+    results.update(new_results)
+    return {solver: results[solver] for solver in solvers if solver in results}
+
+
+def _bind_query(solver, run_function, smt2_str):
+    """A runner that runs `run_function` on `smt2_str`, whatever query it is called with."""
+    def run(smt2_file='', time_out=5, process_group=None, **run_options):
+        return _call_runner(solver, run_function, '', smt2_str, time_out, False, process_group, run_options)
+    return run
+
+
+def race_queries(queries, time_out=5, solvers=solvers, max_workers=None, cpu_limit=None, memory_limit=None,
+                 get_model=False, get_unsat_core=False):
+    """
+    Races every solver on every query at once, e.g. the encodings of one problem, and kills the other runs as soon
+    as one run answers sat/unsat.
+    queries: list of SMT2 texts
+    max_workers: size of the worker pool, defaults to one worker per run
+    get_model, get_unsat_core: see run_solvers, the winner's result then has its model or unsat core
+    return: dict (query index, solver) -> result of the runs that finished before (and including) the winner
+    """
+    run_options = {name: value for name, value in (("cpu_limit", cpu_limit), ("memory_limit", memory_limit))
+                   if value is not None}
+    run_options.update(_result_options(get_model=get_model, get_unsat_core=get_unsat_core))
+    runs = {(index, solver): _bind_query(solver, run_function, query)
+            for index, query in enumerate(queries) for solver, run_function in solvers.items()}
+    return _run_policy('', '', False, time_out, runs, "race", max_workers, run_options)
+
+
+def _lookup_cache(cache, smt2_file, smt2_str, solvers, time_out, verbose, limits=None):
+    """
+    :param limits: dict of the cpu_limit / memory_limit of the runs, part of the cache key
+    :return: (query text, solver versions, cached results of the solvers that do not have to run)
     """
+    query = smt2_str
+    if not query:
+        with open(smt2_file) as f:
+            query = f.read()
+    versions = {solver: get_solver_version(solver, run_function) for solver, run_function in solvers.items()}
     results = {}
-    if smt2_str and smt2_file=='':
-        smt2_file = os.path.join(os.path.dirname(__file__), 'smt_file.smt2')
-        with open(smt2_file, 'w') as f:
-            f.truncate()
-            f.write(smt2_str)
+    for solver in solvers:
+        cached = cache.get(query, solver, versions[solver], time_out, limits)
+        if cached is not None:
+            if verbose:
+                print(f"Using cached result for {solver}...")
+            results[solver] = cached
+    return query, versions, results
 
-    for solver, run_function in solvers.items():
-        if verbose:
-            print(f"Running {solver}...")
-        result = run_function(smt2_file,time_out=time_out)
-        results[solver] = result
 
-    return results
+def _run_policy(smt2_file, smt2_str, verbose, time_out, solvers, policy, max_workers, run_options=None):
+    results = {}
+    if policy == "sequential" or not solvers:
+        for solver, run_function in solvers.items():
+            results[solver] = _call_runner(solver, run_function, smt2_file, smt2_str, time_out, verbose,
+                                           run_options=run_options)
+        return results
+
+    process_group = ProcessGroup()
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(solvers), thread_name_prefix="jz3-solver")
+    futures = {executor.submit(_call_runner, solver, run_function, smt2_file, smt2_str, time_out, verbose,
+                               process_group, run_options): solver
+               for solver, run_function in solvers.items()}
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures[future]] = future.result()
+            if policy == "race" and any(results[futures[f]][2] in DEFINITIVE_ANSWERS for f in done):
+                process_group.kill_all()
+                break
+    finally:
+        executor.shutdown(wait=policy != "race", cancel_futures=True)
+
+    # keep the order of the solvers dict, like the sequential policy does
+    return {solver: results[solver] for solver in solvers if solver in results}
+
+
+@functools.lru_cache(maxsize=None)
+def _binary_version(command):
+    try:
+        output = subprocess.run(list(command), capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+    return output.splitlines()[0] if output else "unknown"
+
+
+def get_solver_version(solver, run_function):
+    """
+    Version of the solver behind a runner, part of the result cache key.
+    A runner can declare its own with a `version` attribute (string or function).
+    """
+    version = getattr(run_function, "version", None)
+    if version is not None:
+        return version() if callable(version) else str(version)
+    if solver == "z3":
+        return _binary_version(("z3", "--version"))
+    if solver == "cvc5":
+        try:
+            return _binary_version((get_cvc5_path(), "--version"))
+        except NotImplementedError:
+            return "unknown"
+    return getattr(run_function, "__qualname__", repr(run_function))
 
 
 def get_executable_path(solver_path_in_solvers_dir):
@@ -136,5 +805,6 @@ def get_executable_path(solver_path_in_solvers_dir):
 
 
 if __name__ == '__main__':
-    print(run_cvc5(
-        '/Users/jiazhenghao/Desktop/CodingProjects/jz3/jz3/problems_instances/particular_hard_instances_records/smt2_files/04_25_00_58_021714024682.151314'))
+    # python -m jz3.src.run_solvers <files or directories> ... is the same as the jz3-bench command
+    from jz3.src.bench import main
+    sys.exit(main())
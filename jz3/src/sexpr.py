@@ -0,0 +1,102 @@
+"""
+Small helpers for the SMT-LIB2 text that goes to and comes back from the external solvers.
+"""
+import re
+
+# a string literal, a quoted symbol, a comment, a parenthesis or any other atom
+_TOKENS = re.compile(r'"(?:[^"]|"")*"|\|[^|]*\||;[^\n]*|[()]|[^\s()";|]+')
+
+
+def iter_commands(text: str):
+    """
+    Splits an SMT-LIB2 script into its top level commands.
+    Comments are dropped, string literals ("...") and quoted symbols (|...|) are kept intact.
+    :param text: the script
+    :return: generator of command strings, e.g. '(check-sat)'
+    """
+    depth = 0
+    start = None
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == ';':  # comment until the end of the line
+            end = text.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        if c == '"':
+            i += 1
+            while i < n:
+                if text[i] == '"':
+                    if i + 1 < n and text[i + 1] == '"':  # "" is an escaped quote
+                        i += 2
+                        continue
+                    break
+                i += 1
+        elif c == '|':
+            end = text.find('|', i + 1)
+            i = n - 1 if end == -1 else end
+        elif c == '(':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0 and start is not None:
+                yield text[start:i + 1]
+                start = None
+        i += 1
+
+
+def command_name(command: str) -> str:
+    """Returns the head symbol of a command, e.g. 'check-sat' for '(check-sat)'."""
+    return command[1:].split(None, 1)[0].rstrip(')') if command.startswith('(') else ''
+
+
+def iter_tokens(text: str):
+    """
+    The tokens of SMT-LIB2 text: parentheses, atoms, string literals and quoted symbols (whitespace inside those
+    two kept as it is), comments are dropped.
+    """
+    for match in _TOKENS.finditer(text):
+        token = match.group()
+        if token[0] != ';':
+            yield token
+
+
+def iter_sexprs(text: str):
+    """
+    Parses the s-expressions of `text` one after the other, e.g. the responses of a solver.
+    Lists become python lists and atoms stay strings (quotes and bars included), comments are dropped.
+    A list that is not closed by the end of the text is not yielded.
+    :return: generator of the top level s-expressions, e.g. 'sat' or ['define-fun', 'x', [], 'Int', '5']
+    """
+    stack = []
+    for token in iter_tokens(text):
+        c = token[0]
+        if c == '(':
+            stack.append([])
+        elif c == ')':
+            if not stack:  # unbalanced, e.g. the tail of a cut off response
+                continue
+            done = stack.pop()
+            if stack:
+                stack[-1].append(done)
+            else:
+                yield done
+        elif stack:
+            stack[-1].append(token)
+        else:
+            yield token
+
+
+def to_text(sexpr) -> str:
+    """The SMT-LIB2 text of a parsed s-expression."""
+    if isinstance(sexpr, str):
+        return sexpr
+    return "(" + " ".join(to_text(item) for item in sexpr) + ")"
+
+
+def symbol_name(symbol: str) -> str:
+    """The name of a symbol without the bars of a quoted symbol, e.g. 'a b' for '|a b|'."""
+    return symbol[1:-1] if len(symbol) > 1 and symbol[0] == symbol[-1] == '|' else symbol
@@ -0,0 +1,175 @@
+"""
+Writes a recorded solver session as SMT-LIB2, straight to any object with a write() method (a file, a socket
+makefile, a StringIO).
+
+Constants and functions are declared the first time an assertion uses them. A subterm that shows up again in a
+later assertion is named once with define-fun and referred to by that name from then on, so the shared parts of
+large encodings are not printed over and over (z3 already uses let for the sharing inside one assertion).
+Subterms shorter than MIN_DEFINITION_LENGTH characters stay inline, their name would not save anything.
+Declarations and definitions made inside a push are forgotten again by the matching pop, like the solver does.
+
+    with open("session.smt2", "w") as f:
+        writer = SMT2Writer(f)
+        writer.set_logic("QF_LIA")
+        writer.assert_expr(x + y > 2)
+        writer.check_sat()
+
+With `max_entries` the tables of seen subterms and definitions are bounded, for very long sessions.
+"""
+from collections import OrderedDict
+
+import z3
+
+DEFINITION_PREFIX = "jz3!d"
+MIN_SHARED_ARGS = 4  # a term without compound arguments is only named when it has this many arguments
+MIN_DEFINITION_LENGTH = 64
+
+
+def _shareable(expr):
+    if not z3.is_app(expr) or expr.num_args() == 0:
+        return False
+    return expr.num_args() >= MIN_SHARED_ARGS or any(child.num_args() > 0 for child in expr.children()
+                                                     if z3.is_app(child))
+
+
+class SMT2Writer:
+    def __init__(self, out, share=True, max_entries=None):
+        """
+        :param out: where the script goes, anything with write()
+        :param share: name subterms shared between assertions with define-fun
+        :param max_entries: optional bound on the remembered subterms and definitions, the oldest are forgotten
+                            (a forgotten subterm is printed in full or defined again)
+        """
+        self.out = out
+        self.share = share
+        self.max_entries = max_entries
+        self._declared = {}  # decl/sort name -> scope level
+        self._defined = OrderedDict()  # ast id -> (expr, name constant)
+        self._seen = OrderedDict()  # ast id -> expr, compound subterms of earlier assertions
+        self._inline = OrderedDict()  # ast id -> expr, shared subterms too short to be named
+        self._scopes = [[]]  # per push level: the declared names and defined ids to drop on pop
+        self._definition_count = 0
+
+    def write(self, text):
+        self.out.write(text)
+
+    def set_logic(self, logic):
+        self.write(f"(set-logic {logic})\n")
+
+    def comment(self, text):
+        self.write(f"; {text}\n")
+
+    def push(self, levels=1):
+        for _ in range(levels):
+            self._scopes.append([])
+        self.write(f"(push {levels})\n")
+
+    def pop(self, levels=1):
+        for _ in range(min(levels, len(self._scopes) - 1)):
+            for kind, key in self._scopes.pop():
+                if kind == "declared":
+                    self._declared.pop(key, None)
+                else:
+                    self._defined.pop(key, None)
+        self.write(f"(pop {levels})\n")
+
+    def check_sat(self):
+        self.write("(check-sat)\n")
+
+    def assert_expr(self, expr, name=None):
+        """:param name: optional name of the assertion, as it shows up in unsat cores"""
+        frontier = self._walk(expr, define=self.share)
+        body = self._print(expr, frontier)
+        if name is not None:
+            body = f"(! {body} :named {name})"
+        self.write(f"(assert {body})\n")
+
+    @staticmethod
+    def _print(expr, frontier):
+        """The s-expression of `expr` with the defined subterms in `frontier` replaced by their names."""
+        if not frontier:
+            return expr.sexpr()
+        return z3.substitute(expr, *frontier.values()).sexpr()
+
+    def _walk(self, root, define):
+        """
+        Declares what `root` uses and, with `define`, names its subterms that earlier assertions had too.
+        :return: dict ast id -> (expr, name constant) of the defined subterms `root` refers to directly, the names
+                 are kept here since defining another subterm of `root` may evict them from the bounded tables
+        """
+        frontier = {}
+        visited = set()
+        stack = [root]
+        while stack:
+            expr = stack.pop()
+            key = expr.get_id()
+            if key in visited:
+                continue
+            visited.add(key)
+            if key in self._defined:
+                frontier[key] = self._defined[key]
+                continue
+            if z3.is_quantifier(expr):  # its body has bound variables, nothing in there is named
+                self._walk_declarations(expr.body())
+                continue
+            if not z3.is_app(expr):
+                continue
+            self._declare(expr)
+            if define and expr is not root and key not in self._inline and _shareable(expr):
+                if key in self._seen:
+                    name = self._define(expr)
+                    if name is not None:
+                        frontier[key] = (expr, name)
+                        continue
+                else:
+                    self._remember(self._seen, key, expr)
+            stack.extend(expr.children())
+        return frontier
+
+    def _walk_declarations(self, root):
+        stack = [root]
+        while stack:
+            expr = stack.pop()
+            if z3.is_quantifier(expr):
+                stack.append(expr.body())
+            elif z3.is_app(expr):
+                self._declare(expr)
+                stack.extend(expr.children())
+
+    def _declare(self, expr):
+        decl = expr.decl()
+        if decl.kind() != z3.Z3_OP_UNINTERPRETED:
+            return
+        for sort in [decl.domain(i) for i in range(decl.arity())] + [decl.range()]:
+            if sort.kind() == z3.Z3_UNINTERPRETED_SORT and self._mark_declared(("sort", sort.name())):
+                self.write(f"(declare-sort {sort.sexpr()} 0)\n")
+        if self._mark_declared(("decl", decl.name(), decl.arity())):
+            self.write(decl.sexpr() + "\n")
+
+    def _mark_declared(self, key):
+        """:return: True when `key` was not declared yet in the current scopes"""
+        if key in self._declared:
+            return False
+        self._declared[key] = len(self._scopes) - 1
+        self._scopes[-1].append(("declared", key))
+        return True
+
+    def _define(self, expr):
+        """:return: the name constant of `expr`, None when it is too short and stays inline"""
+        frontier = self._walk(expr, define=False)
+        key = expr.get_id()
+        body = self._print(expr, frontier)
+        if len(body) < MIN_DEFINITION_LENGTH:
+            self._remember(self._inline, key, expr)
+            return None
+        self._definition_count += 1
+        name = z3.Const(f"{DEFINITION_PREFIX}{self._definition_count}", expr.sort())
+        self.write(f"(define-fun {name.sexpr()} () {expr.sort().sexpr()} {body})\n")
+        self._remember(self._defined, key, (expr, name))
+        self._scopes[-1].append(("defined", key))
+        return name
+
+    def _remember(self, table, key, value):
+        table[key] = value
+        if self.max_entries is not None and len(table) > self.max_entries:
+            table.popitem(last=False)
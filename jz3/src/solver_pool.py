@@ -0,0 +1,200 @@
+"""
+Long lived z3/cvc5 processes that are driven over interactive SMT-LIB2.
+
+Starting a solver binary for every query costs tens of milliseconds, which dominates small queries.
+A SolverProcessPool keeps a few solver processes alive and sends every query to an idle one:
+
+    (reset)
+    (set-option :print-success true)
+    <query>
+    (echo "jz3-done-<n>")
+
+The answers are read back until the echo marker shows up. A query that runs over its time out
+gets its process killed, and the process is started again the next time it is needed.
+
+    with pooled_solvers(size=4) as solvers:
+        run_solvers.run_solvers(smt2_str=query, solvers=solvers)
+"""
+import queue
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+from . import run_solvers
+from .sexpr import iter_commands, command_name
+
+SESSION_COMMANDS = ("exit", "reset")  # owned by the pool, dropped from the queries
+
+
+class SolverProcessError(RuntimeError):
+    pass
+
+
+def z3_command():
+    return ["z3", "-in", "-smt2"]
+
+
+def cvc5_command():
+    return [run_solvers.get_cvc5_path(), "--lang", "smt2", "--incremental", "--interactive"]
+
+
+class InteractiveSolverProcess:
+    """One solver process that answers queries over its stdin/stdout pipes."""
+
+    def __init__(self, command, name="solver"):
+        self.command = command
+        self.name = name
+        self.process = None
+        self._lines = None
+        self._marker_count = 0
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT, text=True, bufsize=1)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(self.process.stdout, self._lines),
+                         daemon=True).start()
+        # handshake: the solver has to acknowledge print-success before it gets any query
+        self._send("(set-option :print-success true)\n")
+        _, line = self._lines.get(timeout=10)
+        if line is None or line.strip() != "success":
+            self.kill()
+            raise SolverProcessError(f"{self.name} did not start an interactive session: {line!r}")
+
+    @staticmethod
+    def _read_lines(stream, lines):
+        for line in stream:
+            lines.put((time.perf_counter_ns(), line))
+        lines.put((time.perf_counter_ns(), None))  # end of stream, the process is gone
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def _send(self, text):
+        self.process.stdin.write(text)
+        self.process.stdin.flush()
+
+    def solve(self, smt2_str: str, time_out=5, process_group=None):
+        """
+        :param smt2_str: query text, any (exit)/(reset)/(set-option :print-success ...) is dropped
+        :param time_out: in seconds
+        :param process_group: optional run_solvers.ProcessGroup that may kill the process early
+        :return: (did_timeout, combined_output, measurements) like run_solvers._execute, only the wall time is
+                 measured since the process lives on after the query
+        """
+        if not self.alive():
+            self.start()
+        self._marker_count += 1
+        marker = f"jz3-done-{self._marker_count}"
+        body = "\n".join(command for command in iter_commands(smt2_str)
+                         if command_name(command) not in SESSION_COMMANDS and ":print-success" not in command)
+        if process_group is not None:
+            process_group.register(self.process)
+        start_ns = time.perf_counter_ns()
+        deadline = time.monotonic() + time_out
+        output = []  # (seconds since the query was sent, line)
+        did_timeout = False
+        try:
+            self._send(f"(reset)\n(set-option :print-success true)\n{body}\n(echo \"{marker}\")\n")
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                line_ns, line = self._lines.get(timeout=remaining)
+                if line is None:  # killed by the process group or crashed
+                    self.kill()
+                    break
+                stripped = line.strip()
+                if stripped.strip('"') == marker:
+                    break
+                if stripped and stripped != "success":  # keep the newline, a model spans several lines
+                    output.append(((line_ns - start_ns) / 1e9, line))
+        except (queue.Empty, BrokenPipeError):
+            self.kill()  # respawned by the next query
+            did_timeout = True
+        finally:
+            if process_group is not None and self.process is not None:
+                process_group.unregister(self.process)
+        measurements = {"wall_time": (time.perf_counter_ns() - start_ns) / 1e9, "output_lines": output}
+        return did_timeout, "".join(line for _, line in output), measurements
+
+
+class SolverProcessPool:
+    """A fixed number of InteractiveSolverProcess for one solver binary."""
+
+    def __init__(self, command, size=1, name="solver"):
+        self.name = name
+        self._idle = queue.Queue()
+        self._workers = [InteractiveSolverProcess(command, name) for _ in range(size)]
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    @contextmanager
+    def _acquire(self):
+        worker = self._idle.get()
+        try:
+            yield worker
+        finally:
+            self._idle.put(worker)
+
+    def run(self, smt2_file: str = '', time_out=5, process_group=None, smt2_str: str = '', per_check_sat=False,
+            get_model=False, get_unsat_core=False):
+        """
+        Same signature and return value as run_solvers.run_z3, so it can be used in a `solvers` dict.
+        :return: run_solvers.SolverResult
+        """
+        smt2_file, smt2_str = run_solvers.prepare_query(smt2_file, smt2_str, per_check_sat, get_model, get_unsat_core)
+        if not smt2_str:
+            with open(smt2_file) as f:
+                smt2_str = f.read()
+        start_time = time.time()
+        with self._acquire() as worker:
+            did_timeout, combined_output, measurements = worker.solve(smt2_str, time_out, process_group)
+        return run_solvers.shared_code(self.name, start_time, did_timeout, combined_output,
+                                       smt2_file or '<stdin>', time_out, measurements, get_model, get_unsat_core)
+
+    def close(self):
+        for worker in self._workers:
+            worker.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PooledSolvers(dict):
+    """`solvers` dict for run_solvers whose runners are backed by SolverProcessPool."""
+
+    def __init__(self, pools):
+        super().__init__((name, pool.run) for name, pool in pools.items())
+        self.pools = pools
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def pooled_solvers(size=1, commands=None):
+    """
+    Drop in replacement for run_solvers.solvers that keeps the solver processes alive between calls.
+    :param size: number of processes per solver, use more than 1 when run_solvers is called from several threads
+    :param commands: dict solver name -> interactive command, defaults to cvc5 and z3
+    """
+    if commands is None:
+        commands = {"cvc5": cvc5_command(), "z3": z3_command()}
+    return PooledSolvers({name: SolverProcessPool(command, size, name) for name, command in commands.items()})
@@ -1,41 +1,92 @@
 from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import functools
+import math
 import z3
 import warnings
 from . import run_solvers
+from . import async_solvers
+from . import assignments
+from . import export
+from . import recommender as encoding_recommender
+from .smt2_writer import SMT2Writer
 
 class InequivalentConditionalConstraints(UserWarning):
     pass
 
+
+class UnrecordedMethodWarning(UserWarning):
+    pass
+
+
+class UnsatisfiableGlobalConstraints(Exception):
+    """No assignment of the condition variables satisfies the global constraints."""
+    pass
+
+
+STRATEGIES = ("exhaustive", "halving", "predicted", "race")
+HALVING_DEFAULTS = {
+    "initial_time_out": 0.5,  # seconds of the first round
+    "eta": 2,  # only the fastest 1/eta of the assignments go on to the next round
+    "growth": 2,  # the time out of every next round is this many times larger
+    "budget": None,  # total solver seconds, None for no limit
+}
+
+_ANSWERS = {"sat": z3.sat, "unsat": z3.unsat}
+
+
+class _Race(list):
+    """Runs of the plan that race each other, the driver stops them at the first sat/unsat answer."""
+    def __init__(self, runs, **options):
+        """:param options: keyword arguments of run_solvers.race_queries, e.g. get_model"""
+        super().__init__(runs)
+        self.options = options
+
+
+# z3.Solver methods that are fine to use next to the ones jz3 defines, the others warn in strict mode
+ALLOWED_METHODS = frozenset(['set', 'assert_exprs', 'to_smt2', 'assertions'])
+
+
 # child class to write push and pop to SMT2 file
 class Solver(z3.Solver):
-    def __init__(self, benchmark_mode=False, *args, **kwargs):
+    def __new__(cls, *args, strict=False, **kwargs):
+        # strict=True gets the subclass with the warning shims, so the plain class pays nothing for them
+        if strict and not issubclass(cls, StrictSolver):
+            cls = StrictSolver
+        return super().__new__(cls)
+
+    def __init__(self, benchmark_mode=False, *args, strict=False, **kwargs):
+        """
+        :param benchmark_mode: check_conditional_constraints benchmarks the external solvers on several assignments
+        :param strict: warn when a z3.Solver method is used that jz3 does not record to the SMT2 file
+        """
         super().__init__(*args, **kwargs)
         self.__start_recording = False
-        self.__history = []
+        self.__history = []  # (operation, z3 expressions or text), printed only by generate_smtlib
+        self.__writer = None  # set when the recording streams straight to a file
         self.__assertions = []
+        # condition ast id -> (condition, [conditional constraints]), the active ones of an assignment are a lookup
+        self.__constraints_by_condition = {}
         self.__global_constraints = z3.BoolVal(True)
-        self.__smt_str = ""
+        self.__global_model = None  # a model of the global constraints, None until checked (again)
         self.__condition_var_assignment_model = None
         self.__solvers_results_for_different_conditional_variables = None
         self.__benchmark_mode = benchmark_mode
         self.__variables = set()
         self.__result = None
-
-    def __getattribute__(self, name):
-        _allowed_methods = ['add', 'add_global_constraints', 'add_conditional_constraint',
-                            'check_conditional_constraints', 'check', 'push', 'pop',
-                            'start_recording', 'generate_smtlib', '_allowed_methods',
-                            'ctx', 'solver', 'set', 'assert_exprs', 'to_smt2', 'assertions',
-                            'get_condition_var_assignment_model',
-                            'get_var_assignments_and_solvers_performance']
-        if name.startswith('_') or name in _allowed_methods:  # intentionally accessing a private variable
-            return object.__getattribute__(self, name)
-        else:
-            warnings.warn(f"Method '{name}' is called.\n "
-                          f"But this method might not be recorded to smt2 file and might incur potential logic errors"
-                          f"Please use only the methods defined in Solver2SMT.\n"
-                          f"If this is intentional, modified the _allowed_methods above")
-            return super().__getattribute__(name)
+        self.__assignment_ranking = None
+        self.__condition_unsat_cores = None
+        self.__enumeration_report = None
+        self.__export_stats = None
+        self.__recommender = None  # loaded on the first strategy="predicted" check, learns from its runs
+        self.__preferred_assignment = None  # condition variable name -> bool of the last race winner
+        self.__external_model = None
+        self.__external_unsat_core = None
+        # every conditional constraint asserted once as Implies(condition, constraint), the assignments of the
+        # condition variables are checked as assumptions, see _check_assignment
+        self.__incremental_solver = None
+        self.__incremental_count = 0
 
     def add_global_constraints(self, *constraints):
         """
@@ -43,27 +94,51 @@ class Solver(z3.Solver):
         :param constraints: A list of Z3 constraints that define global conditions.
         """
         self.__global_constraints = z3.And(self.__global_constraints, *constraints)
+        self.__global_model = None
 
     def add(self, *args):
         # self._conditional_constraints.append((args,condition))
         if self.__start_recording:
             for arg in args:
-                self.__history.append(("add", str(arg.sexpr())))
+                self._record("add", arg)
         super().add(*args)
 
     def add_conditional_constraint(self, *args, condition=z3.BoolVal(True)):
-        if condition is None:
-            condition = z3.BoolVal(True)
-        for conditional_constraint in args:
+        self.add_conditional_constraints([(conditional_constraint, condition) for conditional_constraint in args])
+
+    def add_conditional_constraints(self, constraints):
+        """
+        Adds many conditional constraints at once.
+        :param constraints: iterable of (constraint, condition), a condition of None means always on
+        :raises UnsatisfiableGlobalConstraints: when the global constraints cannot be satisfied
+        """
+        for conditional_constraint, condition in constraints:
+            if condition is None:
+                condition = z3.BoolVal(True)
             self.__assertions.append((conditional_constraint, condition))
+            self._index_constraint(conditional_constraint, condition)
             self.__variables.add(condition)
-        s = z3.Solver()
-        s.add(self.__global_constraints)
-
-        if s.check() != z3.sat:
-            raise "There is no way to satisfy all condition variables provided under global constraint"
-
-    def check_conditional_constraints(self, *args, condition=z3.BoolVal(True),max_count=5):
+        if self._global_model() is None:
+            raise UnsatisfiableGlobalConstraints(
+                "There is no way to satisfy all condition variables provided under global constraint")
+
+    def _global_model(self):
+        """A model of the global constraints or None, only checked again after add_global_constraints."""
+        if self.__global_model is None:
+            s = z3.Solver()
+            s.add(self.__global_constraints)
+            if s.check() == z3.sat:
+                self.__global_model = s.model()
+        return self.__global_model
+
+    def _index_constraint(self, conditional_constraint, condition):
+        _, constraints = self.__constraints_by_condition.setdefault(condition.get_id(), (condition, []))
+        constraints.append(conditional_constraint)
+
+    def check_conditional_constraints(self, *args, condition=z3.BoolVal(True),max_count=5, cache=None, time_out=5,
+                                      solvers=run_solvers.solvers, strategy="exhaustive", halving_options=None,
+                                      enumeration="auto", workers=1, tactics=None, recommender=None,
+                                      get_model=False, get_unsat_core=False):
         """
         Evaluates conditional constraints on a given model and records various solver results based on the conditions.
 
@@ -79,13 +154,58 @@ class Solver(z3.Solver):
             Default is z3.BoolVal(True), which means all conditions are considered true.
         - max_count : int, optional
             The maximum number of distinct model solutions (if there exist) to find in benchmark mode. Default is 5.
+        - cache : result_cache.ResultCache, optional
+            In benchmark mode, solver runs whose SMT2 text was already solved are read from this cache.
+        - time_out : float, optional
+            Seconds every external solver gets per assignment. With strategy="halving" this is the largest time out
+            of the last round. Default is 5.
+        - solvers : dict, optional
+            The external solvers to benchmark, defaults to run_solvers.solvers.
+        - strategy : str, optional
+            "exhaustive" (default): in benchmark mode every assignment gets the full time_out on every solver.
+            "halving": successive halving. All (up to max_count) assignments first run with a small time out,
+            only the fastest 1/eta of them go on to the next round, whose time out is `growth` times larger,
+            until one assignment is left, the time out reaches time_out or `budget` solver seconds are spent.
+            The ranked assignments are available through get_assignment_ranking().
+            "predicted": the assignment and solver the recommender predicts to be the fastest run first, the
+            other assignments only run on all solvers when that gives no sat/unsat answer. Outside benchmark mode
+            too, for production checks.
+            "race": for production checks, in benchmark mode or not. Up to max_count diverse assignments run on
+            every solver at once, the first sat/unsat answer is returned and the other runs are killed. The
+            assignment of the winner is remembered and goes first in the next race (get_preferred_assignment).
+            The assignments are not checked in-process and the cache is not used, the race is the check.
+            With get_model / get_unsat_core the winner's model or unsat core is read back, so there is no need to
+            solve again.
+        - halving_options : dict, optional
+            Overrides of HALVING_DEFAULTS for strategy="halving" (initial_time_out, eta, growth, budget).
+        - enumeration : str, optional
+            How the diverse assignments are picked, one of assignments.ENUMERATION_STRATEGIES ("auto", "allsat",
+            "greedy", "random"). The strategy used and the time it took are in get_enumeration_report().
+        - workers : int, optional
+            Number of assignments whose external solver runs are evaluated at the same time in benchmark mode.
+            The assignments are generated and serialized first, then evaluated on this many threads.
+            Default is 1, since solvers that share the CPUs measure slower times. strategy="race" runs all at once.
+        - tactics : sequence of str, optional
+            z3 tactics (e.g. export.DEFAULT_TACTICS) every assignment is preprocessed with before it is written for
+            the external solvers. The logic of every script is inferred, get_export_stats() has it together with
+            how much the tactics shrank the formula.
+        - recommender : recommender.EncodingRecommender, optional
+            The model of strategy="predicted", defaults to one trained on recommender.DEFAULT_DATABASE.
+            Every run of strategy="predicted" is added to it.
+        - get_model : bool, optional
+            strategy="race" asks the solvers for the model, the winner's is in get_external_model().
+        - get_unsat_core : bool, optional
+            strategy="race" names the assertions and asks the solvers for the unsat core, the winner's is in
+            get_external_unsat_core() and, as condition literals, in get_condition_unsat_cores().
+            Both turn off the tactics of the race, the models and cores of preprocessed assertions do not map back.
 
         Returns:
         - z3.CheckSatResult
-            The result of the final check with all conditional constraints applied.
+            The result of the final check with all conditional constraints applied. With strategy="race" the
+            answer of the winner, z3.unknown when every run timed out.
 
         Raises:
-        - Exception
+        - UnsatisfiableGlobalConstraints
             If it is impossible to find any model that satisfies both the global constraints and the provided
             conditional constraints, indicating an unsatisfiable condition.
 
@@ -97,124 +217,472 @@ class Solver(z3.Solver):
             Records actions taken during the method execution if recording is started.
         - self.__solvers_results_for_different_conditional_variables : list
             Stores results from different solvers if in benchmark mode.
+        - self.__assignment_ranking : list
+            The ranked assignments of strategy="halving", "predicted" or "race".
+        - self.__condition_unsat_cores : list
+            For every checked assignment, the condition literals of its unsat core, None when it is sat.
 
         Notes:
         - In benchmark mode, this method also attempts to record and analyze differences in solver outputs by
           generating different variable assignments that maximize the Hamming distance between them.
-        - This method internally manages several instances of the Solver class, depending on the mode of operation
-          and whether additional checks are performed.
+        - The assignments are checked in-process on one incremental solver that holds every conditional constraint
+          as Implies(condition, constraint), with the condition literals of the assignment as assumptions.
+          The per-assignment Solver instances are only built for the SMT2 text of the external solvers.
 
         """
-        s = z3.Solver()  # no smt file recording required
-        s.add(self.__global_constraints)
-
+        plan = self._check_conditional_constraints_plan(args, condition, max_count, time_out, strategy,
+                                                        halving_options, enumeration, tactics, recommender,
+                                                        list(solvers), get_model, get_unsat_core)
+        try:
+            runs = next(plan)
+            while True:
+                if isinstance(runs, _Race):
+                    runs = plan.send(run_solvers.race_queries([run[0] for run in runs], time_out, solvers,
+                                                              **runs.options))
+                else:
+                    runs = plan.send(self._evaluate_runs(runs, cache, solvers, workers))
+        except StopIteration as stop:
+            return stop.value
+
+    @staticmethod
+    def _evaluate_runs(runs, cache, solvers, workers):
+        """
+        Runs the external solvers on every (smt2_str, time_out[, solver names]) of `runs`, `workers` of them at a
+        time. A run with solver names only runs those solvers.
+        :return: the run_solvers results, in the order of `runs`
+        """
+        def evaluate(smt2_str, time_out, *names):
+            return run_solvers.run_solvers(smt2_str=smt2_str, verbose=False, cache=cache, time_out=time_out,
+                                           solvers=_select_solvers(solvers, *names))
+
+        if workers <= 1 or len(runs) <= 1:
+            return [evaluate(*run) for run in runs]
+        results = [None] * len(runs)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(evaluate, *run): i for i, run in enumerate(runs)}
+            for future in as_completed(futures):  # collected as they finish
+                results[futures[future]] = future.result()
+        return results
+
+    async def check_conditional_constraints_async(self, *args, condition=z3.BoolVal(True), max_count=5,
+                                                  cache=None, time_out=5, solvers=None, limiter=None,
+                                                  strategy="exhaustive", halving_options=None, enumeration="auto",
+                                                  tactics=None, recommender=None, get_model=False,
+                                                  get_unsat_core=False):
+        """
+        Same as check_conditional_constraints, but the external solvers of benchmark mode are awaited
+        through async_solvers.run_solvers_async instead of blocking the event loop.
+        The z3 calls in between still run on the event loop thread.
+        All assignments of a round are evaluated at once, use `limiter` to bound the solver processes.
+        :param solvers: dict of async (or plain) runners, defaults to async_solvers.async_solvers
+        :param limiter: optional asyncio.Semaphore shared with other calls to bound the running solver processes
+        """
+        if solvers is None:
+            solvers = async_solvers.async_solvers
+        plan = self._check_conditional_constraints_plan(args, condition, max_count, time_out, strategy,
+                                                        halving_options, enumeration, tactics, recommender,
+                                                        list(solvers), get_model, get_unsat_core)
+        try:
+            runs = next(plan)
+            while True:
+                if isinstance(runs, _Race):
+                    runs = plan.send(await async_solvers.race_queries_async([run[0] for run in runs], time_out,
+                                                                            solvers, limiter, **runs.options))
+                    continue
+                runs = plan.send(await asyncio.gather(*(async_solvers.run_solvers_async(
+                    smt2_str=smt2_str, time_out=run_time_out, cache=cache, limiter=limiter,
+                    solvers=_select_solvers(solvers, *names)) for smt2_str, run_time_out, *names in runs)))
+        except StopIteration as stop:
+            return stop.value
+
+    def _check_conditional_constraints_plan(self, args, condition, max_count, time_out, strategy, halving_options,
+                                            enumeration="auto", tactics=None, recommender=None, solver_names=None,
+                                            get_model=False, get_unsat_core=False):
+        """
+        The logic of check_conditional_constraints without running the external solvers:
+        a generator that yields a list of (smt2_str, time_out) runs that can be benchmarked in parallel, expects
+        the list of run_solvers results for them to be sent back, and returns the z3 result.
+        A run can have the tuple of solver names it is limited to as third element. The runs of a _Race are
+        sent back as the dict (run index, solver) -> result of run_solvers.race_queries.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy!r}, expected one of {STRATEGIES}")
         # temporarily add the constraint and conditional constraint to be checked.
+        self._sync_incremental_solver()
         if args:  # append the checked condition
             self.__assertions.append((args, condition))
-
-        if s.check() == z3.sat:
+            self._index_constraint(args, condition)
+            self.__incremental_solver.push()
+            self._sync_incremental_solver()
+
+        model = self._global_model()
+        if model is not None and strategy == "race":
+            result = yield from self._race_plan(model, max_count, time_out, enumeration, tactics, get_model,
+                                                get_unsat_core)
+            if args:
+                self._pop_checked_condition()
+            if self.__start_recording:
+                self._record("result", str(result))
+            return result
+        if model is not None:
             # possible combination of condition variables
-            model = s.model()
-
-            solver_with_conditional_constraint = Solver()
+            if self.__start_recording:
+                for conditional_constraint in self._assignment_constraints(model):
+                    self._record("add", conditional_constraint)
+            result, core = self._check_assignment(model)
 
-            # add corresponding conditional constraints and try to solve
-            for (conditional_constraint, condition) in self.__assertions:
-                if condition == z3.BoolVal(True) or model.eval(condition):
-                    if self.__start_recording:
-                        self.__history.append(("add", str(conditional_constraint.sexpr())))
-                    solver_with_conditional_constraint.add(conditional_constraint)
+            self.__condition_var_assignment_model = [model]
+            self.__condition_unsat_cores = [core]
+            self.__export_stats = []
 
-            # Don't really record the smt files
-            solver_with_conditional_constraint.start_recording()
-            result = solver_with_conditional_constraint.check()
+            if strategy == "halving":
+                yield from self._successive_halving_plan(model, max_count, time_out, halving_options, enumeration,
+                                                         tactics)
 
-            self.__condition_var_assignment_model = [model]
+            elif strategy == "predicted":
+                yield from self._predicted_plan(model, max_count, time_out, enumeration, tactics, recommender,
+                                                solver_names)
 
             # Only launch multiple solvers when in benchmark mode
-            if self.__benchmark_mode:
+            elif self.__benchmark_mode:
                 self.__condition_var_assignment_model = []
+                self.__condition_unsat_cores = []
                 self.__solvers_results_for_different_conditional_variables = []
 
-                # find different combinations
-                opt = z3.Optimize()
-                opt.add(self.__global_constraints)
-                dist = 1
-                count = 0
-                while (count < max_count) and (dist > 0):
-                    solver_with_conditional_constraint = Solver()
-
-                    # add corresponding conditional constraints and try to solve
-                    for (conditional_constraint, condition) in self.__assertions:
-                        print(f"{ model.eval(condition)= }")
-                        if model.eval(condition):
-                            if self.__start_recording:
-                                self.__history.append(("add", str(conditional_constraint.sexpr())))
-                            solver_with_conditional_constraint.add(conditional_constraint)
-                            print(conditional_constraint)
-
+                # z3 is not thread safe, so every SMT2 string is built here before any solver runs
+                runs = []
+                for model in self._diverse_assignments(model, max_count, enumeration):
+                    solver_with_conditional_constraint = self._solver_for_assignment(model)
                     # append the combination to the results
-                    # solver_with_conditional_constraint.start_recording()
-                    result = solver_with_conditional_constraint.check()
-                    if self.__result is None:
-                        self.__result=result
-
-                    if result != self.__result: # discrepency between different combinations of condition variables
-                        msg = ("The results from adding different conditional constraints conflict with each other\n"
-                               "This is likely either because the conditional constraints added are not equivalent to one another\n"
-                               "Or one SMT solver was able to solve the problem, while the others aren't, in that case, ignore this warning by either\n"
-                               "1. adding `warnings.filterwarnings('ignore', category=InequivalentConditionalConstraints)` to the users' python script OR\n"
-                               "2. Running the python script through terminal with `python -W ignore::InequivalentConditionalConstraints script.py` ")
-                        warnings.warn(msg,InequivalentConditionalConstraints)
-
-                    single_condition_smt_str = solver_with_conditional_constraint.to_smt2()
-
-                    variable_assignment = {str(var): model[var] for var in self.__variables if str(var) != 'min_hamdist'}
+                    assignment_result, core = self._check_assignment(model)
+                    self._check_assignment_result(assignment_result)
+                    self.__condition_unsat_cores.append(core)
+                    runs.append((self._assignment_smt2(solver_with_conditional_constraint, tactics), time_out))
+                    self.__condition_var_assignment_model.append(self._variable_assignment(model))
+
+                all_solver_results = yield runs
+                for variable_assignment, solver_results in zip(self.__condition_var_assignment_model,
+                                                               all_solver_results):
                     self.__solvers_results_for_different_conditional_variables.append((
                             str(variable_assignment)+': '+
-                            str(run_solvers.run_solvers(smt2_str=single_condition_smt_str, verbose=False))))
-                    self.__condition_var_assignment_model.append(variable_assignment)
-                    min_hamdist = z3.Int("min_hamdist")
-
-                    opt.add(min_hamdist <= z3.Sum(
-                        tuple(z3.If((var == bool(model[var])), 0, 1) for var in self.__variables)))
-
-                    objective = opt.maximize(min_hamdist)
-                    opt.check()
-                    model = opt.model()
-
-                    # min_hamdist_val = model[min_hamdist]
-                    min_hamdist_val = (min_hamdist)
-                    dist = opt.upper(objective).as_long()
-                    count += 1
-
-                # store smt file/str
-                self.__smt_str = solver_with_conditional_constraint.generate_smtlib()
-
-                with open("conditional_constraints.smt2", "w") as file: # TODO
-                    file.write(self.__smt_str)
-
-                # launch multiple solvers and store resutls
+                            str(solver_results)))
 
             # pop the temporarily added conditional constraints
             if args:
-                self.__assertions.pop()
+                self._pop_checked_condition()
 
             if self.__start_recording:
-                self.__history.append(("result", str(solver_with_conditional_constraint.check(*args))))
+                self._record("result", str(result))
             return result
         else:
-            raise ("Impossible to find any way of building constraints"
-                   "The conditional constraints are not satisfiable under global constraints ")
+            if args:
+                self._pop_checked_condition()
+            raise UnsatisfiableGlobalConstraints("Impossible to find any way of building constraints. "
+                                                 "The conditional constraints are not satisfiable under global "
+                                                 "constraints")
+
+    def _sync_incremental_solver(self):
+        """Asserts the conditional constraints added since the last call on the incremental solver."""
+        if self.__incremental_solver is None:
+            self.__incremental_solver = z3.Solver()
+            self.__incremental_count = 0
+        for conditional_constraint, condition in self.__assertions[self.__incremental_count:]:
+            if z3.is_true(condition):
+                self.__incremental_solver.add(conditional_constraint)
+            else:
+                self.__incremental_solver.add(z3.Implies(condition, z3.And(conditional_constraint)))
+        self.__incremental_count = len(self.__assertions)
+
+    def _pop_checked_condition(self):
+        """Undoes the temporary (args, condition) of check_conditional_constraints."""
+        _, condition = self.__assertions.pop()
+        _, constraints = self.__constraints_by_condition[condition.get_id()]
+        constraints.pop()
+        if not constraints:
+            del self.__constraints_by_condition[condition.get_id()]
+        self.__incremental_solver.pop()
+        self.__incremental_count = len(self.__assertions)
+
+    def _check_assignment(self, model):
+        """
+        Checks the assignment of the condition variables in `model` on the incremental solver.
+        :return: (z3.CheckSatResult, unsat core over the condition literals or None when not unsat)
+        """
+        conditions = [condition for condition, _ in self.__constraints_by_condition.values()
+                      if not z3.is_true(condition)]
+        assumptions = [condition if z3.is_true(model.eval(condition, model_completion=True)) else z3.Not(condition)
+                       for condition in conditions]
+        result = self.__incremental_solver.check(*assumptions)
+        core = list(self.__incremental_solver.unsat_core()) if result == z3.unsat else None
+        return result, core
+
+    def _assignment_constraints(self, model):
+        """The unconditional constraints and the conditional constraints that `model` turns on."""
+        for condition, constraints in self.__constraints_by_condition.values():
+            if z3.is_true(condition) or z3.is_true(model.eval(condition, model_completion=True)):
+                yield from constraints
+
+    def _solver_for_assignment(self, model):
+        """A Solver with the unconditional constraints and the conditional constraints that `model` turns on."""
+        solver_with_conditional_constraint = Solver()
+        for conditional_constraint in self._assignment_constraints(model):
+            if self.__start_recording:
+                self._record("add", conditional_constraint)
+            solver_with_conditional_constraint.add(conditional_constraint)
+        return solver_with_conditional_constraint
+
+    def _assignment_smt2(self, solver_with_conditional_constraint, tactics=None, named=False):
+        """The SMT2 script of one assignment for the external solvers, see export.to_smt2."""
+        smt2_str, stats = export.to_smt2(solver_with_conditional_constraint.assertions(), tactics=tactics,
+                                         named=named)
+        self.__export_stats.append(stats)
+        return smt2_str
+
+    def _variable_assignment(self, model):
+        return {str(var): model[var] for var in self.__variables if str(var) != 'min_hamdist'}
+
+    def _check_assignment_result(self, result):
+        """Warns when two assignments of the condition variables give different results."""
+        if self.__result is None:
+            self.__result=result
+
+        if result != self.__result: # discrepency between different combinations of condition variables
+            msg = ("The results from adding different conditional constraints conflict with each other\n"
+                   "This is likely either because the conditional constraints added are not equivalent to one another\n"
+                   "Or one SMT solver was able to solve the problem, while the others aren't, in that case, ignore this warning by either\n"
+                   "1. adding `warnings.filterwarnings('ignore', category=InequivalentConditionalConstraints)` to the users' python script OR\n"
+                   "2. Running the python script through terminal with `python -W ignore::InequivalentConditionalConstraints script.py` ")
+            warnings.warn(msg,InequivalentConditionalConstraints)
+
+    def _diverse_assignments(self, model, max_count, enumeration="auto"):
+        """
+        Up to max_count models of the global constraints, starting with `model`, that are far apart in Hamming
+        distance over the condition variables, see assignments.diverse_assignments.
+        """
+        variables = assignments.condition_variables(self.__variables)
+        models, self.__enumeration_report = assignments.diverse_assignments(
+            self.__global_constraints, variables, max_count, first=model, strategy=enumeration)
+        return models
+
+    def _successive_halving_plan(self, model, max_count, time_out, halving_options, enumeration="auto",
+                                 tactics=None):
+        """
+        Races the candidate assignments with successive halving, see check_conditional_constraints.
+        Every assignment is scored by its fastest sat/unsat answer over the solvers, a timeout scores infinity.
+        """
+        options = dict(HALVING_DEFAULTS, **(halving_options or {}))
+        self.__condition_var_assignment_model = []
+        self.__condition_unsat_cores = []
+        self.__solvers_results_for_different_conditional_variables = []
+        candidates = []
+        for model in self._diverse_assignments(model, max_count, enumeration):
+            solver_with_conditional_constraint = self._solver_for_assignment(model)
+            assignment_result, core = self._check_assignment(model)
+            self._check_assignment_result(assignment_result)
+            self.__condition_unsat_cores.append(core)
+            variable_assignment = self._variable_assignment(model)
+            self.__condition_var_assignment_model.append(variable_assignment)
+            candidates.append({"assignment": variable_assignment, "rungs": [],
+                               "smt2_str": self._assignment_smt2(solver_with_conditional_constraint, tactics)})
+
+        survivors = candidates
+        rung_time_out = min(options["initial_time_out"], time_out)
+        spent = 0.0
+        while True:
+            all_solver_results = yield [(candidate["smt2_str"], rung_time_out) for candidate in survivors]
+            for candidate, solver_results in zip(survivors, all_solver_results):
+                self.__solvers_results_for_different_conditional_variables.append((
+                        str(candidate["assignment"])+': '+str(solver_results)))
+                answered = [(result[0], solver) for solver, result in solver_results.items()
+                            if result[2] in run_solvers.DEFINITIVE_ANSWERS]
+                best_time, best_solver = min(answered) if answered else (float("inf"), None)
+                candidate["rungs"].append({"time_out": rung_time_out, "time": best_time, "solver": best_solver})
+                spent += sum(result[0] for result in solver_results.values())
+            survivors.sort(key=lambda candidate: candidate["rungs"][-1]["time"])
+            survivors = survivors[:max(1, math.ceil(len(survivors) / options["eta"]))]
+            decided = len(survivors) == 1 and survivors[0]["rungs"][-1]["time"] != float("inf")
+            budget_left = options["budget"] is None or spent < options["budget"]
+            if decided or rung_time_out >= time_out or not budget_left:
+                break
+            rung_time_out = min(rung_time_out * options["growth"], time_out)
+
+        self.__assignment_ranking = []
+        for candidate in sorted(candidates, key=lambda candidate: (-len(candidate["rungs"]),
+                                                                    candidate["rungs"][-1]["time"])):
+            last_rung = candidate["rungs"][-1]
+            timed_out = last_rung["time"] == float("inf")
+            self.__assignment_ranking.append({
+                "assignment": candidate["assignment"],
+                "rounds": len(candidate["rungs"]),
+                "time_out": last_rung["time_out"],
+                "time": last_rung["time_out"] if timed_out else last_rung["time"],
+                "solver": last_rung["solver"],
+                # a timed out assignment is only known to take at least time_out
+                "confidence": "lower-bound" if timed_out else "measured",
+                "rungs": candidate["rungs"],
+            })
+
+    def _predicted_plan(self, model, max_count, time_out, enumeration="auto", tactics=None, recommender=None,
+                        solver_names=None):
+        """
+        Runs the assignment the recommender ranks first on its predicted solver, the others in ranked order on all
+        solvers only when that gives no sat/unsat answer. The runs are added to the recommender.
+        """
+        if recommender is None:
+            if self.__recommender is None:
+                self.__recommender = encoding_recommender.EncodingRecommender.from_database()
+            recommender = self.__recommender
+        self.__condition_var_assignment_model = []
+        self.__condition_unsat_cores = []
+        self.__solvers_results_for_different_conditional_variables = []
+        candidates = []
+        for model in self._diverse_assignments(model, max_count, enumeration):
+            assignment_result, core = self._check_assignment(model)
+            self._check_assignment_result(assignment_result)
+            self.__condition_unsat_cores.append(core)
+            variable_assignment = self._variable_assignment(model)
+            self.__condition_var_assignment_model.append(variable_assignment)
+            # the features of the formula this assignment solves, like jz3-bench stores them for its files
+            features = encoding_recommender.formula_features(
+                [constraint for conditional_constraint in self._assignment_constraints(model)
+                 for constraint in (conditional_constraint if isinstance(conditional_constraint, tuple)
+                                    else (conditional_constraint,))])
+            candidates.append({"assignment": variable_assignment, "model": model, "features": features})
+
+        ranking = recommender.rank([candidate["features"] for candidate in candidates],
+                                   [{name: z3.is_true(value) for name, value in candidate["assignment"].items()}
+                                    for candidate in candidates],
+                                   solver_names)
+        ranked = [dict(candidates[index], predicted_time=score, predicted_solver=solver)
+                  for score, index, solver in ranking]
+
+        def smt2(candidate):
+            # only the assignments that run are serialized
+            return self._assignment_smt2(self._solver_for_assignment(candidate["model"]), tactics)
+
+        first = ranked[0]
+        solvers_of_first = (first["predicted_solver"],) if first["predicted_solver"] is not None else ()
+        rounds = [([first], [(smt2(first), time_out, *solvers_of_first)])]
+        answered = False
+        while rounds:
+            batch, runs = rounds.pop()
+            all_solver_results = yield runs
+            for candidate, solver_results in zip(batch, all_solver_results):
+                self.__solvers_results_for_different_conditional_variables.append((
+                        str(candidate["assignment"])+': '+str(solver_results)))
+                recommender.add(candidate["features"], {name: z3.is_true(value) for name, value in
+                                           candidate["assignment"].items()}, solver_results)
+                definitive = [(result[0], solver) for solver, result in solver_results.items()
+                              if result[2] in run_solvers.DEFINITIVE_ANSWERS]
+                candidate["time"], candidate["solver"] = min(definitive) if definitive else (float("inf"), None)
+                candidate["time_out"] = time_out
+                answered = answered or bool(definitive)
+            if not answered and len(ranked) > 1 and batch[0] is first:
+                rest = ranked[1:]
+                rounds.append((rest, [(smt2(candidate), time_out) for candidate in rest]))
+
+        self.__assignment_ranking = []
+        for candidate in ranked:
+            measured = "time" in candidate
+            timed_out = measured and candidate["time"] == float("inf")
+            self.__assignment_ranking.append({
+                "assignment": candidate["assignment"],
+                "predicted_time": candidate["predicted_time"],
+                "predicted_solver": candidate["predicted_solver"],
+                "time_out": candidate.get("time_out"),
+                "time": (candidate["time_out"] if timed_out else candidate["time"]) if measured else None,
+                "solver": candidate.get("solver"),
+                "confidence": ("lower-bound" if timed_out else "measured") if measured else "predicted",
+            })
+
+    def _race_plan(self, model, max_count, time_out, enumeration="auto", tactics=None, get_model=False,
+                   get_unsat_core=False):
+        """
+        Races the assignments on every solver at once, see check_conditional_constraints.
+        :return: the answer of the winner, z3.unknown without any sat/unsat answer
+        """
+        models = self._diverse_assignments(self._preferred_model() or model, max_count, enumeration)
+        self.__condition_var_assignment_model = [self._variable_assignment(model) for model in models]
+        self.__condition_unsat_cores = [None] * len(models)  # not checked in-process
+        self.__solvers_results_for_different_conditional_variables = []
+        self.__export_stats = []
+        self.__external_model = None
+        self.__external_unsat_core = None
+        if get_model or get_unsat_core:
+            tactics = None
+        race_solvers = [self._solver_for_assignment(model) for model in models]
+        results = yield _Race(((self._assignment_smt2(solver, tactics, get_unsat_core), time_out)
+                               for solver in race_solvers), get_model=get_model, get_unsat_core=get_unsat_core)
+
+        answered = sorted((result[0], index, solver) for (index, solver), result in results.items()
+                          if result[2] in run_solvers.DEFINITIVE_ANSWERS)
+        winner_time, winner, winner_solver = answered[0] if answered else (time_out, None, None)
+        self.__assignment_ranking = []
+        for index, variable_assignment in enumerate(self.__condition_var_assignment_model):
+            solver_results = {solver: result for (run_index, solver), result in results.items()
+                              if run_index == index}
+            if solver_results:
+                self.__solvers_results_for_different_conditional_variables.append((
+                        str(variable_assignment)+': '+str(solver_results)))
+            self.__assignment_ranking.append({
+                "assignment": variable_assignment,
+                # the losers ran at least as long as the winner, or timed out
+                "time": winner_time if index == winner else max([winner_time] + [
+                    result[0] for result in solver_results.values()]),
+                "solver": winner_solver if index == winner else None,
+                "confidence": "measured" if index == winner else "lower-bound",
+            })
+        if winner is None:
+            return z3.unknown
+        self.__assignment_ranking.insert(0, self.__assignment_ranking.pop(winner))
+        variables = assignments.condition_variables(self.__variables)
+        self.__preferred_assignment = {str(var): z3.is_true(models[winner].eval(var, model_completion=True))
+                                       for var in variables}
+        winner_result = results[winner, winner_solver]
+        winner_assertions = race_solvers[winner].assertions()
+        if getattr(winner_result, "model", None) is not None:
+            self.__external_model = {var: z3.BoolVal(value) for var, value in
+                                     zip(variables, self.__preferred_assignment.values())}
+            self.__external_model.update(export.read_model(winner_result.model, winner_assertions))
+        if getattr(winner_result, "unsat_core", None) is not None:
+            self.__external_unsat_core = export.read_unsat_core(winner_result.unsat_core, winner_assertions)
+            self.__condition_unsat_cores[winner] = self._core_conditions(self.__external_unsat_core)
+        return _ANSWERS[winner_result[2]]
+
+    def _core_conditions(self, core):
+        """The conditions whose conditional constraints are in `core`, an unsat core of active constraints."""
+        in_core = {expr.get_id() for expr in core}
+        conditions = []
+        for condition, constraints in self.__constraints_by_condition.values():
+            if z3.is_true(condition):
+                continue
+            for conditional_constraint in constraints:
+                exprs = (conditional_constraint if isinstance(conditional_constraint, tuple)
+                         else (conditional_constraint,))
+                if any(expr.get_id() in in_core for expr in exprs):
+                    conditions.append(condition)
+                    break
+        return conditions
+
+    def _preferred_model(self):
+        """A model of the global constraints with the remembered race winner, None when there is none (anymore)."""
+        if self.__preferred_assignment is None:
+            return None
+        variables = assignments.condition_variables(self.__variables)
+        literals = [var if self.__preferred_assignment[str(var)] else z3.Not(var) for var in variables
+                    if str(var) in self.__preferred_assignment]
+        s = z3.Solver()
+        s.add(self.__global_constraints)
+        return s.model() if s.check(*literals) == z3.sat else None
 
     def push(self):
         if self.__start_recording:
-            self.__history.append(("push", None))
+            self._record("push")
         super().push()
 
     def pop(self, *args, **kwargs):
         if self.__start_recording:
-            self.__history.append(("pop", None))
+            self._record("pop")
         super().pop(*args, **kwargs)
 
     def check(self, *args, **kwargs):
@@ -223,50 +691,90 @@ class Solver(z3.Solver):
             if args:
                 for arg in args:
                     # Format the args in SMT-LIB syntax
-                    self.__history.append(("push", ""))
-                    self.__history.append(("add", str(arg.sexpr())))
-                    self.__history.append(("check", ""))
+                    self._record("push")
+                    self._record("add", arg)
+                    self._record("check")
                     result = super().check(*args)
-                    self.__history.append(("result", result))
-                    self.__history.append(("pop", ""))
+                    self._record("result", result)
+                    self._record("pop")
             else:
-                self.__history.append(("check", ""))
+                self._record("check")
                 result = super().check(*args)
-                self.__history.append(("result", result))
+                self._record("result", result)
             return result
         else:
             return super().check(*args)
 
-    def start_recording(self):
+    def start_recording(self, stream=None, max_entries=None, logic=None):
+        """
+        Records the session from here on. The z3 expressions are kept as they are and only printed by
+        generate_smtlib, with the subterms that several assertions share named once (see smt2_writer).
+        :param stream: optional file (or anything with write()) the session is written to as it happens instead,
+                       nothing is kept in memory then and generate_smtlib is not available
+        :param max_entries: with a stream, bounds the subterms the writer remembers for sharing
+        :param logic: with a stream, the SMT-LIB logic of the session. It is written before the assertions are
+                      known, so it defaults to "ALL" (generate_smtlib infers it from the recorded assertions)
+        """
+        if stream is not None:
+            self.__writer = SMT2Writer(stream, max_entries=max_entries)
+            self.__writer.set_logic(logic or export.FALLBACK_LOGIC)
         self.__start_recording = True
-        self.check()
-        initial_state = self.to_smt2()
-        # Remove the last "(check-sat)" from the initial state
-        initial_state = initial_state.rsplit("(check-sat)", 1)[0]
-        self.__history.append(("initial_state", initial_state))
+        self._record("initial_state", tuple(self.assertions()))
 
-    def generate_smtlib(self):
+    def _record(self, op, args=None):
+        if self.__writer is not None:
+            self._write_operation(self.__writer, op, args)
+        else:
+            self.__history.append((op, args))
+
+    @staticmethod
+    def _write_operation(writer, op, args):
+        if op in ("initial_state", "add"):
+            for expr in args if isinstance(args, (tuple, list)) else (args,):
+                writer.assert_expr(expr)
+        elif op == "push":
+            writer.push()
+        elif op == "pop":
+            writer.pop()
+        elif op == "check":
+            writer.check_sat()
+        elif op == "result":
+            writer.comment(f"Result: {args}")
+
+    def generate_smtlib(self, out=None, logic=None):
+        """
+        :param out: optional file (or anything with write()) to write the script to instead of returning it
+        :param logic: SMT-LIB logic of the script, inferred from the recorded assertions when None
+        :return: the SMT-LIB2 script of the recorded session, or of the assertions when nothing is recorded
+        """
         if not self.__start_recording:
-            return self.to_smt2()
+            smt_str = self.to_smt2()
+        elif self.__writer is not None:
+            raise ValueError("The session is streamed to the file given to start_recording, it is not kept")
         else:
-            output = StringIO()
-            output.write(f"(set-logic QF_LIA)\n")
-            for operation in self.__history:
-                op, args = operation
-                if op == "initial_state":
-                    output.write(args)
-                elif op == "add":
-                    output.write(f"(assert {args})\n")
-                elif op in ["push", "pop"]:
-                    output.write(f"({op} 1)\n")
-                elif op == "check":
-                    output.write("(check-sat)\n")
-                elif op == "result":
-                    output.write(f"; Result: {args}\n")
-
+            output = StringIO() if out is None else out
+            writer = SMT2Writer(output)
+            recorded = [expr for op, args in self.__history if op in ("initial_state", "add")
+                        for expr in (args if isinstance(args, (tuple, list)) else (args,))]
+            writer.set_logic(logic or export.infer_logic(recorded))
+            for op, args in self.__history:
+                self._write_operation(writer, op, args)
+            if out is not None:
+                return None
             smt_str = output.getvalue()
             output.close()
-            return smt_str
+        if out is not None:
+            out.write(smt_str)
+            return None
+        return smt_str
+
+    def run_recorded_session(self, time_out=5, solvers=run_solvers.solvers, policy="sequential"):
+        """
+        Replays the recorded push/pop session (generate_smtlib) on the external solvers.
+        :return: dict solver -> SolverResult, its check_sats attribute holds (answer, seconds) for every check-sat
+        """
+        return run_solvers.run_solvers(smt2_str=self.generate_smtlib(), time_out=time_out, solvers=solvers,
+                                       policy=policy, per_check_sat=True)
 
     def get_condition_var_assignment_model(self):
         return self.__condition_var_assignment_model
@@ -274,6 +782,92 @@ class Solver(z3.Solver):
     def get_var_assignments_and_solvers_performance(self):
         return self.__solvers_results_for_different_conditional_variables
 
+    def get_condition_unsat_cores(self):
+        """
+        For every assignment of the last check_conditional_constraints (in the order of
+        get_condition_var_assignment_model), the condition literals that make it unsat, or None when it is not unsat.
+        strategy="race" does not check the assignments in-process, only the winner can have a core there, read
+        from the external solver with get_unsat_core=True.
+        """
+        return self.__condition_unsat_cores
+
+    def get_enumeration_report(self):
+        """
+        How the assignments of the last benchmark run were picked: the enumeration strategy used, the seconds
+        it took, the size of the assignment pool and whether the pool covers every feasible assignment.
+        """
+        return self.__enumeration_report
+
+    def get_export_stats(self):
+        """
+        For every SMT2 script of the last benchmark run, in the order of get_condition_var_assignment_model:
+        its inferred logic and, when tactics were given, the assertion counts and DAG sizes before and after them.
+        """
+        return self.__export_stats
+
+    def get_assignment_ranking(self):
+        """
+        The assignments ranked by check_conditional_constraints(strategy="halving"), fastest first.
+        Every entry has the assignment, the number of rounds it survived, its time and solver in its last round,
+        and confidence: "measured" when it answered in that round, "lower-bound" when it timed out.
+        With strategy="predicted" the order is the predicted one and every entry has the predicted_time (mean
+        PAR-2 seconds, inf without any matching record) and predicted_solver too, the confidence of an assignment
+        that did not run is "predicted" and its time None.
+        With strategy="race" the winner comes first ("measured"), the others are "lower-bound" with the time they
+        ran at least.
+        """
+        return self.__assignment_ranking
+
+    def get_external_model(self):
+        """
+        The model of the last race winner, check_conditional_constraints(strategy="race", get_model=True):
+        dict z3 constant -> z3 value, with the condition variables of the winning assignment. None without one.
+        """
+        return self.__external_model
+
+    def get_external_unsat_core(self):
+        """
+        The unsat core of the last race winner, check_conditional_constraints(strategy="race", get_unsat_core=True):
+        the constraints of the winning assignment in the core. None without one.
+        """
+        return self.__external_unsat_core
+
+    def get_preferred_assignment(self):
+        """The condition variable assignment (name -> bool) that won the last race, the next race tries it first."""
+        return self.__preferred_assignment
+
+
+def _select_solvers(solvers, *names):
+    """The solvers limited to `names`, all of them when no name is given or none of the names is known."""
+    selected = {name: solvers[name] for name in names if name in solvers}
+    return selected or solvers
+
+
+class StrictSolver(Solver):
+    """What Solver(strict=True) creates: the z3.Solver methods outside ALLOWED_METHODS warn when called."""
+    pass
+
+
+def _unrecorded_method(name):
+    z3_method = getattr(z3.Solver, name)
+
+    @functools.wraps(z3_method)
+    def method(self, *args, **kwargs):
+        warnings.warn(f"Method '{name}' is called.\n "
+                      f"But this method might not be recorded to smt2 file and might incur potential logic errors"
+                      f"Please use only the methods defined in Solver2SMT.\n"
+                      f"If this is intentional, add it to z3_wrapper.ALLOWED_METHODS", UnrecordedMethodWarning,
+                      stacklevel=2)
+        return z3_method(self, *args, **kwargs)
+    return method
+
+
+for _name in dir(z3.Solver):
+    if (not _name.startswith('_') and _name not in ALLOWED_METHODS and _name not in vars(Solver)
+            and callable(getattr(z3.Solver, _name))):
+        setattr(StrictSolver, _name, _unrecorded_method(_name))
+del _name
+
 
 def solver_demo():
     solver = Solver(benchmark_mode=True)
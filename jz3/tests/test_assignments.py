@@ -0,0 +1,20 @@
+"""
+Diversity of the assignments picked for benchmark mode.
+"""
+import itertools
+
+import z3
+
+from jz3.src import assignments
+
+
+def test_truncated_allsat_pool_is_picked_greedily():
+    variables = [z3.Bool(f"c{i}") for i in range(8)]
+    first = z3.Solver()
+    first.add([z3.Not(variable) for variable in variables])
+    first.check()
+    models, report = assignments.diverse_assignments(z3.BoolVal(True), variables, count=4, first=first.model(),
+                                                     strategy="allsat", pool_limit=16)
+    assert report["strategy"] == "allsat" and not report["exhaustive"] and len(models) == 4
+    bits = [assignments._bits(model, variables) for model in models]
+    assert min((a ^ b).bit_count() for a, b in itertools.combinations(bits, 2)) > 1
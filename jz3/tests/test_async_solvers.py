@@ -0,0 +1,45 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from jz3.src import async_solvers, run_solvers
+from jz3.tests.test_run_solvers import requires_z3, _pigeonhole
+
+EASY_QUERY = "(declare-const x Int)\n(assert (> x 2))\n(check-sat)\n"
+RACE_TIME_OUT = 30  # the losers are killed long before this
+
+
+@requires_z3
+@pytest.mark.parametrize("runner", [async_solvers.run_z3_async, run_solvers.run_z3])
+def test_race_kills_the_losers(runner, caplog):
+    start = time.monotonic()
+    with caplog.at_level(logging.ERROR, logger="asyncio"):
+        results = asyncio.run(async_solvers.race_queries_async([_pigeonhole(12), EASY_QUERY],
+                                                               time_out=RACE_TIME_OUT, solvers={"z3": runner}))
+    assert results[(1, "z3")][2] == "sat"
+    assert (0, "z3") not in results
+    assert time.monotonic() - start < RACE_TIME_OUT / 2  # asyncio.run did not wait for the hard query
+    assert not [record for record in caplog.records if "never retrieved" in record.getMessage()]
+
+
+@requires_z3
+def test_timeout_kills_the_solver(caplog):
+    with caplog.at_level(logging.ERROR, logger="asyncio"):
+        result = asyncio.run(async_solvers.run_z3_async(smt2_str=_pigeonhole(12), time_out=0.5))
+    assert result[1:] == (True, "timeout")
+    assert result.returncode is not None
+    assert not [record for record in caplog.records if "never retrieved" in record.getMessage()]
+
+
+@requires_z3
+def test_race_losers_are_reaped_by_asyncio(caplog):
+    # easy queries finish together, the losers have often exited but are not reaped yet when they are killed
+    with caplog.at_level(logging.WARNING, logger="asyncio"):
+        for _ in range(10):
+            results = asyncio.run(async_solvers.race_queries_async(
+                [EASY_QUERY] * 4, time_out=RACE_TIME_OUT,
+                solvers={"z3": async_solvers.run_z3_async, "z3b": async_solvers.run_z3_async}))
+            assert "sat" in [result[2] for result in results.values()]
+    assert not [record for record in caplog.records if "Unknown child process" in record.getMessage()]
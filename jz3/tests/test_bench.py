@@ -0,0 +1,33 @@
+import json
+import sqlite3
+
+from jz3.src import bench
+from jz3.tests.test_run_solvers import requires_z3
+
+QUERY = "(declare-const x Int)\n(assert (> x 2))\n(check-sat)\n"
+
+
+def _write_instances(directory, names):
+    files = []
+    for name in names:
+        path = directory / name
+        path.write_text(QUERY)
+        files.append(str(path))
+    return files
+
+
+@requires_z3
+def test_appending_campaigns_keep_instance_ids(tmp_path):
+    db_path = str(tmp_path / "bench.db")
+    first = _write_instances(tmp_path, ["a_classic_distinct.smt2", "a_argyle_distinct.smt2"])
+    second = _write_instances(tmp_path, ["b_classic_distinct.smt2", "a_classic_PbEq.smt2"])
+    assert bench.run_campaign(first, ["z3"], db_path, jobs=1) == 2
+    assert bench.run_campaign(second, ["z3"], db_path, jobs=1) == 2
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT * FROM benchmark_results").fetchall()
+    ids = {row["file"].rsplit("/", 1)[-1]: row["instance_id"] for row in rows}
+    assert ids["a_classic_distinct.smt2"] == ids["a_argyle_distinct.smt2"] == ids["a_classic_PbEq.smt2"]
+    assert ids["b_classic_distinct.smt2"] != ids["a_classic_distinct.smt2"]
+    assert all(row["grid"] is None and row["z3_state"] == "sat" for row in rows)
+    assert all(json.loads(row["features"])["vars"] == 1 for row in rows)
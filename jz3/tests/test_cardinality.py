@@ -0,0 +1,52 @@
+"""
+The clause encodings of PbEq / PbLe against z3's own cardinality constraints, assignment by assignment.
+"""
+import itertools
+
+import pytest
+import z3
+
+from jz3.src.SMTs.SMTs import Bool, PbEq, PbLe
+from jz3.src.SMTs.cardinality import ENCODINGS, encode
+
+CLAUSE_ENCODINGS = [encoding for encoding in ENCODINGS if encoding != "native"]
+
+
+def _agrees(encoded, reference, inputs):
+    """True when `encoded` (with its auxiliary Bools free) holds for exactly the input assignments of `reference`."""
+    solver = z3.Solver()
+    solver.add(encoded.to_z3_expr())
+    for values in itertools.product([False, True], repeat=len(inputs)):
+        literals = [variable if value else z3.Not(variable) for variable, value in zip(inputs, values)]
+        expected = z3.is_true(z3.simplify(z3.substitute(reference, *zip(inputs, map(z3.BoolVal, values)))))
+        if (solver.check(*literals) == z3.sat) != expected:
+            return False
+    return True
+
+
+@pytest.mark.parametrize("encoding", CLAUSE_ENCODINGS)
+@pytest.mark.parametrize("n", [1, 2, 3, 5])
+def test_unit_weights_match_at_most_and_at_least(encoding, n):
+    names = [f"v{i}" for i in range(n)]
+    inputs = [z3.Bool(name) for name in names]
+    for k in range(-1, n + 2):
+        at_most = PbLe([(Bool(name), 1) for name in names], k)
+        at_least = PbLe([(Bool(name), -1) for name in names], -k)  # -sum <= -k
+        exactly = PbEq([(Bool(name), 1) for name in names], k)
+        bounded = max(k, 0)
+        reference_at_most = z3.AtMost(*inputs, bounded) if k >= 0 else z3.BoolVal(False)
+        reference_at_least = z3.AtLeast(*inputs, bounded) if k >= 0 else z3.BoolVal(True)
+        assert _agrees(encode(at_most, encoding), reference_at_most, inputs), (encoding, "at most", k)
+        assert _agrees(encode(at_least, encoding), reference_at_least, inputs), (encoding, "at least", k)
+        assert _agrees(encode(exactly, encoding), z3.And(reference_at_most, reference_at_least), inputs), \
+            (encoding, "exactly", k)
+
+
+@pytest.mark.parametrize("encoding", CLAUSE_ENCODINGS)
+def test_weights_match_native(encoding):
+    weights = [(Bool("w0"), 2), (Bool("w1"), -1), (Bool("w2"), 3), (Bool("w3"), 1)]
+    inputs = [z3.Bool(f"w{i}") for i in range(4)]
+    for bound in range(-2, 7):
+        for constraint in (PbLe(weights, bound), PbEq(weights, bound)):
+            assert _agrees(encode(constraint, encoding), encode(constraint, "native").to_z3_expr(), inputs), \
+                (encoding, constraint)
@@ -0,0 +1,80 @@
+"""
+Logic inference, preprocessing and the round trip of models and unsat cores through the external solvers.
+"""
+import pytest
+import z3
+
+from jz3.src import export, run_solvers
+from jz3.tests.test_run_solvers import requires_z3
+
+RUNNERS = [pytest.param(run_solvers.run_z3, marks=requires_z3), run_solvers.run_z3_api]
+
+x, y = z3.Ints("x y")
+r = z3.Real("r")
+p, q = z3.Bools("p q")
+b = z3.BitVec("b", 8)
+f = z3.Function("f", z3.IntSort(), z3.IntSort())
+a = z3.Array("a", z3.IntSort(), z3.IntSort())
+
+
+@pytest.mark.parametrize("exprs, logic", [
+    ([z3.Or(p, q)], "QF_UF"),
+    ([x + 2 * y > 3], "QF_LIA"),
+    ([x * y > 3], "QF_NIA"),
+    ([x / 2 > 3], "QF_LIA"),
+    ([r * 3 > 1], "QF_LRA"),
+    ([z3.ToReal(x) + r > 1], "QF_LIRA"),
+    ([b + 1 == 3], "QF_BV"),
+    ([f(x) > y], "QF_UFLIA"),
+    ([a[x] == y + 1], "QF_ALIA"),
+    ([z3.ForAll([x], z3.Implies(x > 0, x + y > 0))], "LIA"),
+    ([z3.Length(z3.String("s")) > 2], "ALL"),
+])
+def test_infer_logic(exprs, logic):
+    assert export.infer_logic(exprs) == logic
+
+
+def _satisfiable(exprs):
+    solver = z3.Solver()
+    solver.add(exprs)
+    return solver.check()
+
+
+@pytest.mark.parametrize("exprs", [[x == y + 1, y == 3, x + y > 5, z3.Or(p, x > 10)], [x == y + 1, y == 3, x < 4]])
+def test_preprocess_keeps_satisfiability(exprs):
+    result, stats = export.preprocess(exprs)
+    assert _satisfiable(result) == _satisfiable(exprs)
+    assert stats["assertions_before"] == len(exprs) and stats["size_after"] <= stats["size_before"]
+    smt2_str, stats = export.to_smt2(exprs, tactics=export.DEFAULT_TACTICS)
+    assert "size_after" in stats  # the logic is inferred after the tactics, which may leave no arithmetic
+    assert _satisfiable(z3.parse_smt2_string(smt2_str)) == _satisfiable(exprs)
+
+
+@pytest.mark.parametrize("runner", RUNNERS)
+def test_model_round_trip(runner):
+    exprs = [x + y == 7, x > 2 * y, y > -5, z3.ToReal(y) < r, r < 0, p != (x > 100), b * 3 == 27]
+    smt2_str, _ = export.to_smt2(exprs, named=True)
+    result = runner(smt2_str=smt2_str, get_model=True)
+    assert result[2] == "sat"
+    model = export.read_model(result.model, exprs)
+    assert set(model) >= {x, y, r, p, b}
+    values = list(model.items())
+    for expr in exprs:
+        assert z3.is_true(z3.simplify(z3.substitute(expr, *values))), expr
+
+
+@pytest.mark.parametrize("runner", RUNNERS)
+def test_unsat_core_round_trip(runner):
+    exprs = [p, x > 3, y == 2, z3.Or(q, y > 0), x < 2, q]
+    smt2_str, _ = export.to_smt2(exprs, named=True)
+    result = runner(smt2_str=smt2_str, get_unsat_core=True)
+    assert result[2] == "unsat"
+    core = export.read_unsat_core(result.unsat_core, exprs)
+    assert all(name.startswith(export.ASSERTION_PREFIX) for name in result.unsat_core)
+    assert any(expr.eq(x > 3) for expr in core) and any(expr.eq(x < 2) for expr in core)
+    assert _satisfiable(core) == z3.unsat
+
+
+def test_read_model_skips_unknown_and_unreadable_values():
+    model = export.read_model({"x": "3", "y": "(bad", "z": "1"}, [x > 0, y > 0])
+    assert list(model) == [x] and model[x].as_long() == 3
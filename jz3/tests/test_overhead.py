@@ -0,0 +1,106 @@
+"""
+Microbenchmarks of the per-call overhead of jz3.Solver over a plain z3.Solver.
+
+    JZ3_BENCHMARK=1 python -m pytest jz3/tests/test_overhead.py   # fails when an overhead goes over its limit
+    python -m jz3.tests.test_overhead                              # prints the table
+
+Every operation is timed on both solvers (best of REPEATS alternating runs of CALLS calls, check does fewer calls
+since it is slow) and the ratio is compared with
+the limit in MAX_RATIO. The limits are loose on purpose, they catch a facade that taxes every call again
+(like the old __getattribute__), not noise. Wall-clock ratios still swing on a loaded machine, so the timed test only
+runs when JZ3_BENCHMARK is set, the structural checks always run.
+"""
+import os
+import timeit
+
+import pytest
+import z3
+
+import jz3
+
+CALLS = 2000
+REPEATS = 5
+MAX_RATIO = {
+    "add": 2.0,
+    "push/pop": 2.0,
+    "check": 2.0,
+    "recorded add": 3.0,
+    "recorded push/pop": 3.0,
+}
+
+
+def _operations(solver_class, recording):
+    """:return: dict operation name -> zero argument function doing one call on a fresh solver"""
+    x = z3.Int("x")
+    terms = [x > i for i in range(CALLS)]
+
+    def fresh():
+        solver = solver_class()
+        if recording:
+            solver.start_recording()
+        return solver
+
+    add_solver = fresh()
+    add_terms = iter(terms * (REPEATS + 1))
+    push_solver = fresh()
+    check_solver = fresh()
+    check_solver.add(x > 0)
+
+    def push_pop():
+        push_solver.push()
+        push_solver.pop()
+
+    prefix = "recorded " if recording else ""
+    operations = {
+        prefix + "add": lambda: add_solver.add(next(add_terms)),
+        prefix + "push/pop": push_pop,
+    }
+    if not recording:
+        operations["check"] = check_solver.check
+    return operations
+
+
+def _compare(z3_function, jz3_function, calls=CALLS):
+    """:return: (z3 seconds per call, jz3 seconds per call), the runs alternate so drift hits both alike"""
+    z3_times, jz3_times = [], []
+    for _ in range(REPEATS):
+        z3_times.append(timeit.timeit(z3_function, number=calls))
+        jz3_times.append(timeit.timeit(jz3_function, number=calls))
+    return min(z3_times) / calls, min(jz3_times) / calls
+
+
+def measure():
+    """:return: dict operation name -> (z3 seconds per call, jz3 seconds per call, ratio)"""
+    results = {}
+    for recording in (False, True):
+        # plain z3 does not record, its numbers are the baseline of the recorded operations too
+        baseline = _operations(z3.Solver, recording=False)
+        wrapped = _operations(jz3.Solver, recording)
+        for name, function in wrapped.items():
+            calls = CALLS // 20 if name == "check" else CALLS
+            z3_time, jz3_time = _compare(baseline[name.replace("recorded ", "")], function, calls)
+            results[name] = (z3_time, jz3_time, jz3_time / z3_time)
+    return results
+
+
+@pytest.mark.skipif(not os.environ.get("JZ3_BENCHMARK"), reason="timing test, set JZ3_BENCHMARK to run it")
+def test_overhead():
+    results = measure()
+    too_slow = {name: round(ratio, 2) for name, (_, _, ratio) in results.items() if ratio > MAX_RATIO[name]}
+    assert not too_slow, f"jz3.Solver overhead over the limits {MAX_RATIO}: {too_slow}"
+
+
+def test_strict_mode_is_opt_in():
+    assert type(jz3.Solver()) is jz3.Solver
+    assert "__getattribute__" not in vars(jz3.Solver)
+    strict_solver = jz3.Solver(strict=True)
+    strict_solver.add(z3.Int("x") > 0)
+    strict_solver.check()
+    with pytest.warns(UserWarning):
+        strict_solver.model()
+
+
+if __name__ == '__main__':
+    for operation, (z3_time, jz3_time, ratio) in measure().items():
+        print(f"{operation:20} z3 {z3_time * 1e6:8.2f} us   jz3 {jz3_time * 1e6:8.2f} us   x{ratio:.2f} "
+              f"(limit x{MAX_RATIO[operation]})")
@@ -0,0 +1,35 @@
+import z3
+
+from jz3.src.recommender import EncodingRecommender, formula_features
+
+DISTINCT = {"distinct": True, "PbEq": False}
+PB_EQ = {"distinct": False, "PbEq": True}
+
+
+def _features():
+    cells = [z3.Int(f"x{i}") for i in range(9)]
+    small = formula_features([z3.Distinct(cells)])
+    large = formula_features([z3.And([a != b for a in cells for b in cells if not a.eq(b)])])
+    return small, large
+
+
+def test_ranking_follows_the_nearest_formula():
+    small, large = _features()
+    recommender = EncodingRecommender([
+        {"features": small, "assignment": DISTINCT, "times": {"z3": (0.1, False)}},
+        {"features": large, "assignment": DISTINCT, "times": {"z3": (4.0, False)}},
+        {"features": small, "assignment": PB_EQ, "times": {"z3": (1.0, False)}},
+        {"features": large, "assignment": PB_EQ, "times": {"z3": (1.0, False)}},
+    ], neighbours=1)
+    assert recommender.predict(small, [DISTINCT, PB_EQ]) == (0, "z3")
+    assert recommender.predict(large, [DISTINCT, PB_EQ]) == (1, "z3")
+    assert recommender.predict([small, large], [DISTINCT, PB_EQ]) == (0, "z3")
+
+
+def test_records_without_features_give_the_global_best():
+    small, _ = _features()
+    recommender = EncodingRecommender([
+        {"features": {}, "assignment": DISTINCT, "times": {"z3": (3.0, False)}},
+        {"features": {}, "assignment": PB_EQ, "times": {"z3": (5.0, True)}},
+    ])
+    assert recommender.rank(small, [DISTINCT, PB_EQ]) == [(3.0, 0, "z3"), (10.0, 1, "z3")]
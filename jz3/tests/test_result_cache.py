@@ -0,0 +1,54 @@
+import z3
+
+from jz3.src import result_cache, run_solvers
+
+QUERY = "(declare-const x Int)\n(assert (> x 2))\n(check-sat)\n"
+
+
+def test_limits_are_part_of_the_key():
+    unlimited = result_cache.smt2_key(QUERY, "z3", "4.13")
+    assert result_cache.smt2_key(QUERY, "z3", "4.13", {}) == unlimited
+    assert result_cache.smt2_key(QUERY, "z3", "4.13", {"cpu_limit": 1}) != unlimited
+    assert (result_cache.smt2_key(QUERY, "z3", "4.13", {"cpu_limit": 1})
+            != result_cache.smt2_key(QUERY, "z3", "4.13", {"memory_limit": 1}))
+
+
+def test_limited_timeout_is_only_reused_under_the_same_limits():
+    cache = result_cache.ResultCache(":memory:")
+    cache.put(QUERY, "z3", "4.13", 30, (30, True, "timeout"), {"cpu_limit": 1})
+    assert cache.get(QUERY, "z3", "4.13", 30) is None
+    assert cache.get(QUERY, "z3", "4.13", 30, {"cpu_limit": 1}) == (30, True, "timeout")
+
+
+def test_resource_limit_answers_are_not_cached():
+    cache = result_cache.ResultCache(":memory:")
+    cache.put(QUERY, "z3", "4.13", 5, (0.1, False, "resource_limit"), {"memory_limit": 10 ** 6})
+    assert len(cache) == 0
+
+
+def test_normalization_keeps_strings_and_quoted_symbols():
+    assert (result_cache.normalize_smt2("(assert  (>\n x 2)) ; comment\n(check-sat)")
+            == result_cache.normalize_smt2("(assert (> x 2))\n(check-sat)"))
+    assert (result_cache.normalize_smt2('(declare-const |a  b| Int)(echo "x  y")')
+            != result_cache.normalize_smt2('(declare-const |a b| Int)(echo "x y")'))
+
+
+def test_in_process_runs_are_keyed_by_the_bindings_version_and_the_limits():
+    calls = []
+
+    def run_z3_api(smt2_file='', time_out=5, smt2_str=''):
+        calls.append(smt2_str)
+        return run_solvers.run_z3_api(smt2_file, time_out=time_out, smt2_str=smt2_str)
+    run_z3_api.version = run_solvers.run_z3_api.version
+
+    # named like the binary, but keyed by the version of the z3 bindings it runs on
+    assert run_solvers.get_solver_version("z3", run_solvers.run_z3_api) == z3.get_full_version()
+    cache = result_cache.ResultCache(":memory:")
+    all_limits = ({}, {"cpu_limit": 1}, {"memory_limit": 1 << 30}, {"cpu_limit": 1, "memory_limit": 1 << 30})
+    for limits in all_limits:
+        for _ in range(2):
+            results = run_solvers.run_solvers(smt2_str=QUERY, solvers={"z3": run_z3_api}, cache=cache, **limits)
+            assert results["z3"][2] == "sat"
+    assert len(calls) == len(cache) == len(all_limits)
+    for limits in all_limits:
+        assert cache.get(QUERY, "z3", z3.get_full_version(), 5, limits)[2] == "sat"
@@ -0,0 +1,71 @@
+"""
+Behaviour of the solver runners on small scripts, the tests that need the z3 binary are skipped without it.
+"""
+import shutil
+import warnings
+
+import pytest
+
+from jz3.src import result_cache, run_solvers, solver_pool
+
+requires_z3 = pytest.mark.skipif(shutil.which("z3") is None, reason="needs the z3 binary")
+
+SAT_QUERY = "(declare-const x Int)\n(declare-const y Int)\n(assert (> x 2))\n(assert (= y (* 2 x)))\n(check-sat)\n"
+# no check-sat, the only response is an error whose text contains "unsat"
+CORE_ERROR_QUERY = "(declare-const x Int)\n(assert (! (> x 2) :named a))\n(get-unsat-core)\n"
+
+
+@pytest.mark.parametrize("runner", [pytest.param(run_solvers.run_z3, marks=requires_z3), run_solvers.run_z3_api])
+def test_error_mentioning_unsat_is_an_error(runner):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", run_solvers.SMTFileErrorWarning)
+        result = runner(smt2_str=CORE_ERROR_QUERY)
+    assert result[2] == "error"
+
+
+def test_answer_comes_from_answer_lines_only():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", run_solvers.SMTFileErrorWarning)
+        result = run_solvers.shared_code("Z3", 0, False, '(error "line 3: unsat core is not available")\n', "q", 5)
+    assert result[2] == "error"
+    assert run_solvers.shared_code("Z3", 0, False, "", "q", 5)[2] == "unknown"
+    assert run_solvers.shared_code("Z3", 0, False, "success\nsat\n", "q", 5)[2] == "sat"
+
+
+@requires_z3
+def test_pooled_model_matches_run_z3():
+    expected = run_solvers.run_z3(smt2_str=SAT_QUERY, get_model=True)
+    with solver_pool.pooled_solvers(commands={"z3": solver_pool.z3_command()}) as solvers:
+        pooled = solvers["z3"](smt2_str=SAT_QUERY, get_model=True)
+    assert expected[2] == pooled[2] == "sat"
+    assert expected.model == pooled.model == {"x": "3", "y": "6"}
+
+
+def _pigeonhole(holes):
+    """An unsat query that keeps z3 busy for seconds."""
+    pigeons = holes + 1
+    lines = [f"(declare-const p{i}_{j} Bool)" for i in range(pigeons) for j in range(holes)]
+    lines += [f"(assert (or {' '.join(f'p{i}_{j}' for j in range(holes))}))" for i in range(pigeons)]
+    lines += [f"(assert (not (and p{i}_{j} p{k}_{j})))"
+              for j in range(holes) for i in range(pigeons) for k in range(i + 1, pigeons)]
+    return "\n".join(lines) + "\n(check-sat)\n"
+
+
+@requires_z3
+@pytest.mark.skipif(run_solvers.resource is None, reason="needs resource limits")
+def test_cpu_limit_is_a_timeout_and_not_served_to_unlimited_runs():
+    cache = result_cache.ResultCache(":memory:")
+    query = _pigeonhole(10)
+    solvers = {"z3": run_solvers.run_z3}
+    limited = run_solvers.run_solvers(smt2_str=query, time_out=30, cpu_limit=1, solvers=solvers, cache=cache)
+    assert limited["z3"][1:] == (True, "timeout")
+    assert cache.get(query, "z3", run_solvers.get_solver_version("z3", run_solvers.run_z3), 30) is None
+    assert len(cache) == 1
+
+
+def test_in_process_limits_report_a_timeout():
+    query = _pigeonhole(10)
+    assert run_solvers.run_z3_api(smt2_str=query, rlimit=10000)[1:] == (True, "timeout")
+    result = run_solvers.run_z3_api(smt2_str=query, time_out=0.5)
+    assert result[1:] == (True, "timeout") and result.wall_time < 5
+    assert run_solvers.run_z3_api(smt2_str=SAT_QUERY, rlimit=10 ** 6)[2] == "sat"
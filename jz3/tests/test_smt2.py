@@ -0,0 +1,75 @@
+"""
+SMT-LIB2 written straight from SMTs expressions, read back by z3.
+"""
+import io
+import socket
+
+import pytest
+import z3
+
+from jz3.src.SMTs.SMTs import Bool, Int, Not, And, Or, Eq, Implies, PbEq, PbLe, Distinct
+from jz3.src.SMTs.smt2 import SMT2Emitter, write_smt2, symbol
+
+
+def _expressions():
+    x, y, z, n = Bool("x"), Bool("y"), Bool("z y"), Int("n")
+    shared = Or(And(x, Not(y)), And(y, z), PbLe([(x, 1), (y, 1), (z, 1)], 1))
+    return [Implies(shared, Eq(n, -3)), Or(shared, Distinct(n, Int("m"), 4)), PbEq([(x, 2), (y, -1), (z, 1)], 1),
+            Eq(x, Not(z))]
+
+
+def _check(script, expressions):
+    """z3's verdict on the script, after checking it asserts exactly the expressions."""
+    parsed = z3.And(*z3.parse_smt2_string(script))
+    expected = z3.And(*[expression.to_z3_expr() for expression in expressions])
+    solver = z3.Solver()
+    solver.add(parsed != expected)
+    assert solver.check() == z3.unsat
+    solver = z3.Solver()
+    solver.add(parsed)
+    return solver.check()
+
+
+@pytest.mark.parametrize("options", [{}, {"share": False}, {"max_entries": 1}, {"buffer_size": 1}])
+def test_written_script_reads_back_the_same(options):
+    expressions = _expressions()
+    out = io.StringIO()
+    write_smt2(expressions, out, logic="QF_LIA", **options)
+    script = out.getvalue()
+    if "max_entries" not in options:  # with max_entries=1 the shared subterm may be forgotten before it comes again
+        assert ("(define-fun " in script) == options.get("share", True)
+    assert _check(script, expressions) == z3.sat
+
+
+def test_unsat_script_and_scopes():
+    x = Bool("x")
+    shared = And(Or(x, Bool("y")), Or(Not(x), Bool("y")))
+    out = io.StringIO()
+    with SMT2Emitter(out) as emitter:
+        emitter.assert_expr(shared)
+        emitter.push()
+        emitter.assert_expr(And(shared, Not(Bool("y"))), name="no y")
+        emitter.check_sat()
+        emitter.pop()
+        emitter.assert_expr(Or(shared, Bool("w")))
+        emitter.check_sat()
+    script = out.getvalue()
+    inner = script[:script.index("(pop 1)")]
+    assert _check(inner, [shared, And(shared, Not(Bool("y")))]) == z3.unsat
+    assert _check(script, [shared, Or(shared, Bool("w"))]) == z3.sat
+
+
+def test_socket_output():
+    left, right = socket.socketpair()
+    with left, right:
+        write_smt2(_expressions(), left)
+        left.shutdown(socket.SHUT_WR)
+        script = right.makefile().read()
+    assert _check(script, _expressions()) == z3.sat
+
+
+def test_symbols():
+    assert symbol("x") == "x"
+    assert symbol("z y") == "|z y|"
+    with pytest.raises(ValueError):
+        symbol("a|b")
@@ -0,0 +1,35 @@
+"""
+Scripts of the SMT2Writer read back by z3.
+"""
+import io
+
+import z3
+
+from jz3.src.smt2_writer import SMT2Writer
+
+
+def _equivalent(script, expected):
+    solver = z3.Solver()
+    solver.add(z3.And(*z3.parse_smt2_string(script)) != z3.And(*expected))
+    return solver.check() == z3.unsat
+
+
+def test_bounded_tables_with_shared_subterms_and_scopes():
+    # long enough to be named, with max_entries=3 defining a subterm of the last assertion evicts the name of another
+    shared = [z3.Or([z3.Bool(f"cond_{i}_{j}") for j in range(10)]) for i in range(5)]
+    first, inner, second, last = (z3.And([shared[i] for i in indices])
+                                  for indices in ([0, 2, 3, 4], [2, 3], [0, 1, 2, 3], [0, 1, 3, 4]))
+    out = io.StringIO()
+    writer = SMT2Writer(out, max_entries=3)
+    writer.assert_expr(first)
+    writer.push()
+    writer.assert_expr(inner)
+    writer.check_sat()
+    writer.pop()
+    writer.assert_expr(second)
+    writer.assert_expr(last)
+    writer.check_sat()
+    script = out.getvalue()
+    assert script.count("(define-fun ") > 1
+    assert _equivalent(script[:script.index("(pop 1)")], [first, inner])
+    assert _equivalent(script, [first, second, last])
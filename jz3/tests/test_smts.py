@@ -0,0 +1,87 @@
+"""
+The SMTs expressions and SMTs.Solver.
+"""
+import gc
+import pickle
+import threading
+import weakref
+
+import pytest
+import z3
+
+from jz3.src.SMTs.SMTs import (Solver, UnsatisfiableConditions, SELECTOR_PREFIX, Expression, BoolVal, Bool, Int, Const,
+                               Not, And, Or, Eq, Implies, PbEq, PbLe, Distinct)
+
+
+def _example():
+    x, y, n = Bool("x"), Bool("y"), Int("n")
+    return And(Or(x, Not(y)), Implies(x, Eq(n, 3)), PbEq([(x, 1), (y, 2)], 2), PbLe([(x, 1), (y, 1)], 1),
+               Distinct(n, Int("m"), 4), Not(True))
+
+
+def test_equal_expressions_are_one_node():
+    assert _example() is _example()
+    assert Not(True) is Not(BoolVal(True))
+    assert Eq(Int("n"), 3) is Eq(Int("n"), Const(3))
+    assert Bool("x") is not Int("x")
+    assert And(Bool("x"), Bool("y")) is not And(Bool("y"), Bool("x"))
+    assert len({_example(), _example()}) == 1
+
+
+def test_interning_from_threads_makes_one_node():
+    nodes = []
+    threads = [threading.Thread(target=lambda: nodes.append(Or(Bool("racing"), Eq(Int("racing_n"), 0))))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(node is nodes[0] for node in nodes)
+
+
+def test_pickled_expressions_are_interned_again():
+    expression = _example()
+    copy = pickle.loads(pickle.dumps(expression))
+    assert copy is expression
+    assert pickle.loads(pickle.dumps([Bool("x"), Bool("x")]))[0] is Bool("x")
+
+
+def test_unused_nodes_are_dropped():
+    reference = weakref.ref(And(Bool("dropped_a"), Bool("dropped_b")))
+    gc.collect()
+    assert reference() is None
+    assert isinstance(And(Bool("dropped_a"), Bool("dropped_b")), Expression)
+
+
+def test_slots_and_translation_cache():
+    expression = _example()
+    assert not hasattr(expression, "__dict__")
+    with pytest.raises(AttributeError):
+        expression.extra = 1
+    assert expression.to_z3_expr() is expression.to_z3_expr()
+    other = z3.Context()
+    assert expression.to_z3_expr(other).ctx is other
+    assert expression.to_z3_expr(other).sexpr() == expression.to_z3_expr().sexpr()
+
+
+def test_solver_applies_every_condition_and_hides_selectors():
+    solver = Solver()
+    solver.add(Or(Bool("x"), Bool("y")))
+    solver.add(Not(Bool("x")), condition=Bool("c"))
+    solver.add(Eq(Int("n"), 3), condition=Implies(Bool("c"), Bool("d")))
+    assert solver.check() == z3.sat
+    model = solver.model
+    assert not any(decl.name().startswith(SELECTOR_PREFIX) for decl in model.decls())
+    assert z3.is_false(model.eval(z3.Bool("x"), model_completion=True))
+    assert z3.is_true(model[z3.Bool("y")])
+    assert model[z3.Int("n")].as_long() == 3
+    assert solver.check(Not(Bool("y"))) == z3.unsat
+    assert solver.model is None
+
+
+def test_solver_rejects_conditions_against_the_global_constraints():
+    solver = Solver()
+    solver.global_constraints = Not(Bool("c"))
+    solver.add(Bool("x"))
+    with pytest.raises(UnsatisfiableConditions):
+        solver.add(Bool("y"), condition=Bool("c"))
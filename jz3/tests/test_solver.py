@@ -0,0 +1,142 @@
+"""
+check_conditional_constraints on small instances, with z3 in-process as the external solver.
+"""
+import io
+import time
+
+import pytest
+import z3
+
+from jz3.src import run_solvers, z3_wrapper
+
+SOLVERS = {"z3": run_solvers.run_z3_api}
+CONDITIONS = [z3.Bool(f"c{i}") for i in range(4)]
+# the seconds the encoding of every condition costs the scripted solver
+COSTS = {"(= (+ x y) 10)": 0.01, "(* 2 x)": 0.02, "(- 10 y)": 0.04, "(- (+ y x) 10)": 0.08}
+
+
+def _instance(unsat=False, benchmark_mode=True):
+    """Four equivalent encodings of x + y == 10 under the conditions c0..c3, at least one of them on."""
+    x, y = z3.Ints("x y")
+    solver = z3_wrapper.Solver(benchmark_mode=benchmark_mode)
+    solver.add_global_constraints(z3.AtLeast(*CONDITIONS, 1))
+    solver.add_conditional_constraints([(x + y == 10, CONDITIONS[0]), (2 * x == 20 - 2 * y, CONDITIONS[1]),
+                                        (x == 10 - y, CONDITIONS[2]), (y + x - 10 == 0, CONDITIONS[3]),
+                                        (x > (6 if unsat else 3), None), (y > 4, None)])
+    return solver
+
+
+def _cost(assignment):
+    return sum(cost for condition, cost in zip(CONDITIONS, COSTS.values()) if z3.is_true(assignment[str(condition)]))
+
+
+def _scripted_z3(smt2_file='', time_out=5, smt2_str='', get_model=False, get_unsat_core=False):
+    """z3's answer, in the time COSTS gives the encodings in the script, so the fastest assignment is known."""
+    result = run_solvers.run_z3_api(smt2_file, time_out=time_out, smt2_str=smt2_str, get_model=get_model,
+                                    get_unsat_core=get_unsat_core)
+    return run_solvers.SolverResult(sum(cost for text, cost in COSTS.items() if text in smt2_str), *result[1:],
+                                    model=result.model, unsat_core=result.unsat_core)
+
+
+def _sleeping_z3(smt2_file='', time_out=5, smt2_str='', get_model=False, get_unsat_core=False):
+    """_scripted_z3 that takes 10 times its scripted time of wall clock, for races."""
+    result = _scripted_z3(smt2_file, time_out, smt2_str, get_model, get_unsat_core)
+    time.sleep(10 * result[0])
+    return result
+
+
+def _exhaustive(unsat=False):
+    """:return: (answer, assignments) of the sequential benchmark plan"""
+    solver = _instance(unsat)
+    answer = solver.check_conditional_constraints(max_count=4, solvers={"z3": _scripted_z3})
+    return answer, solver.get_condition_var_assignment_model()
+
+
+def test_halving_picks_the_fastest_assignment_of_the_sequential_plan():
+    for unsat in (False, True):
+        answer, candidates = _exhaustive(unsat)
+        solver = _instance(unsat)
+        result = solver.check_conditional_constraints(max_count=4, solvers={"z3": _scripted_z3}, time_out=1,
+                                                      strategy="halving", halving_options={"initial_time_out": 0.25})
+        assert result == answer == (z3.unsat if unsat else z3.sat)
+        ranking = solver.get_assignment_ranking()
+        assert sorted(map(str, candidates)) == sorted(str(entry["assignment"]) for entry in ranking)
+        assert ranking[0]["assignment"] == min(candidates, key=_cost)
+        assert ranking[0]["time"] == _cost(ranking[0]["assignment"])
+        assert ranking[0]["rounds"] == max(entry["rounds"] for entry in ranking) == 2
+
+
+def test_bulk_constraints_match_one_by_one_and_check_the_globals_once(monkeypatch):
+    checks = []
+    check = z3.Solver.check
+    monkeypatch.setattr(z3.Solver, "check", lambda self, *args: checks.append(self) or check(self, *args))
+    bulk = _instance(benchmark_mode=False)
+    assert len(checks) == 1
+    x, y = z3.Ints("x y")
+    one_by_one = z3_wrapper.Solver()
+    one_by_one.add_global_constraints(z3.AtLeast(*CONDITIONS, 1))
+    for constraint, condition in [(x + y == 10, CONDITIONS[0]), (2 * x == 20 - 2 * y, CONDITIONS[1]),
+                                  (x == 10 - y, CONDITIONS[2]), (y + x - 10 == 0, CONDITIONS[3])]:
+        one_by_one.add_conditional_constraint(constraint, condition=condition)
+    one_by_one.add_conditional_constraint(x > 3, y > 4)
+    assert len(checks) == 2  # one feasibility check per solver, not per call
+    assert bulk.check_conditional_constraints() == one_by_one.check_conditional_constraints() == z3.sat
+    assert str(bulk.get_condition_var_assignment_model()) == str(one_by_one.get_condition_var_assignment_model())
+    assert bulk.check_conditional_constraints(x > 6) == one_by_one.check_conditional_constraints(x > 6) == z3.unsat
+
+    bulk.add_global_constraints(z3.Not(CONDITIONS[0]), z3.Not(CONDITIONS[1]), z3.Not(CONDITIONS[2]))
+    checks.clear()
+    bulk.add_conditional_constraints([(x < 8, None)])
+    assert len(checks) == 1  # the new global constraints are checked again
+    assert bulk.check_conditional_constraints() == z3.sat
+    assert z3.is_true(bulk.get_condition_var_assignment_model()[0].eval(CONDITIONS[3]))
+    bulk.add_global_constraints(z3.Not(CONDITIONS[3]))
+    with pytest.raises(z3_wrapper.UnsatisfiableGlobalConstraints):
+        bulk.add_conditional_constraints([(x < 9, None)])
+
+
+def test_race_wins_with_the_fastest_assignment_and_reuses_its_model():
+    answer, candidates = _exhaustive()
+    solver = _instance()
+    assert solver.check_conditional_constraints(max_count=4, solvers={"z3": _sleeping_z3}, strategy="race",
+                                                get_model=True) == answer == z3.sat
+    assert sorted(map(str, candidates)) == sorted(map(str, solver.get_condition_var_assignment_model()))
+    winner = solver.get_assignment_ranking()[0]
+    assert winner["assignment"] == min(candidates, key=_cost) and winner["confidence"] == "measured"
+    model = solver.get_external_model()
+    x, y = z3.Ints("x y")
+    values = [(x, model[x]), (y, model[y])]
+    for constraint in (x + y == 10, x > 3, y > 4):
+        assert z3.is_true(z3.simplify(z3.substitute(constraint, *values)))
+    assert {str(var): z3.is_true(model[var]) for var in CONDITIONS} == solver.get_preferred_assignment()
+
+    # the winner goes first in the next race
+    solver.check_conditional_constraints(max_count=2, solvers={"z3": _sleeping_z3}, strategy="race")
+    assert solver.get_condition_var_assignment_model()[0] == winner["assignment"]
+
+
+def test_race_unsat_core_maps_back_to_conditions():
+    answer, _ = _exhaustive(unsat=True)
+    solver = _instance(unsat=True)
+    assert solver.check_conditional_constraints(max_count=4, solvers=SOLVERS, strategy="race",
+                                                get_unsat_core=True) == answer == z3.unsat
+    core = solver.get_external_unsat_core()
+    x, y = z3.Ints("x y")
+    assert any(expr.eq(x > 6) for expr in core) and any(expr.eq(y > 4) for expr in core)
+    cores = [core for core in solver.get_condition_unsat_cores() if core is not None]
+    assert len(cores) == 1 and all(any(condition.eq(var) for var in CONDITIONS) for condition in cores[0])
+
+
+def test_recording_records_the_answer_without_solving_again(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    checks = []
+    check = z3_wrapper.Solver.check
+    monkeypatch.setattr(z3_wrapper.Solver, "check", lambda self, *args: checks.append(self) or check(self, *args))
+    for unsat, expected in ((False, z3.sat), (True, z3.unsat)):
+        solver = _instance(unsat)
+        out = io.StringIO()
+        solver.start_recording(stream=out)
+        assert solver.check_conditional_constraints(max_count=3, solvers=SOLVERS, time_out=5) == expected
+        assert f"; Result: {expected}" in out.getvalue()
+    assert checks == []
+    assert list(tmp_path.iterdir()) == []
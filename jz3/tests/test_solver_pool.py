@@ -0,0 +1,54 @@
+"""
+The persistent solver processes of solver_pool, against fresh run_z3 processes.
+"""
+import os
+import signal
+
+from jz3.src import run_solvers, solver_pool
+from jz3.tests.test_run_solvers import requires_z3, SAT_QUERY, _pigeonhole
+
+pytestmark = requires_z3
+
+UNSAT_QUERY = "(declare-const x Int)\n(assert (> x 2))\n(assert (< x 1))\n(check-sat)\n"
+# declares x again with another sort, only possible when the previous query was reset
+BOOL_QUERY = "(declare-const x Bool)\n(assert (not x))\n(check-sat)\n"
+PUSH_POP_QUERY = ("(declare-const x Int)\n(push 1)\n(assert (< x 0))\n(assert (> x 0))\n(check-sat)\n(pop 1)\n"
+                  "(assert (= x 4))\n(check-sat)\n(exit)\n")
+
+
+def _pid(pool):
+    return pool._workers[0].process.pid
+
+
+def test_one_process_answers_every_query_after_a_reset():
+    with solver_pool.SolverProcessPool(solver_pool.z3_command(), name="z3") as pool:
+        assert pool.run(smt2_str=SAT_QUERY)[2] == "sat"
+        pid = _pid(pool)
+        assert pool.run(smt2_str=BOOL_QUERY)[2] == "sat"
+        assert pool.run(smt2_str=UNSAT_QUERY)[2] == "unsat"
+        assert pool.run(smt2_str=SAT_QUERY, get_model=True).model == {"x": "3", "y": "6"}
+        assert _pid(pool) == pid
+
+
+def test_pool_recovers_from_a_crash_and_a_time_out():
+    with solver_pool.SolverProcessPool(solver_pool.z3_command(), name="z3") as pool:
+        assert pool.run(smt2_str=SAT_QUERY)[2] == "sat"
+        crashed = _pid(pool)
+        os.kill(crashed, signal.SIGKILL)
+        pool._workers[0].process.wait()
+        assert pool.run(smt2_str=UNSAT_QUERY)[2] == "unsat"
+        assert _pid(pool) != crashed
+
+        assert pool.run(smt2_str=_pigeonhole(10), time_out=0.5)[1:] == (True, "timeout")
+        assert pool.run(smt2_str=BOOL_QUERY)[2] == "sat"
+
+
+def test_pooled_solvers_match_run_solvers():
+    with solver_pool.pooled_solvers(size=2, commands={"z3": solver_pool.z3_command()}) as pooled:
+        for query in (SAT_QUERY, UNSAT_QUERY, BOOL_QUERY, PUSH_POP_QUERY):
+            expected = run_solvers.run_solvers(smt2_str=query, solvers={"z3": run_solvers.run_z3},
+                                               per_check_sat=True)
+            results = run_solvers.run_solvers(smt2_str=query, solvers=pooled, per_check_sat=True, policy="benchmark")
+            assert results["z3"][1:] == expected["z3"][1:]
+            assert [answer for answer, _ in results["z3"].check_sats] == \
+                [answer for answer, _ in expected["z3"].check_sats]
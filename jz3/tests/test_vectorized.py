@@ -0,0 +1,55 @@
+"""
+The numpy evaluator against evaluate_assigned_value on random assignments.
+"""
+import random
+
+import numpy as np
+
+from jz3.src.SMTs.SMTs import BoolVal, Bool, Int, Not, And, Or, Eq, Implies, PbEq, PbLe, Distinct
+from jz3.src.SMTs.vectorized import compile_expression, satisfying_assignments
+
+NAMES = ["a", "b", "c", "d", "e"]
+
+
+def _random_expression(rng, depth):
+    if depth == 0 or rng.random() < 0.2:
+        return rng.choice([Bool(rng.choice(NAMES)), Bool(rng.choice(NAMES)), BoolVal(rng.random() < 0.5)])
+    kind = rng.randrange(7)
+    children = [_random_expression(rng, depth - 1) for _ in range(rng.randint(1, 4))]
+    if kind == 0:
+        return Not(children[0])
+    if kind == 1:
+        return And(*children)
+    if kind == 2:
+        return Or(*children)
+    if kind == 3:
+        return Implies(children[0], children[-1])
+    if kind == 4:
+        return Eq(children[0], children[-1])
+    weights = [(child, rng.randint(-2, 3)) for child in children]
+    return (PbEq if kind == 5 else PbLe)(weights, rng.randint(-1, 4))
+
+
+def test_evaluator_agrees_with_scalar_evaluation():
+    rng = random.Random(0)
+    values = np.random.default_rng(0).random((64, len(NAMES))) < 0.5
+    rows = [dict(zip(NAMES, map(bool, row))) for row in values]
+    for _ in range(200):
+        expression = _random_expression(rng, 4)
+        vectorized = compile_expression(expression, NAMES)(values)
+        assert list(vectorized) == [expression.evaluate_assigned_value(row) for row in rows], expression
+
+
+def test_integer_columns_and_distinct():
+    expression = And(Distinct(Int("x"), Int("y"), Int("z")), Not(Eq(Int("x"), 2)))
+    values = np.random.default_rng(1).integers(0, 4, size=(100, 3))
+    evaluator = compile_expression(expression)
+    assert evaluator.variables == ["x", "y", "z"]
+    expected = [expression.evaluate_assigned_value(dict(zip("xyz", map(int, row)))) for row in values]
+    assert list(evaluator(values)) == expected
+
+
+def test_satisfying_assignments_in_chunks():
+    expression = PbEq([(Bool(name), 1) for name in NAMES], 2)
+    found = satisfying_assignments(expression, NAMES, chunk_size=7)
+    assert list(found) == [bits for bits in range(1 << len(NAMES)) if bin(bits).count("1") == 2]
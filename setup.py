@@ -15,10 +15,16 @@ setup(
     install_requires=[
         'z3-solver',
         'matplotlib',
+        'numpy',
     ],
     package_data={
         'jz3': ['solvers/*']
     },
+    entry_points={
+        'console_scripts': [
+            'jz3-bench=jz3.src.bench:main',
+        ],
+    },
     python_requires='>3.11',
     classifiers=[
         'Development Status :: 3 - Alpha',